@@ -1,4 +1,5 @@
 import asyncio
+import copy
 import io
 import json
 import logging
@@ -18,8 +19,8 @@ from openai import AsyncStream
 from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
+from openai.types.completion_usage import CompletionUsage
 from PIL import Image
-from prisma import Json
 from prisma.models import documents, threads
 from pydantic import BaseModel, Field
 from weaviate.classes.query import Filter, MetadataQuery
@@ -39,6 +40,8 @@ from src.models.multiple_choice_widget import MultipleChoiceWidget
 from src.models.stream_tool_call import StreamToolCall
 from src.services.one_signal.one_signal_service import OneSignalService
 from src.utils.image_to_base64 import image_to_base64
+from src.utils.metrics import log_metric
+from src.utils.prompt_budget import PromptBudget
 from src.settings import settings
 
 TConfig = TypeVar("TConfig", bound=BaseModel)
@@ -61,6 +64,12 @@ class BaseAgent(Generic[TConfig]):
         self._raw_config = kwargs
         self.thread_id = thread_id
         self.request_headers = request_headers
+        self._tool_tasks: set[asyncio.Task] = set()
+        self._stored_metadata: dict = {}
+        self._dirty_metadata_keys: set[str] = set()
+
+        # Called with the token estimates of every prompt the agent assembles, see `record_prompt_budget`
+        self.on_prompt_budget: Callable[[PromptBudget], None] | None = None
 
         # Initialize the client
         self.client = openai_client
@@ -118,47 +127,118 @@ class BaseAgent(Generic[TConfig]):
     async def forward_message(
         self, messages: Iterable[ChatCompletionMessageParam], retry_count: int = 0
     ) -> AsyncGenerator[tuple[MessageContent, bool], None]:
-        result, tools = await self.on_message(messages, retry_count)
+        try:
+            result, tools = await self.on_message(messages, retry_count)
 
-        async for chunk, should_stop in (
-            self._handle_stream(result, tools, messages, retry_count)
-            if isinstance(result, AsyncStream)
-            else self._handle_completion(result, tools, messages, retry_count)
-        ):
-            yield chunk, should_stop
+            async for chunk, should_stop in (
+                self._handle_stream(result, tools, messages, retry_count)
+                if isinstance(result, AsyncStream)
+                else self._handle_completion(result, tools, messages, retry_count)
+            ):
+                yield chunk, should_stop
+        finally:
+            await self.flush_metadata()
 
     async def run_super_agent(
         self, messages: Iterable[ChatCompletionMessageParam]
     ) -> AsyncGenerator[tuple[MessageContent, bool], None]:
         self.logger.info(f"Running super agent for {self.thread_id}")
 
-        result = await self.on_super_agent_call(messages)
+        try:
+            result = await self.on_super_agent_call(messages)
 
-        if result is None:
-            return
+            if result is None:
+                return
 
-        result, tools = result
+            result, tools = result
 
-        async for chunk, should_stop in (
-            self._handle_stream(result, tools, messages)
-            if isinstance(result, AsyncStream)
-            else self._handle_completion(result, tools, messages)
-        ):
-            yield chunk, should_stop
+            async for chunk, should_stop in (
+                self._handle_stream(result, tools, messages)
+                if isinstance(result, AsyncStream)
+                else self._handle_completion(result, tools, messages)
+            ):
+                yield chunk, should_stop
+        finally:
+            await self.flush_metadata()
+
+    def record_prompt_budget(self, budget: PromptBudget) -> None:
+        """Emit the token estimates of a prompt that is about to be sent to the model."""
+
+        budget.log_metrics(agent=self.__class__.__name__)
+
+        if self.on_prompt_budget is not None:
+            self.on_prompt_budget(budget)
+
+    def record_usage(self, usage: CompletionUsage, model: str) -> None:
+        """Emit the token usage of a completion, including the prompt tokens that were served from the provider cache."""
+
+        cached_tokens = usage.prompt_tokens_details.cached_tokens if usage.prompt_tokens_details else None
+        tags = {"agent": self.__class__.__name__, "model": model}
+
+        log_metric("llm.prompt.tokens", usage.prompt_tokens, **tags)
+        log_metric("llm.prompt.cached_tokens", cached_tokens or 0, **tags)
+        log_metric("llm.completion.tokens", usage.completion_tokens, **tags)
+
+    def preload_thread(self, thread: threads) -> None:
+        """Seed the thread and metadata caches with a thread that was already fetched by the caller."""
+
+        self._thread = thread
+        self._set_stored_metadata(dict(thread.metadata) or {})
 
     async def get_metadata(self, key: str, default: Any | None = None) -> Any:
-        if self._metadata is None:
-            self._metadata = dict((await self._get_thread()).metadata) or {}
+        return (await self._get_metadata()).get(key, default)
+
+    async def get_scalar_metadata(self) -> dict:
+        """The metadata without its lists and objects, compact enough to put in a prompt."""
 
-        return self._metadata.get(key, default)
+        return {key: value for key, value in (await self._get_metadata()).items() if not isinstance(value, list | dict)}
 
     async def set_metadata(self, key: str, value: Any) -> None:
-        if self._metadata is None:
-            self._metadata = dict((await self._get_thread()).metadata) or {}
+        """Set a metadata key on the thread.
+
+        Changes are kept in memory and written by `flush_metadata`, which runs after every tool call and at the end
+        of the turn. Keys that end up with the value they already had in the database are not written at all.
+        """
+
+        (await self._get_metadata())[key] = value
+        self._dirty_metadata_keys.add(key)
+
+    async def flush_metadata(self) -> None:
+        """Write the changed metadata keys to the thread.
+
+        The changed keys are merged into the stored metadata with `||`, so keys written by another turn or by the
+        super agent in the meantime are left alone.
+        """
+
+        if self._metadata is None or not self._dirty_metadata_keys:
+            return
 
-        self._metadata[key] = value
+        changes = {
+            key: self._metadata[key]
+            for key in self._dirty_metadata_keys
+            if key not in self._stored_metadata or self._stored_metadata[key] != self._metadata[key]
+        }
+        self._dirty_metadata_keys = set()
 
-        await prisma.threads.update(where={"id": self.thread_id}, data={"metadata": Json(self._metadata)})
+        if not changes:
+            return
+
+        payload = json.dumps(changes)
+
+        try:
+            await prisma.execute_raw(
+                """
+                UPDATE threads SET metadata = metadata || $1::jsonb, updated_at = timezone('utc', now())
+                WHERE id = $2::uuid
+                """,
+                payload,
+                self.thread_id,
+            )
+        except Exception:
+            self._dirty_metadata_keys |= changes.keys()
+            raise
+
+        self._stored_metadata.update(json.loads(payload))
 
     async def get_document(self, document_path: str) -> dict:
         document = await prisma.documents.find_first_or_raise(where={"path": document_path})
@@ -192,6 +272,18 @@ class BaseAgent(Generic[TConfig]):
 
         return await prisma.documents.find_many(where={"file_name": {"in": filenames}})
 
+    async def _get_metadata(self) -> dict:
+        if self._metadata is None:
+            self._set_stored_metadata(dict((await self._get_thread()).metadata) or {})
+
+        return self._metadata
+
+    def _set_stored_metadata(self, metadata: dict) -> None:
+        # Tools mutate the lists and dicts they get from `get_metadata` in place, so we compare against a copy
+        self._metadata = metadata
+        self._stored_metadata = copy.deepcopy(metadata)
+        self._dirty_metadata_keys = set()
+
     async def _get_thread(self) -> threads:
         """Get the thread for the agent."""
 
@@ -219,6 +311,34 @@ class BaseAgent(Generic[TConfig]):
 
         return self._config_type(**kwargs)
 
+    async def _run_tool_call(
+        self, name: str, tool_call_id: str, arguments: dict[str, Any], tools: list[Callable]
+    ) -> tuple[ToolResultContent, bool]:
+        """Run a tool call as a tracked task, so it can be cancelled when the client goes away."""
+
+        task = asyncio.create_task(self._handle_tool_call(name, tool_call_id, arguments, tools))
+        self._tool_tasks.add(task)
+
+        try:
+            result = await task
+        finally:
+            self._tool_tasks.discard(task)
+
+        try:
+            await self.flush_metadata()
+        except Exception as e:
+            self.logger.warning(f"Could not write metadata after tool {name}, retrying at the end of the turn: {e}")
+
+        return result
+
+    def _cancel_tool_tasks(self) -> None:
+        for task in self._tool_tasks:
+            if not task.done():
+                self.logger.info(f"Cancelling tool task {task.get_name()}")
+                task.cancel()
+
+        self._tool_tasks.clear()
+
     async def _handle_tool_call(
         self, name: str, tool_call_id: str, arguments: dict[str, Any], tools: list[Callable]
     ) -> tuple[ToolResultContent, bool]:
@@ -353,6 +473,13 @@ class BaseAgent(Generic[TConfig]):
 
         try:
             async for event in stream:
+                if event.usage is not None:
+                    self.record_usage(event.usage, event.model)
+
+                # With usage reporting on, the last chunk carries only the usage and no choices
+                if not event.choices:
+                    continue
+
                 if event.choices[0].delta.content is not None:
                     text_content = (
                         event.choices[0].delta.content
@@ -416,7 +543,7 @@ class BaseAgent(Generic[TConfig]):
                     False,
                 )
 
-                yield await self._handle_tool_call(tool_call.name, tool_call.tool_call_id, input_data, tools)
+                yield await self._run_tool_call(tool_call.name, tool_call.tool_call_id, input_data, tools)
 
             did_produce_content = len(final_tool_calls.items()) > 0 or (text_content and text_content.strip() != "")
 
@@ -427,6 +554,12 @@ class BaseAgent(Generic[TConfig]):
                     yield chunk
             elif not did_produce_content:
                 raise ValueError("The agent did not produce any content after 3 retries.")
+        except (asyncio.CancelledError, GeneratorExit):
+            self.logger.warning("Stream handling was interrupted, closing the model stream and cancelling tools")
+
+            self._cancel_tool_tasks()
+            await stream.close()
+            raise
         except Exception as e:
             self.logger.error(f"Error in _handle_stream: {e}")
             raise e
@@ -438,6 +571,9 @@ class BaseAgent(Generic[TConfig]):
         messages: Iterable[ChatCompletionMessageParam],
         retry_count: int = 0,
     ) -> AsyncGenerator[tuple[MessageContent, bool], None]:
+        if completion.usage is not None:
+            self.record_usage(completion.usage, completion.model)
+
         if len(completion.choices or []) == 0:
             raise ValueError(
                 "No choices found in completion, this usually means the messages weren't forwarded correctly"
@@ -473,7 +609,7 @@ class BaseAgent(Generic[TConfig]):
                 False,
             )
 
-            yield await self._handle_tool_call(tool_call.function.name, tool_call.id, input_data, tools)
+            yield await self._run_tool_call(tool_call.function.name, tool_call.id, input_data, tools)
 
         did_produce_content = len(choice.message.tool_calls or []) > 0 or (
             choice.message.content and choice.message.content.strip() != ""
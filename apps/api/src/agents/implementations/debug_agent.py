@@ -1,9 +1,7 @@
 import json
 import re
-import uuid
 from collections.abc import Callable, Iterable
 from datetime import datetime
-from typing import Any
 
 import pytz
 from onesignal.model.notification import Notification
@@ -14,10 +12,13 @@ from openai.types.chat.chat_completion_message_param import ChatCompletionMessag
 from pydantic import BaseModel, Field
 from src.agents.base_agent import BaseAgent, SuperAgentConfig
 from src.agents.tools.base_tools import BaseTools
-from src.lib.prisma import prisma
 from src.models.multiple_choice_widget import Choice, MultipleChoiceWidget
+from src.services.super_agent.due_items import DEFAULT_TIMEZONE, get_due_recurring_tasks, get_due_reminders
+from src.services.super_agent.reminder_scheduler import ReminderScheduler
+from src.services.thread_items.thread_items_service import ThreadItemsService
 from src.settings import settings
 from src.utils.function_to_openai_tool import function_to_openai_tool
+from src.utils.prompt_template import render_template
 
 onesignal_api_key = settings.ONESIGNAL_APPERTO_API_KEY
 class QuestionaireQuestionConfig(BaseModel):
@@ -97,29 +98,6 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             settings.ONESIGNAL_APPERTO_APP_ID,
         )
 
-    def _substitute_double_curly_placeholders(
-        self, template_string: str, data_dict: dict[str, Any]
-    ) -> str:
-        """Substitutes {{placeholder}} style placeholders in a string with values from data_dict."""
-
-        # First, replace all known placeholders
-        output_string = template_string
-        for key, value in data_dict.items():
-            placeholder = "{{" + key + "}}"
-            output_string = output_string.replace(placeholder, str(value))
-
-        # Then, find any remaining {{...}} placeholders that were not in data_dict
-        # and replace them with a [missing:key_name] indicator.
-        # This mimics the DefaultKeyDict behavior for unprovided keys.
-        def replace_missing_with_indicator(match: re.Match[str]) -> str:
-            var_name = match.group(1)  # Content inside {{...}}
-            return f"[missing:{var_name}]"
-
-        output_string = re.sub(
-            r"\{\{([^}]+)\}\}", replace_missing_with_indicator, output_string
-        )
-        return output_string
-
     async def get_current_role(self) -> RoleConfig:
         role = await self.get_metadata("current_role", self.config.roles[0].name)
         if role not in [role.name for role in self.config.roles]:
@@ -261,19 +239,9 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
                 task (str): The task to set the schedule for.
             """
 
-            existing_tasks: list[dict[str, str]] = await self.get_metadata(
-                "recurring_tasks", []
-            )
+            recurring_task = await ThreadItemsService.add_recurring_task(self.thread_id, cron_expression, task)
 
-            existing_tasks.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "cron_expression": cron_expression,
-                    "task": task,
-                }
-            )
-
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            ReminderScheduler.schedule_recurring_task(self.__class__, self.thread_id, recurring_task)
 
             return f"Schedule set for {task} with cron expression {cron_expression}"
 
@@ -285,19 +253,9 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
                 message (str): The message to remind the user about.
             """
 
-            existing_reminders: list[dict[str, str]] = await self.get_metadata(
-                "reminders", []
-            )
+            reminder = await ThreadItemsService.add_reminder(self.thread_id, date, message)
 
-            existing_reminders.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "date": date,
-                    "message": message,
-                }
-            )
-
-            await self.set_metadata("reminders", existing_reminders)
+            ReminderScheduler.schedule_reminder(self.__class__, self.thread_id, reminder)
 
             return f"Reminder added for {message} at {date}"
 
@@ -307,13 +265,10 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             Args:
                 id (str): The ID of the task to remove.
             """
-            existing_tasks: list[dict[str, str]] = await self.get_metadata(
-                "recurring_tasks", []
-            )
 
-            existing_tasks = [task for task in existing_tasks if task["id"] != id]
+            await ThreadItemsService.remove_recurring_task(self.thread_id, id)
 
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            ReminderScheduler.unschedule(ReminderScheduler.recurring_task_job_id(self.thread_id, id))
 
             return f"Recurring task {id} removed"
 
@@ -323,15 +278,10 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             Args:
                 id (str): The ID of the reminder to remove.
             """
-            existing_reminders: list[dict[str, str]] = await self.get_metadata(
-                "reminders", []
-            )
 
-            existing_reminders = [
-                reminder for reminder in existing_reminders if reminder["id"] != id
-            ]
+            await ThreadItemsService.remove_reminder(self.thread_id, id)
 
-            await self.set_metadata("reminders", existing_reminders)
+            ReminderScheduler.unschedule(ReminderScheduler.reminder_job_id(self.thread_id, id))
 
             return f"Reminder {id} removed"
 
@@ -342,9 +292,7 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
                 memory (str): The memory to store.
             """
 
-            memories = await self.get_metadata("memories", [])
-            memories.append({"id": str(uuid.uuid4())[0:8], "memory": memory})
-            await self.set_metadata("memories", memories)
+            await ThreadItemsService.add_memory(self.thread_id, memory)
 
             return f"Memory stored: {memory}"
 
@@ -354,8 +302,9 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             Args:
                 key (str): The key of the memory to get.
             """
-            memories = await self.get_metadata("memories", [])
-            memory = next((m for m in memories if m["id"] == id), None)
+
+            memory = await ThreadItemsService.get_memory(self.thread_id, id)
+
             if memory is None:
                 return "[not stored]"
 
@@ -398,18 +347,10 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             response = await self.one_signal.send_notification(notification)
             self.logger.info(f"Notification response: {response}")
 
-            notifications = await self.get_metadata("notifications", [])
-            notifications.append(
-                {
-                    "id": response["id"],
-                    "title": title,
-                    "contents": contents,
-                    "sent_at": datetime.now().isoformat(),
-                }
+            await ThreadItemsService.add_notification(
+                self.thread_id, response["id"], onesignal_id, title, contents
             )
 
-            await self.set_metadata("notifications", notifications)
-
             return "Notification sent"
 
         return {
@@ -468,14 +409,12 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             )
             questionnaire_format_kwargs[f"questionaire_{q_item.name}_answer"] = answer
 
-        formatted_current_role_prompt = self._substitute_double_curly_placeholders(
-            role_config.prompt, questionnaire_format_kwargs
-        )
+        formatted_current_role_prompt = render_template(role_config.prompt, questionnaire_format_kwargs)
 
-        reminders = await self.get_metadata("reminders", [])
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
-        memories = await self.get_metadata("memories", [])
-        notifications = await self.get_metadata("notifications", [])
+        reminders = await ThreadItemsService.get_reminders(self.thread_id)
+        recurring_tasks = await ThreadItemsService.get_recurring_tasks(self.thread_id)
+        memories = await ThreadItemsService.get_memories(self.thread_id)
+        notifications = await ThreadItemsService.get_notifications(self.thread_id)
 
         # Prepare the main content for the LLM
         main_prompt_format_args = {
@@ -519,9 +458,7 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             "metadata": json.dumps((await self._get_thread()).metadata),
         }
 
-        formatted_prompt = self._substitute_double_curly_placeholders(
-            self.config.prompt, main_prompt_format_args
-        )
+        formatted_prompt = render_template(self.config.prompt, main_prompt_format_args)
 
         self.logger.debug(f"formatted_prompt: {formatted_prompt}")
 
@@ -559,69 +496,43 @@ class DebugAgent(BaseAgent[DebugAgentConfig]):
             self.logger.info("No onesignal id found, skipping super agent call")
             return
 
-        last_thread = await prisma.threads.query_first(
-            """
-        SELECT * FROM threads
-        WHERE metadata->>'onesignal_id' = $1
-        ORDER BY created_at DESC
-        LIMIT 1
-        """,
-            onesignal_id,
-        )
-
-        if last_thread is None:
-            self.logger.info("No last thread found, skipping super agent call")
-            return
-
-        if last_thread.id != self.thread_id:
-            self.logger.info(
-                "Last thread id does not match current thread id, skipping super agent call"
-            )
-            return
-
         tools = [
             BaseTools.tool_noop,
             self.get_tools()["tool_send_notification"],
         ]
 
-        notifications = await self.get_metadata("notifications", [])
-        reminders = await self.get_metadata("reminders", [])
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
+        notifications = await ThreadItemsService.get_notifications(self.thread_id, limit=1, newest_first=True)
+        now = datetime.now(DEFAULT_TIMEZONE)
+
+        # Work out what is due up front, so we only call the model when there is something to send
+        due_reminders = get_due_reminders(await ThreadItemsService.get_reminders(self.thread_id), notifications, now)
+        due_recurring_tasks = get_due_recurring_tasks(
+            await ThreadItemsService.get_recurring_tasks(self.thread_id), notifications, now
+        )
+
+        if not due_reminders and not due_recurring_tasks:
+            self.logger.info("No reminders or recurring tasks are due, skipping super agent call")
+            return
 
         prompt = f"""
 # Notification Management System
 
 ## Core Responsibility
-You are the notification management system responsible for delivering timely alerts without duplication. Your task is to analyze pending notifications and determine which ones need to be sent.
+You are the notification management system responsible for delivering timely alerts. The reminders and recurring tasks below are due now and the user has not been notified about them yet.
 
 ## Current Time
-Current system time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-## Previously Sent Notifications
-The following notifications have already been sent and MUST NOT be resent:
-{json.dumps(notifications, indent=2)}
-
-## Items to Evaluate
-Please evaluate these items for notification eligibility:
+Current system time: {now.strftime("%Y-%m-%d %H:%M:%S")}
 
+## Due Items
 1. Reminders:
-{json.dumps(reminders, indent=2)}
+{json.dumps(due_reminders, indent=2)}
 
 2. Recurring Tasks:
-{json.dumps(recurring_tasks, indent=2)}
-
-## Decision Rules
-- A notification should be sent for any reminder that is currently due
-- For recurring tasks, evaluate the cron expression to determine if it should be triggered at the current time
-- If a cron expression indicates the task is due now and hasn't already been sent today, send a notification
-- If an item appears in the previously sent notifications list, it MUST be skipped
-- Parse cron expressions carefully to determine exact scheduling (minute, hour, day of month, month, day of week)
-- The date attribute of the reminders in the reminders list is the due date. If that date is before the current date, the reminder is due.
+{json.dumps(due_recurring_tasks, indent=2)}
 
 ## Required Action
-After analysis, you must take exactly ONE of these actions:
-- If any eligible notifications are found: invoke the send_notification tool with details
-- If no eligible notifications exist: invoke the noop tool
+- Invoke the send_notification tool once, with a title and text that cover all due items
+- Only invoke the noop tool if none of the items should be sent to the user as a notification
 """
 
         self.logger.info(f"Calling super agent with prompt: {prompt}")
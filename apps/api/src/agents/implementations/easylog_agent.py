@@ -1,9 +1,8 @@
 import io
 import json
 import re
-import uuid
 from collections.abc import Callable, Iterable
-from datetime import datetime, time
+from datetime import datetime
 from typing import Any, Literal
 
 import httpx
@@ -14,8 +13,7 @@ from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 from PIL import Image, ImageOps
-from prisma.enums import health_data_point_type
-from prisma.types import health_data_pointsWhereInput, usersWhereInput
+from prisma.types import usersWhereInput
 from pydantic import BaseModel, Field
 
 from src.agents.base_agent import BaseAgent, SuperAgentConfig
@@ -28,8 +26,17 @@ from src.models.chart_widget import (
     Line,
 )
 from src.models.multiple_choice_widget import Choice, MultipleChoiceWidget
+from src.services.steps.steps_service import StepsService
+from src.services.super_agent.due_items import DEFAULT_TIMEZONE, get_due_recurring_tasks, get_due_reminders
+from src.services.super_agent.reminder_scheduler import ReminderScheduler
+from src.services.thread_items.thread_items_service import ThreadItemsService
 from src.settings import settings
 from src.utils.function_to_openai_tool import function_to_openai_tool
+from src.utils.memory_selection import format_memories, last_user_message_text, select_memories
+from src.utils.prompt_budget import PromptBudget
+from src.utils.prompt_cache import format_volatile_suffix, split_volatile_sections, system_message
+from src.utils.prompt_template import render_template
+from src.utils.tool_router import route_tools
 
 onesignal_api_key = settings.ONESIGNAL_APPERTO_API_KEY
 
@@ -76,6 +83,10 @@ class RoleConfig(BaseModel):
         default=".*",
         description="A regular expression specifying which tools this role is permitted to use. Use '.*' to allow all tools, or restrict as needed.",
     )
+    loaded_tools_regex: str | None = Field(
+        default=None,
+        description="A regular expression specifying which of the permitted tools are sent with every request of this role. The core tools are always sent, the other tools are loaded on demand with tool_load_tools. If None, all permitted tools are sent.",
+    )
     allowed_subjects: list[str] | None = Field(
         default=None,
         description="A list of subject names from the knowledge base that this role is allowed to access. If None, all subjects are allowed.",
@@ -643,17 +654,9 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
                 task (str): The task to set the schedule for.
             """
 
-            existing_tasks: list[dict[str, str]] = await self.get_metadata("recurring_tasks", [])
-
-            existing_tasks.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "cron_expression": cron_expression,
-                    "task": task,
-                }
-            )
+            recurring_task = await ThreadItemsService.add_recurring_task(self.thread_id, cron_expression, task)
 
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            ReminderScheduler.schedule_recurring_task(self.__class__, self.thread_id, recurring_task)
 
             return f"Schedule set for {task} with cron expression {cron_expression}"
 
@@ -665,17 +668,9 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
                 message (str): The message to remind the user about.
             """
 
-            existing_reminders: list[dict[str, str]] = await self.get_metadata("reminders", [])
+            reminder = await ThreadItemsService.add_reminder(self.thread_id, date, message)
 
-            existing_reminders.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "date": date,
-                    "message": message,
-                }
-            )
-
-            await self.set_metadata("reminders", existing_reminders)
+            ReminderScheduler.schedule_reminder(self.__class__, self.thread_id, reminder)
 
             return f"Reminder added for {message} at {date}"
 
@@ -685,11 +680,10 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             Args:
                 id (str): The ID of the task to remove.
             """
-            existing_tasks: list[dict[str, str]] = await self.get_metadata("recurring_tasks", [])
 
-            existing_tasks = [task for task in existing_tasks if task["id"] != id]
+            await ThreadItemsService.remove_recurring_task(self.thread_id, id)
 
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            ReminderScheduler.unschedule(ReminderScheduler.recurring_task_job_id(self.thread_id, id))
 
             return f"Recurring task {id} removed"
 
@@ -699,11 +693,10 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             Args:
                 id (str): The ID of the reminder to remove.
             """
-            existing_reminders: list[dict[str, str]] = await self.get_metadata("reminders", [])
 
-            existing_reminders = [reminder for reminder in existing_reminders if reminder["id"] != id]
+            await ThreadItemsService.remove_reminder(self.thread_id, id)
 
-            await self.set_metadata("reminders", existing_reminders)
+            ReminderScheduler.unschedule(ReminderScheduler.reminder_job_id(self.thread_id, id))
 
             return f"Reminder {id} removed"
 
@@ -715,9 +708,7 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
                 memory (str): The memory to store.
             """
 
-            memories = await self.get_metadata("memories", [])
-            memories.append({"id": str(uuid.uuid4())[0:8], "memory": memory})
-            await self.set_metadata("memories", memories)
+            await ThreadItemsService.add_memory(self.thread_id, memory)
 
             return f"Memory stored: {memory}"
 
@@ -727,8 +718,9 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             Args:
                 id (str): The id of the memory to get.
             """
-            memories = await self.get_metadata("memories", [])
-            memory = next((m for m in memories if m["id"] == id), None)
+
+            memory = await ThreadItemsService.get_memory(self.thread_id, id)
+
             if memory is None:
                 return "[not stored]"
 
@@ -772,18 +764,10 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             response = await self.one_signal.send_notification(notification)
             self.logger.info(f"Notification response: {response}")
 
-            notifications = await self.get_metadata("notifications", [])
-            notifications.append(
-                {
-                    "id": response["id"],
-                    "title": title,
-                    "contents": contents,
-                    "sent_at": datetime.now().isoformat(),
-                }
+            await ThreadItemsService.add_notification(
+                self.thread_id, response["id"], onesignal_id, title, contents
             )
 
-            await self.set_metadata("notifications", notifications)
-
             return "Notification sent"
 
         async def tool_get_steps_data(
@@ -797,17 +781,20 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             Parameters
             ----------
             date_from, date_to : str | datetime
-                Inclusive ISO-8601 strings **or** ``datetime`` objects that define the
-                query window in the *local* timezone (see ``timezone``).
+                ISO-8601 strings **or** ``datetime`` objects that define the query
+                window in the *local* timezone (see ``timezone``). A data point counts
+                when it *starts* within the window, both ends included, so a range
+                over two days gives the same total as the two daily totals.
 
             timezone : str | None, default ``"Europe/Amsterdam"``
-                IANA timezone name used to interpret naïve datetimes **and** for the
-                timestamps returned by this tool.
+                IANA timezone name used to interpret naïve datetimes, to align the
+                buckets to local time **and** for the timestamps returned by this tool.
 
-            aggregation : {"quarter", "hour", "day", None}, default ``day``
+            aggregation : {"quarter", "hour", "day", "none", None}, default ``day``
                 • ``"quarter"`` → 15-minute buckets
                 • ``"hour"``     → hourly totals
                 • ``"day"``      → daily totals
+                • ``"none"``     → the raw data points
                 • ``None``/empty → **defaults to daily** (same as ``"day"``)
 
             The granularity increases from *quarter* (smallest) → *hour* → *day*.
@@ -822,77 +809,10 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
 
             Notes
             -----
-            • The result set is limited to **max 300 rows** to protect the UI and
-              network usage. If the database returns more rows, only the first 300
-              (ordered chronologically) are returned.
+            • The result set is limited to **max 300 rows** (buckets, or data points
+              in raw mode), ordered chronologically, to protect the UI and network usage.
             """
 
-            from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-
-            # ------------------------------------------------------------------ #
-            # 0. Normalise / validate aggregation parameter                     #
-            # ------------------------------------------------------------------ #
-            agg_raw = (aggregation or "").strip().lower()
-
-            if agg_raw in {"", "none"}:
-                aggregation_normalised = "day"
-            elif agg_raw in {"hour", "hourly"}:
-                aggregation_normalised = "hour"
-            elif agg_raw in {"day", "daily"}:
-                aggregation_normalised = "day"
-            elif agg_raw in {"quarter", "quarterly", "q", "15m", "15min", "15"}:
-                aggregation_normalised = "quarter"
-            else:
-                raise ValueError("Invalid aggregation value. Use one of: 'quarter', 'hour', 'day', or None/empty.")
-
-            aggregation = aggregation_normalised  # overwrite with canonical value
-
-            # ------------------------------------------------------------------ #
-            # 1. Resolve / validate timezone                                     #
-            # ------------------------------------------------------------------ #
-            tz_name = (timezone or "Europe/Amsterdam").strip()
-            if tz_name in {"CET", "CEST"}:
-                tz_name = "Europe/Amsterdam"
-
-            try:
-                tz = ZoneInfo(tz_name)
-            except ZoneInfoNotFoundError as exc:
-                raise ValueError(f"Invalid timezone '{timezone}'. Please provide a valid IANA name.") from exc
-
-            UTC = ZoneInfo("UTC")  # single UTC instance for reuse
-
-            # ------------------------------------------------------------------ #
-            # 2. Parse inputs → timezone-aware datetimes                         #
-            # ------------------------------------------------------------------ #
-            def _parse_input(val: str | datetime) -> datetime:
-                """ISO string → datetime; naïve → attach local tz."""
-                dt_obj = datetime.fromisoformat(val) if isinstance(val, str) else val
-                if dt_obj.tzinfo is None:  # treat naïve as local
-                    dt_obj = dt_obj.replace(tzinfo=tz)
-                return dt_obj
-
-            date_from_dt = _parse_input(date_from)
-            date_to_dt = _parse_input(date_to)
-
-            extra = ""
-            if date_from_dt.year < datetime.now().year:
-                raise ValueError("Date from is in the past")
-
-            # Expand “whole-day” range (00:00 → 23:59:59.999999)
-            if (
-                date_from_dt.date() == date_to_dt.date()
-                and date_from_dt.timetz() == time(0, tzinfo=tz)
-                and date_to_dt.timetz() == time(0, tzinfo=tz)
-            ):
-                date_to_dt = date_to_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-            # Convert to **UTC** for querying
-            date_from_utc = date_from_dt.astimezone(UTC)
-            date_to_utc = date_to_dt.astimezone(UTC)
-
-            # ------------------------------------------------------------------ #
-            # 3. Fetch user id                                                   #
-            # ------------------------------------------------------------------ #
             external_user_id = self.request_headers.get("x-onesignal-external-user-id")
             if external_user_id is None:
                 raise ValueError("User ID not provided and not found in agent context.")
@@ -901,94 +821,7 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             if user is None:
                 raise ValueError("User not found")
 
-            # ------------------------------------------------------------------ #
-            # 4. Retrieve raw datapoints                                         #
-            # ------------------------------------------------------------------ #
-            steps_data = await prisma.health_data_points.find_many(
-                where=health_data_pointsWhereInput(
-                    user_id=user.id,
-                    type=health_data_point_type.steps,
-                    date_from={"gte": date_from_utc},
-                    date_to={"lte": date_to_utc},
-                ),
-                order={"created_at": "asc"},
-                take=300,
-            )
-            if not steps_data:
-                return []
-
-            # ------------------------------------------------------------------ #
-            # 5. Helper: convert any str/naïve dt → ISO in *local* timezone      #
-            # ------------------------------------------------------------------ #
-            def _iso_local(val: str | datetime) -> str:
-                dt_obj = datetime.fromisoformat(val) if isinstance(val, str) else val
-                if dt_obj.tzinfo is None:  # DB can return naïve UTC
-                    dt_obj = dt_obj.replace(tzinfo=UTC)
-                return dt_obj.astimezone(tz).isoformat()
-
-            # ------------------------------------------------------------------ #
-            # 6. Aggregation                                                     #
-            # ------------------------------------------------------------------ #
-            if aggregation in {"hour", "day"}:
-                rows: list[dict[str, Any]] = await prisma.query_raw(
-                    f"""
-                    SELECT
-                        date_trunc('{aggregation}', date_from AT TIME ZONE 'UTC') AS bucket,
-                        SUM(value)::int                                          AS total
-                    FROM   health_data_points
-                    WHERE  user_id  = $1::uuid
-                    AND  type     = 'steps'
-                    AND  date_from >= $2::timestamptz
-                    AND  date_to   <= $3::timestamptz
-                    GROUP  BY bucket
-                    ORDER  BY bucket
-                    LIMIT 300
-                    """,
-                    user.id,
-                    date_from_utc,
-                    date_to_utc,
-                )
-
-                return [
-                    {
-                        "created_at": _iso_local(row["bucket"]),
-                        "value": row["total"],
-                    }
-                    for row in rows
-                ]
-
-            # ------------------------------------------------------------------ #
-            # 6b. Quarter-hour aggregation                                       #
-            # ------------------------------------------------------------------ #
-            if aggregation == "quarter":
-                from collections import defaultdict
-
-                bucket_totals: dict[str, int] = defaultdict(int)
-
-                for dp in steps_data:
-                    start_dt = _parse_input(dp.date_from)
-                    local_dt = start_dt.astimezone(tz)
-                    floored_minute = (local_dt.minute // 15) * 15
-                    bucket_dt = local_dt.replace(minute=floored_minute, second=0, microsecond=0)
-                    bucket_key = bucket_dt.isoformat()
-                    bucket_totals[bucket_key] += dp.value
-
-                sorted_rows = sorted(bucket_totals.items())[:300]
-
-                return [{"created_at": key, "value": total} for key, total in sorted_rows]
-
-            # ------------------------------------------------------------------ #
-            # 7. Raw datapoints                                                  #
-            # ------------------------------------------------------------------ #
-            return [
-                {
-                    "created_at": _iso_local(dp.created_at),
-                    "date_from": _iso_local(dp.date_from),
-                    "date_to": _iso_local(dp.date_to),
-                    "value": dp.value,
-                }
-                for dp in steps_data
-            ]
+            return await StepsService.get_steps(user.id, date_from, date_to, timezone, aggregation)
 
         # Assemble and return the complete tool list
         tools_list = [
@@ -1028,25 +861,6 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
         ]
         return {tool.__name__: tool for tool in tools_list}
 
-    def _substitute_double_curly_placeholders(self, template_string: str, data_dict: dict[str, Any]) -> str:
-        """Substitutes {{placeholder}} style placeholders in a string with values from data_dict."""
-
-        # First, replace all known placeholders
-        output_string = template_string
-        for key, value in data_dict.items():
-            placeholder = "{{" + key + "}}"
-            output_string = output_string.replace(placeholder, str(value))
-
-        # Then, find any remaining {{...}} placeholders that were not in data_dict
-        # and replace them with a [missing:key_name] indicator.
-        # This mimics the DefaultKeyDict behavior for unprovided keys.
-        def replace_missing_with_indicator(match: re.Match[str]) -> str:
-            var_name = match.group(1)  # Content inside {{...}}
-            return f"[missing:{var_name}]"
-
-        output_string = re.sub(r"\{\{([^}]+)\}\}", replace_missing_with_indicator, output_string)
-        return output_string
-
     async def on_message(
         self, messages: Iterable[ChatCompletionMessageParam], _: int = 0
     ) -> tuple[AsyncStream[ChatCompletionChunk] | ChatCompletion, list[Callable]]:
@@ -1076,49 +890,59 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
 
         # Format the role prompt with questionnaire data
         try:
-            formatted_current_role_prompt = self._substitute_double_curly_placeholders(
-                role_config.prompt, questionnaire_format_kwargs
-            )
+            formatted_current_role_prompt = render_template(role_config.prompt, questionnaire_format_kwargs)
         except Exception as e:
             self.logger.warning(f"Error formatting role prompt: {e}")
             formatted_current_role_prompt = role_config.prompt
 
         # Gather reminders and recurring tasks
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
-        reminders = await self.get_metadata("reminders", [])
-        memories = await self.get_metadata("memories", [])
-        notifications = await self.get_metadata("notifications", [])
+        recurring_tasks = await ThreadItemsService.get_recurring_tasks(self.thread_id)
+        reminders = await ThreadItemsService.get_reminders(self.thread_id)
+
+        # Only the memories that matter for this message go into the prompt, within a fixed token budget
+        memories = await ThreadItemsService.get_memories(self.thread_id)
+        relevant_memories = select_memories(
+            memories,
+            last_user_message_text(messages),
+            settings.PROMPT_MEMORIES_MAX_ITEMS,
+            settings.PROMPT_MEMORIES_TOKEN_BUDGET,
+        )
+        recent_notifications = await ThreadItemsService.get_notifications(
+            self.thread_id, limit=settings.PROMPT_NOTIFICATIONS_MAX_ITEMS, newest_first=True
+        )
+        notifications = list(reversed(recent_notifications))
 
         # Prepare the main content for the LLM
-        main_prompt_format_args = {
-            "current_role": role_config.name,
-            "current_role_prompt": formatted_current_role_prompt,
-            "available_roles": "\n".join([f"- {role.name}" for role in self.config.roles]),
-            "current_time": datetime.now(pytz.timezone("Europe/Amsterdam")).strftime("%Y-%m-%d %H:%M:%S"),
-            "recurring_tasks": "\n".join(
-                [f"- {task['id']}: {task['cron_expression']} - {task['task']}" for task in recurring_tasks]
-            )
-            if recurring_tasks
-            else "<no recurring tasks>",
-            "reminders": "\n".join(
-                [f"- {reminder['id']}: {reminder['date']} - {reminder['message']}" for reminder in reminders]
-            )
-            if reminders
-            else "<no reminders>",
-            "memories": "\n".join([f"- {memory['id']}: {memory['memory']}" for memory in memories])
-            if memories
-            else "<no memories>",
-            "notifications": "\n".join(
-                [
-                    f"{notification.get('id')}: {notification.get('contents')} at {notification.get('sent_at')}"
-                    for notification in notifications
-                ]
-            )
-            if notifications
-            else "<no notifications>",
-            "metadata": json.dumps((await self._get_thread()).metadata),
-        }
-        main_prompt_format_args.update(questionnaire_format_kwargs)
+        budget = PromptBudget(settings.PROMPT_SECTION_TOKEN_CAPS)
+        main_prompt_format_args = budget.sections_from(
+            {
+                "current_role": role_config.name,
+                "current_role_prompt": formatted_current_role_prompt,
+                "available_roles": "\n".join([f"- {role.name}" for role in self.config.roles]),
+                "current_time": datetime.now(pytz.timezone("Europe/Amsterdam")).strftime("%Y-%m-%d %H:%M:%S"),
+                "recurring_tasks": "\n".join(
+                    [f"- {task['id']}: {task['cron_expression']} - {task['task']}" for task in recurring_tasks]
+                )
+                if recurring_tasks
+                else "<no recurring tasks>",
+                "reminders": "\n".join(
+                    [f"- {reminder['id']}: {reminder['date']} - {reminder['message']}" for reminder in reminders]
+                )
+                if reminders
+                else "<no reminders>",
+                "memories": format_memories(relevant_memories, len(memories)),
+                "notifications": "\n".join(
+                    [
+                        f"{notification.get('id')}: {notification.get('contents')} at {notification.get('sent_at')}"
+                        for notification in notifications
+                    ]
+                )
+                if notifications
+                else "<no notifications>",
+                "metadata": json.dumps(await self.get_scalar_metadata(), ensure_ascii=False),
+            }
+        )
+        main_prompt_format_args.update(budget.sections_from(questionnaire_format_kwargs, group="questionnaire"))
 
         # Store session metadata from headers
         onesignal_id = self.request_headers.get("x-onesignal-external-user-id")
@@ -1130,34 +954,43 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
         if assistant_field_name is not None:
             await self.set_metadata("assistant_field_name", assistant_field_name)
 
+        # The values that change every turn go after the static instructions, so the provider can cache the prefix
+        stable_format_args, volatile_format_args = split_volatile_sections(main_prompt_format_args)
+
         try:
-            llm_content = self._substitute_double_curly_placeholders(self.config.prompt, main_prompt_format_args)
+            system_prompt_prefix = render_template(self.config.prompt, stable_format_args)
         except Exception as e:
             self.logger.warning(f"Error formatting system prompt: {e}")
-            llm_content = f"Role: {role_config.name}\nPrompt: {formatted_current_role_prompt}"
+            system_prompt_prefix = f"Role: {role_config.name}\nPrompt: {formatted_current_role_prompt}"
+
+        system_prompt_suffix = format_volatile_suffix(system_prompt_prefix, volatile_format_args)
+
+        budget.system_prompt(f"{system_prompt_prefix}\n\n{system_prompt_suffix}")
+        # The schemas only depend on the role so they stay cached, the other tools can be loaded on demand
+        routed_tools, callable_tools = route_tools(tools_values, role_config.loaded_tools_regex)
+        tool_schemas = budget.tool_schemas(function_to_openai_tool(tool) for tool in routed_tools)
+        self.record_prompt_budget(budget)
 
         # Create the completion request
         response = await self.client.chat.completions.create(
             model=role_config.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": llm_content,
-                },
+                system_message(system_prompt_prefix, system_prompt_suffix, role_config.model),
                 *messages,
             ],
             stream=True,
+            stream_options={"include_usage": True},
             extra_body={
                 "reasoning": {
                     "enabled": role_config.reasoning.enabled,
                     "effort": role_config.reasoning.effort,
                 }
             },
-            tools=[function_to_openai_tool(tool) for tool in tools_values],
+            tools=tool_schemas,
             tool_choice="auto",
         )
 
-        return response, list(tools_values)
+        return response, callable_tools
 
     @staticmethod
     def super_agent_config() -> SuperAgentConfig[EasyLogAgentConfig] | None:
@@ -1175,67 +1008,43 @@ class EasyLogAgent(BaseAgent[EasyLogAgentConfig]):
             self.logger.info("No onesignal id found, skipping super agent call")
             return
 
-        last_thread = await prisma.threads.query_first(
-            """
-        SELECT * FROM threads
-        WHERE metadata->>'onesignal_id' = $1
-        ORDER BY created_at DESC
-        LIMIT 1
-        """,
-            onesignal_id,
-        )
-
-        if last_thread is None:
-            self.logger.info("No last thread found, skipping super agent call")
-            return
-
-        if last_thread.id != self.thread_id:
-            self.logger.info("Last thread id does not match current thread id, skipping super agent call")
-            return
-
         tools = [
             BaseTools.tool_noop,
             self.get_tools()["tool_send_notification"],
         ]
 
-        notifications = await self.get_metadata("notifications", [])
-        reminders = await self.get_metadata("reminders", [])
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
+        notifications = await ThreadItemsService.get_notifications(self.thread_id, limit=1, newest_first=True)
+        now = datetime.now(DEFAULT_TIMEZONE)
+
+        # Work out what is due up front, so we only call the model when there is something to send
+        due_reminders = get_due_reminders(await ThreadItemsService.get_reminders(self.thread_id), notifications, now)
+        due_recurring_tasks = get_due_recurring_tasks(
+            await ThreadItemsService.get_recurring_tasks(self.thread_id), notifications, now
+        )
+
+        if not due_reminders and not due_recurring_tasks:
+            self.logger.info("No reminders or recurring tasks are due, skipping super agent call")
+            return
 
         prompt = f"""
 # Notification Management System
 
 ## Core Responsibility
-You are the notification management system responsible for delivering timely alerts without duplication. Your task is to analyze pending notifications and determine which ones need to be sent.
+You are the notification management system responsible for delivering timely alerts. The reminders and recurring tasks below are due now and the user has not been notified about them yet.
 
 ## Current Time
-Current system time: {datetime.now(pytz.timezone("Europe/Amsterdam")).strftime("%Y-%m-%d %H:%M:%S")}
-
-## Previously Sent Notifications
-The following notifications have already been sent and MUST NOT be resent:
-{json.dumps(notifications, indent=2)}
-
-## Items to Evaluate
-Please evaluate these items for notification eligibility:
+Current system time: {now.strftime("%Y-%m-%d %H:%M:%S")}
 
+## Due Items
 1. Reminders:
-{json.dumps(reminders, indent=2)}
+{json.dumps(due_reminders, indent=2)}
 
 2. Recurring Tasks:
-{json.dumps(recurring_tasks, indent=2)}
-
-## Decision Rules
-- A notification should be sent for any reminder that is currently due
-- For recurring tasks, evaluate the cron expression to determine if it should be triggered at the current time
-- If a cron expression indicates the task is due now and hasn't already been sent today, send a notification
-- If an item appears in the previously sent notifications list, it MUST be skipped
-- Parse cron expressions carefully to determine exact scheduling (minute, hour, day of month, month, day of week)
-- The date attribute of the reminders in the reminders list is the due date. If that date is before the current date, the reminder is due.
+{json.dumps(due_recurring_tasks, indent=2)}
 
 ## Required Action
-After analysis, you must take exactly ONE of these actions:
-- If any eligible notifications are found: invoke the send_notification tool with details
-- If no eligible notifications exist: invoke the noop tool
+- Invoke the send_notification tool once, with a title and text that cover all due items
+- Only invoke the noop tool if none of the items should be sent to the user as a notification
 """
 
         self.logger.info(f"Calling super agent with prompt: {prompt}")
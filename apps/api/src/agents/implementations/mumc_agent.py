@@ -2,8 +2,8 @@ import io
 import json
 import re
 import uuid
-from collections.abc import Callable, Iterable
-from datetime import datetime, time
+from collections.abc import AsyncGenerator, Callable, Iterable
+from datetime import datetime
 from typing import Any, Literal
 
 import httpx
@@ -14,10 +14,16 @@ from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 from PIL import Image, ImageOps
-from prisma.enums import health_data_point_type
-from prisma.types import health_data_pointsWhereInput, usersWhereInput
+from prisma.types import usersWhereInput
 from pydantic import BaseModel, Field
 from src.agents.base_agent import BaseAgent, SuperAgentConfig
+from src.agents.questionnaire_engine import (
+    find_question,
+    last_multiple_choice_widget,
+    match_choice,
+    next_question,
+    structured_choices,
+)
 from src.agents.tools.base_tools import BaseTools
 from src.agents.tools.easylog_backend_tools import EasylogBackendTools
 from src.agents.tools.easylog_sql_tools import EasylogSqlTools
@@ -25,11 +31,22 @@ from src.lib.prisma import prisma
 from src.models.chart_widget import (
     ChartWidget,
     Line,
-    ZLMDataRow,
 )
+from src.models.messages import MessageContent, ToolResultContent, ToolUseContent
 from src.models.multiple_choice_widget import Choice, MultipleChoiceWidget
+from src.services.super_agent.due_items import DEFAULT_TIMEZONE, get_due_recurring_tasks, get_due_reminders
+from src.services.super_agent.reminder_scheduler import ReminderScheduler
+from src.services.steps.steps_service import StepsService
+from src.services.thread_items.thread_items_service import ThreadItemsService
+from src.services.zlm.zlm_score_service import ZLM_DOMAIN_LABELS, ZLMScoreService
 from src.settings import settings
 from src.utils.function_to_openai_tool import function_to_openai_tool
+from src.utils.memory_selection import format_memories, last_user_message_text, select_memories
+from src.utils.metrics import log_metric
+from src.utils.prompt_budget import PromptBudget
+from src.utils.prompt_cache import format_volatile_suffix, split_volatile_sections, system_message
+from src.utils.tool_router import route_tools
+from src.utils.prompt_template import render_template
 
 
 class QuestionaireQuestionConfig(BaseModel):
@@ -47,33 +64,6 @@ class QuestionaireQuestionConfig(BaseModel):
     )
 
 
-class ZLMQuestionnaireAnswers(BaseModel):
-    """Validated answers for the Ziektelastmeter COPD questionnaire (G1–G22)."""
-
-    G1: int = Field(..., ge=0, le=6)
-    G2: int = Field(..., ge=0, le=6)
-    G3: int = Field(..., ge=0, le=6)
-    G4: int = Field(..., ge=0, le=6)
-    G5: int = Field(..., ge=0, le=6)
-    G6: int = Field(..., ge=0, le=6)
-    G7: int = Field(..., ge=0, le=6)
-    G8: int = Field(..., ge=0, le=6)
-    G9: int = Field(..., ge=0, le=6)
-    G10: int = Field(..., ge=0, le=6)
-    G11: int = Field(..., ge=0, le=6)
-    G12: int = Field(..., ge=0, le=6)
-    G13: int = Field(..., ge=0, le=6)
-    G14: int = Field(..., ge=0, le=6)
-    G15: int = Field(..., ge=0, le=6)
-    G16: int = Field(..., ge=0, le=6)
-    G17: int = Field(..., ge=0, le=4)
-    G18: int = Field(..., ge=0, le=6)
-    G19: int = Field(..., ge=0, le=6)
-    G20: Literal["nooit", "vroeger", "ja"]
-    G21: float = Field(..., gt=0)
-    G22: float = Field(..., gt=0)
-
-
 class RoleReasoningConfig(BaseModel):
     enabled: bool = Field(
         default=False,
@@ -102,6 +92,10 @@ class RoleConfig(BaseModel):
         default=".*",
         description="A regular expression specifying which tools this role is permitted to use. Use '.*' to allow all tools, or restrict as needed.",
     )
+    loaded_tools_regex: str | None = Field(
+        default=None,
+        description="A regular expression specifying which of the permitted tools are sent with every request of this role. The core tools are always sent, the other tools are loaded on demand with tool_load_tools. If None, all permitted tools are sent.",
+    )
     allowed_subjects: list[str] | None = Field(
         default=None,
         description="A list of subject names from the knowledge base that this role is allowed to access. If None, all subjects are allowed.",
@@ -150,6 +144,111 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             role_config for role_config in self.config.roles if role_config.name == role
         )
 
+    async def forward_message(
+        self, messages: Iterable[ChatCompletionMessageParam], retry_count: int = 0
+    ) -> AsyncGenerator[tuple[MessageContent, bool], None]:
+        if retry_count == 0:
+            try:
+                handled = False
+
+                async for chunk, should_stop in self._continue_questionnaire(list(messages)):
+                    handled = True
+                    yield chunk, should_stop
+            finally:
+                await self.flush_metadata()
+
+            if handled:
+                return
+
+        async for chunk, should_stop in super().forward_message(messages, retry_count):
+            yield chunk, should_stop
+
+    async def _continue_questionnaire(
+        self, messages: list[ChatCompletionMessageParam]
+    ) -> AsyncGenerator[tuple[MessageContent, bool], None]:
+        """Record the choice the user picked in a questionnaire widget and ask the next question, without the model.
+
+        Yields the same tool calls the model would make, so the history reads the same. Anything that is not a pick
+        from the last widget, and free text questions, are left to the model.
+        """
+
+        widget = last_multiple_choice_widget(messages)
+
+        if widget is None:
+            return
+
+        choice = match_choice(widget, last_user_message_text(messages))
+
+        if choice is None:
+            return
+
+        role_config = await self.get_current_role()
+        answers = {question.name: await self.get_metadata(question.name) for question in role_config.questionaire}
+        question = find_question(role_config.questionaire, widget, answers)
+
+        if question is None:
+            return
+
+        tool_use_id = f"call_{uuid.uuid4().hex}"
+        yield (
+            ToolUseContent(
+                id=str(uuid.uuid4()),
+                tool_use_id=tool_use_id,
+                name="tool_answer_questionaire_question",
+                input={"question_name": question.name, "answer": choice.value},
+            ),
+            False,
+        )
+
+        await self.set_metadata(question.name, choice.value)
+        answers[question.name] = choice.value
+
+        log_metric("questionnaire.answer.without_llm", 1, agent=self.__class__.__name__, question=question.name)
+
+        upcoming_question = next_question(role_config.questionaire, answers, after=question)
+        choices = structured_choices(upcoming_question) if upcoming_question else None
+
+        yield (
+            ToolResultContent(
+                id=str(uuid.uuid4()),
+                tool_use_id=tool_use_id,
+                output=f"Answer to {question.name} set to {choice.value}",
+                widget_type="text",
+                is_error=False,
+            ),
+            False,
+        )
+
+        # Without a next multiple choice question to ask, the answer goes back to the model to continue the turn
+        if upcoming_question is None or choices is None:
+            return
+
+        next_widget = MultipleChoiceWidget(question=upcoming_question.question, choices=choices, selected_choice=None)
+        tool_use_id = f"call_{uuid.uuid4().hex}"
+
+        yield (
+            ToolUseContent(
+                id=str(uuid.uuid4()),
+                tool_use_id=tool_use_id,
+                name="tool_ask_multiple_choice",
+                input={
+                    "question": next_widget.question,
+                    "choices": [choice.model_dump() for choice in next_widget.choices],
+                },
+            ),
+            False,
+        )
+        yield (
+            ToolResultContent(
+                id=str(uuid.uuid4()),
+                tool_use_id=tool_use_id,
+                output=next_widget.model_dump_json(),
+                widget_type="multiple_choice",
+                is_error=False,
+            ),
+            True,
+        )
+
     def get_tools(self) -> dict[str, Callable]:
         # EasyLog-specific tools
         easylog_token = self.request_headers.get("x-easylog-bearer-token", "")
@@ -262,219 +361,71 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             """
             return await self.get_metadata(question_name, "[not answered]")
 
-        async def tool_calculate_zlm_scores() -> dict[str, float]:
-            """Calculate Ziektelastmeter COPD domain scores based on previously
-            answered questionnaire values. The questionnaire must be complete before calling this tool.
+        async def get_zlm_user_id() -> str:
+            external_user_id = self.request_headers.get("x-onesignal-external-user-id")
 
-            Upon successful calculation the individual domain scores **and** the
-            calculated BMI Value are persisted as memories using
-            ``tool_store_memory``.
-            """
+            if external_user_id is None:
+                raise ValueError("User ID not provided and not found in agent context.")
 
-            # --------------------------------------------------------------
-            # 1. Gather & validate answers
-            # --------------------------------------------------------------
-            question_codes = [f"G{i}" for i in range(1, 23)]  # g1 … g22 inclusive
-
-            raw_answers: dict[str, str] = {}
-            missing: list[str] = []
-            for code in question_codes:
-                ans = await tool_get_questionaire_answer(code)
-                if ans in {"[not answered]", None, ""}:
-                    missing.append(code)
-                else:
-                    raw_answers[code] = ans
+            return await ZLMScoreService.get_user_id(external_user_id)
 
-            if missing:
-                raise ValueError(
-                    "Missing questionnaire answers for: " + ", ".join(missing)
-                )
+        async def tool_calculate_zlm_scores() -> str:
+            """Calculate Ziektelastmeter COPD domain scores based on previously
+            answered questionnaire values. The questionnaire must be complete before calling this tool.
 
-            # --------------------------------------------------------------
-            # 2. Parse & validate using Pydantic model
-            # --------------------------------------------------------------
-            def _to_int(val: str) -> int:
-                try:
-                    return int(val)
-                except Exception as exc:
-                    raise ValueError(
-                        f"Expected integer, got '{val}' for question."
-                    ) from exc
+            The scores are saved to the score history of the user. The result contains the domain scores (0-6, 0 is
+            good), the BMI value and the scores of the previous questionnaire, if any. Use tool_create_zlm_chart to
+            show them.
+            """
 
-            def _to_float(val: str) -> float:
-                try:
-                    return float(val)
-                except Exception as exc:
-                    raise ValueError(
-                        f"Expected float, got '{val}' for question."
-                    ) from exc
-
-            parsed: dict[str, Any] = {
-                # ints 0-6 unless specified
-                **{
-                    f"G{i}": _to_int(raw_answers[f"G{i}"])
-                    for i in range(1, 20)
-                    if i != 20
-                },
-                # g20 remains str literal
-                "G20": raw_answers["G20"].strip().lower(),
-                # floats
-                "G21": _to_float(raw_answers["G21"]),
-                "G22": _to_float(raw_answers["G22"]),
-            }
+            metadata = await self.get_scalar_metadata()
+            answers = ZLMScoreService.parse_answers(metadata)
+            scores, bmi_value = ZLMScoreService.calculate_scores(answers)
 
-            answers = ZLMQuestionnaireAnswers(**parsed)
+            result = await ZLMScoreService.save_scores(await get_zlm_user_id(), self.thread_id, scores, bmi_value)
 
-            # --------------------------------------------------------------
-            # 3. Domain score computation
-            # --------------------------------------------------------------
-            from statistics import mean
+            return result.model_dump_json()
 
-            def _avg(vals: list[int]) -> float:
-                return float(mean(vals)) if vals else 0.0
+        async def tool_create_zlm_chart(language: Literal["nl", "en"]) -> ChartWidget:
+            """
+            Creates a ZLM (Ziektelastmeter COPD) balloon chart of the most recent scores of the user, with the
+            previous scores as the old values. Calculate the scores with tool_calculate_zlm_scores first.
 
-            scores: dict[str, float] = {
-                "longklachten": _avg(
-                    [answers.G12, answers.G13, answers.G15, answers.G16]
-                ),
-                "longaanvallen": float(answers.G17),
-                "lichambeperkingen": _avg([answers.G5, answers.G6, answers.G7]),
-                "vermoeidheid": float(answers.G1),
-                "nachtrust": float(answers.G2),
-                "gevoelens emoties": _avg([answers.G3, answers.G11, answers.G14]),
-                "seksualiteit": float(answers.G10),
-                "relaties en werk": _avg([answers.G8, answers.G9]),
-                "medicijnen": float(answers.G4),
-                "bewegen": float(answers.G18),
-                "alcohol": float(answers.G19),
-            }
+            Args:
+                language: The language for chart title and labels ('nl' or 'en').
 
-            # BMI-related score
-            height_m = answers.G22 / 100.0
-            bmi_value = answers.G21 / (height_m**2)
-            if bmi_value < 18.5:  # Ondergewicht
-                gewicht_score = 6
-            elif bmi_value < 19:  # Ondergewicht grens
-                gewicht_score = 5
-            elif bmi_value < 19.5:  # Ondergewicht grens
-                gewicht_score = 4
-            elif bmi_value < 20:  # Ondergewicht grens
-                gewicht_score = 3
-            elif bmi_value < 20.5:  # Ondergewicht grens
-                gewicht_score = 2
-            elif bmi_value < 21:  # Ondergewicht grens
-                gewicht_score = 1
-            elif bmi_value >= 21 and bmi_value < 25:  # NORMAAL GEWICHT
-                gewicht_score = 0
-            elif bmi_value >= 25:  # Licht overgewicht
-                gewicht_score = 1
-            elif bmi_value >= 27:  # Overgewicht
-                gewicht_score = 2
-            elif bmi_value >= 29:  # Overgewicht
-                gewicht_score = 3
-            elif bmi_value >= 31:  # Obesitas I
-                gewicht_score = 4
-            elif bmi_value >= 33:  # Obesitas II
-                gewicht_score = 5
-            elif bmi_value >= 35:  # Obesitas III
-                gewicht_score = 6
-
-            scores["gewicht_bmi"] = float(gewicht_score)
-
-            # Scale scores that are not already 0-6 to 0-6
-            scores["longaanvallen"] = scores["longaanvallen"] * 1.5
-            # score 0-3 to 0-6
-
-            # Roken score
-            roken_map = {"nooit": 0, "vroeger": 2, "ja": 6}
-            scores["roken"] = float(roken_map[answers.G20])
-
-            # --------------------------------------------------------------
-            # 4. Persist memories
-            # --------------------------------------------------------------
-            label_map = {
-                "longklachten": "Long klachten",
-                "longaanvallen": "Long aanvallen",
-                "lichamelijke_beperkingen": "Lichamelijke beperkingen",
-                "vermoeidheid": "Vermoeidheid",
-                "nachtrust": "Nachtrust",
-                "gevoelens_emoties": "Emoties",
-                "seksualiteit": "Seksualiteit",
-                "relaties_en_werk": "Relaties en werk",
-                "medicijnen": "Medicijnen",
-                "gewicht_bmi": "BMI",
-                "bewegen": "Bewegen",
-                "alcohol": "Alcohol",
-                "roken": "Roken",
-            }
+            Returns:
+                A ChartWidget object configured as a balloon chart.
 
-            today_str = datetime.now().strftime("%d-%m-%Y")
+            Raises:
+                ValueError: If the user has no ZLM scores yet.
+            """
 
-            # Store domain scores
-            for key, score in scores.items():
-                label = label_map.get(key, key.title())
-                mem = f"ZLM-Score-{label} {today_str}: Score = {score}"
-                await tool_store_memory(mem)
+            result = await ZLMScoreService.get_latest(await get_zlm_user_id())
 
-            mem = f"ZLM-BMI-meta_value {today_str} {bmi_value}"
-            await tool_store_memory(mem)
+            if result is None:
+                raise ValueError("No ZLM scores found, calculate them with tool_calculate_zlm_scores first.")
 
-            return scores
+            return ZLMScoreService.to_chart(result, language)
 
-        def tool_create_zlm_chart(
-            language: Literal["nl", "en"],
-            data: list[ZLMDataRow],
-        ) -> ChartWidget:
-            """
-            Creates a ZLM (Ziektelastmeter COPD) balloon chart using a predefined ZLM color scheme.
-            The chart visualizes scores, expecting values in the 0-6 range. Where 0 is good and 6 is the worst
-            The y-axis label is derived from the `y_label` field of the first data item.
+        async def tool_get_zlm_score_history(limit: int = 5) -> list[dict[str, Any]]:
+            """Get the previous Ziektelastmeter COPD results of the user, newest first.
 
             Args:
-                language: The language for chart title and description ('nl' or 'en').
-                data: A list of `ZLMDataRow` objects for the chart. Each item represents a
-                      category on the x-axis and its corresponding scores.
-                      - `x_value` (str): The name of the category (e.g., "Algemeen").
-                      - `y_current` (float): The current score (0-6).
-                      - `y_old` (float | None): Optional. The previous score the patient had (0-6).
-                      - `y_label` (str): The label for the y-axis, typically including units
-                                         (e.g., "Score (0-6)"). This is used for the overall
-                                         Y-axis label of the chart.
-                      - `meta` (str | None): Optional. Extra information for this data point shown to the user. Add the BMI value here for the BMI score data point.
+                limit (int): The maximum number of results to return.
 
             Returns:
-                A ChartWidget object configured as a balloon chart.
-
-            Raises:
-                ValueError: If the `data` list is empty.
-
-            Example:
-                ```python
-                # Assuming ZLMDataRow is imported from src.models.chart_widget
-                data = [
-                    ZLMDataRow(x_value="Physical pain", y_current=7.5, y_old=6.0, y_label="Score (0-6)"),
-                    ZLMDataRow(x_value="Mental health", y_current=8.2, y_old=8.5, y_label="Score (0-6)"),
-                    ZLMDataRow(x_value="Social support", y_current=3.0, y_label="Schaal (0-5)"),  # No old value
-                ]
-                chart_widget = tool_create_zlm_chart(language="nl", data=data)
-                ```
+                list[dict[str, Any]]: The date, domain scores (0-6) and BMI value of each result.
             """
 
-            title = (
-                "Resultaten ziektelastmeter"
-                if language == "nl"
-                else "Disease burden results"
-            )
-
-            # Check that data list is at least 1 or more,.
-            if len(data) < 1:
-                raise ValueError("Data list must be at least 1 or more.")
-
-            # Convert dictionaries to ZLMDataRow objects if needed
-            return ChartWidget.create_balloon_chart(
-                title=title,
-                data=data,
-            )
+            return [
+                {
+                    "date": row.created_at.astimezone(DEFAULT_TIMEZONE).isoformat(),
+                    "bmi_value": row.bmi_value,
+                    "scores": {domain: getattr(row, domain) for domain in ZLM_DOMAIN_LABELS},
+                }
+                for row in await ZLMScoreService.get_history(await get_zlm_user_id(), limit)
+            ]
 
         def tool_create_bar_chart(
             title: str,
@@ -911,19 +862,9 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
                 task (str): The task to set the schedule for.
             """
 
-            existing_tasks: list[dict[str, str]] = await self.get_metadata(
-                "recurring_tasks", []
-            )
+            recurring_task = await ThreadItemsService.add_recurring_task(self.thread_id, cron_expression, task)
 
-            existing_tasks.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "cron_expression": cron_expression,
-                    "task": task,
-                }
-            )
-
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            ReminderScheduler.schedule_recurring_task(self.__class__, self.thread_id, recurring_task)
 
             return f"Schedule set for {task} with cron expression {cron_expression}"
 
@@ -935,19 +876,9 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
                 message (str): The message to remind the user about.
             """
 
-            existing_reminders: list[dict[str, str]] = await self.get_metadata(
-                "reminders", []
-            )
+            reminder = await ThreadItemsService.add_reminder(self.thread_id, date, message)
 
-            existing_reminders.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "date": date,
-                    "message": message,
-                }
-            )
-
-            await self.set_metadata("reminders", existing_reminders)
+            ReminderScheduler.schedule_reminder(self.__class__, self.thread_id, reminder)
 
             return f"Reminder added for {message} at {date}"
 
@@ -957,13 +888,10 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             Args:
                 id (str): The ID of the task to remove.
             """
-            existing_tasks: list[dict[str, str]] = await self.get_metadata(
-                "recurring_tasks", []
-            )
 
-            existing_tasks = [task for task in existing_tasks if task["id"] != id]
+            await ThreadItemsService.remove_recurring_task(self.thread_id, id)
 
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            ReminderScheduler.unschedule(ReminderScheduler.recurring_task_job_id(self.thread_id, id))
 
             return f"Recurring task {id} removed"
 
@@ -973,15 +901,10 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             Args:
                 id (str): The ID of the reminder to remove.
             """
-            existing_reminders: list[dict[str, str]] = await self.get_metadata(
-                "reminders", []
-            )
 
-            existing_reminders = [
-                reminder for reminder in existing_reminders if reminder["id"] != id
-            ]
+            await ThreadItemsService.remove_reminder(self.thread_id, id)
 
-            await self.set_metadata("reminders", existing_reminders)
+            ReminderScheduler.unschedule(ReminderScheduler.reminder_job_id(self.thread_id, id))
 
             return f"Reminder {id} removed"
 
@@ -993,9 +916,7 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
                 memory (str): The memory to store.
             """
 
-            memories = await self.get_metadata("memories", [])
-            memories.append({"id": str(uuid.uuid4())[0:8], "memory": memory})
-            await self.set_metadata("memories", memories)
+            await ThreadItemsService.add_memory(self.thread_id, memory)
 
             return f"Memory stored: {memory}"
 
@@ -1005,8 +926,9 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             Args:
                 id (str): The id of the memory to get.
             """
-            memories = await self.get_metadata("memories", [])
-            memory = next((m for m in memories if m["id"] == id), None)
+
+            memory = await ThreadItemsService.get_memory(self.thread_id, id)
+
             if memory is None:
                 return "[not stored]"
 
@@ -1057,20 +979,10 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
 
             self.logger.info(f"Notification response: {response}")
 
-            notifications = await self.get_metadata("notifications", [])
-            notifications.append(
-                {
-                    "id": response["id"],
-                    "title": title,
-                    "contents": contents,
-                    "sent_at": datetime.now(
-                        pytz.timezone("Europe/Amsterdam")
-                    ).isoformat(),
-                }
+            await ThreadItemsService.add_notification(
+                self.thread_id, response["id"], onesignal_id, title, contents
             )
 
-            await self.set_metadata("notifications", notifications)
-
             return "Notification sent"
 
         async def tool_get_steps_data(
@@ -1084,17 +996,20 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             Parameters
             ----------
             date_from, date_to : str | datetime
-                Inclusive ISO-8601 strings **or** ``datetime`` objects that define the
-                query window in the *local* timezone (see ``timezone``).
+                ISO-8601 strings **or** ``datetime`` objects that define the query
+                window in the *local* timezone (see ``timezone``). A data point counts
+                when it *starts* within the window, both ends included, so a range
+                over two days gives the same total as the two daily totals.
 
             timezone : str | None, default ``"Europe/Amsterdam"``
-                IANA timezone name used to interpret naïve datetimes **and** for the
-                timestamps returned by this tool.
+                IANA timezone name used to interpret naïve datetimes, to align the
+                buckets to local time **and** for the timestamps returned by this tool.
 
-            aggregation : {"quarter", "hour", "day", None}, default ``day``
+            aggregation : {"quarter", "hour", "day", "none", None}, default ``day``
                 • ``"quarter"`` → 15-minute buckets
                 • ``"hour"``     → hourly totals
                 • ``"day"``      → daily totals
+                • ``"none"``     → the raw data points
                 • ``None``/empty → **defaults to daily** (same as ``"day"``)
 
             The granularity increases from *quarter* (smallest) → *hour* → *day*.
@@ -1109,185 +1024,19 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
 
             Notes
             -----
-            • The result set is limited to **max 300 rows** to protect the UI and
-              network usage. If the database returns more rows, only the first 300
-              (ordered chronologically) are returned.
+            • The result set is limited to **max 300 rows** (buckets, or data points
+              in raw mode), ordered chronologically, to protect the UI and network usage.
             """
 
-            from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-
-            # ------------------------------------------------------------------ #
-            # 0. Normalise / validate aggregation parameter                     #
-            # ------------------------------------------------------------------ #
-            agg_raw = (aggregation or "").strip().lower()
-
-            if agg_raw in {"", "none"}:
-                aggregation_normalised = "day"
-            elif agg_raw in {"hour", "hourly"}:
-                aggregation_normalised = "hour"
-            elif agg_raw in {"day", "daily"}:
-                aggregation_normalised = "day"
-            elif agg_raw in {"quarter", "quarterly", "q", "15m", "15min", "15"}:
-                aggregation_normalised = "quarter"
-            else:
-                raise ValueError(
-                    "Invalid aggregation value. Use one of: 'quarter', 'hour', 'day', or None/empty."
-                )
-
-            aggregation = aggregation_normalised  # overwrite with canonical value
-
-            # ------------------------------------------------------------------ #
-            # 1. Resolve / validate timezone                                     #
-            # ------------------------------------------------------------------ #
-            tz_name = (timezone or "Europe/Amsterdam").strip()
-            if tz_name in {"CET", "CEST"}:
-                tz_name = "Europe/Amsterdam"
-
-            try:
-                tz = ZoneInfo(tz_name)
-            except ZoneInfoNotFoundError as exc:
-                raise ValueError(
-                    f"Invalid timezone '{timezone}'. Please provide a valid IANA name."
-                ) from exc
-
-            UTC = ZoneInfo("UTC")  # single UTC instance for reuse
-
-            # ------------------------------------------------------------------ #
-            # 2. Parse inputs → timezone-aware datetimes                         #
-            # ------------------------------------------------------------------ #
-            def _parse_input(val: str | datetime) -> datetime:
-                """ISO string → datetime; naïve → attach local tz."""
-                dt_obj = datetime.fromisoformat(val) if isinstance(val, str) else val
-                if dt_obj.tzinfo is None:  # treat naïve as local
-                    dt_obj = dt_obj.replace(tzinfo=tz)
-                return dt_obj
-
-            date_from_dt = _parse_input(date_from)
-            date_to_dt = _parse_input(date_to)
-
-            extra = ""
-            if date_from_dt.year < datetime.now(pytz.timezone("Europe/Amsterdam")).year:
-                raise ValueError("Date from is in the past")
-
-            # Expand “whole-day” range (00:00 → 23:59:59.999999)
-            if (
-                date_from_dt.date() == date_to_dt.date()
-                and date_from_dt.timetz() == time(0, tzinfo=tz)
-                and date_to_dt.timetz() == time(0, tzinfo=tz)
-            ):
-                date_to_dt = date_to_dt.replace(
-                    hour=23, minute=59, second=59, microsecond=999999
-                )
-
-            # Convert to **UTC** for querying
-            date_from_utc = date_from_dt.astimezone(UTC)
-            date_to_utc = date_to_dt.astimezone(UTC)
-
-            # ------------------------------------------------------------------ #
-            # 3. Fetch user id                                                   #
-            # ------------------------------------------------------------------ #
             external_user_id = self.request_headers.get("x-onesignal-external-user-id")
             if external_user_id is None:
                 raise ValueError("User ID not provided and not found in agent context.")
 
-            user = await prisma.users.find_first(
-                where=usersWhereInput(external_id=external_user_id)
-            )
+            user = await prisma.users.find_first(where=usersWhereInput(external_id=external_user_id))
             if user is None:
                 raise ValueError("User not found")
 
-            # ------------------------------------------------------------------ #
-            # 4. Retrieve raw datapoints                                         #
-            # ------------------------------------------------------------------ #
-            steps_data = await prisma.health_data_points.find_many(
-                where=health_data_pointsWhereInput(
-                    user_id=user.id,
-                    type=health_data_point_type.steps,
-                    date_from={"gte": date_from_utc},
-                    date_to={"lte": date_to_utc},
-                ),
-                order={"created_at": "asc"},
-                take=300,
-            )
-            if not steps_data:
-                return []
-
-            # ------------------------------------------------------------------ #
-            # 5. Helper: convert any str/naïve dt → ISO in *local* timezone      #
-            # ------------------------------------------------------------------ #
-            def _iso_local(val: str | datetime) -> str:
-                dt_obj = datetime.fromisoformat(val) if isinstance(val, str) else val
-                if dt_obj.tzinfo is None:  # DB can return naïve UTC
-                    dt_obj = dt_obj.replace(tzinfo=UTC)
-                return dt_obj.astimezone(tz).isoformat()
-
-            # ------------------------------------------------------------------ #
-            # 6. Aggregation                                                     #
-            # ------------------------------------------------------------------ #
-            if aggregation in {"hour", "day"}:
-                rows: list[dict[str, Any]] = await prisma.query_raw(
-                    f"""
-                    SELECT
-                        date_trunc('{aggregation}', date_from AT TIME ZONE 'UTC') AS bucket,
-                        SUM(value)::int                                          AS total
-                    FROM   health_data_points
-                    WHERE  user_id  = $1::uuid
-                    AND  type     = 'steps'
-                    AND  date_from >= $2::timestamptz
-                    AND  date_to   <= $3::timestamptz
-                    GROUP  BY bucket
-                    ORDER  BY bucket
-                    LIMIT 300
-                    """,
-                    user.id,
-                    date_from_utc,
-                    date_to_utc,
-                )
-
-                return [
-                    {
-                        "created_at": _iso_local(row["bucket"]),
-                        "value": row["total"],
-                    }
-                    for row in rows
-                ]
-
-            # ------------------------------------------------------------------ #
-            # 6b. Quarter-hour aggregation                                       #
-            # ------------------------------------------------------------------ #
-            if aggregation == "quarter":
-                from collections import defaultdict
-
-                bucket_totals: dict[str, int] = defaultdict(int)
-
-                for dp in steps_data:
-                    start_dt = _parse_input(dp.date_from)
-                    local_dt = start_dt.astimezone(tz)
-                    floored_minute = (local_dt.minute // 15) * 15
-                    bucket_dt = local_dt.replace(
-                        minute=floored_minute, second=0, microsecond=0
-                    )
-                    bucket_key = bucket_dt.isoformat()
-                    bucket_totals[bucket_key] += dp.value
-
-                sorted_rows = sorted(bucket_totals.items())[:300]
-
-                return [
-                    {"created_at": key, "value": total} for key, total in sorted_rows
-                ]
-
-            # ------------------------------------------------------------------ #
-            # 7. Raw datapoints                                                  #
-            # ------------------------------------------------------------------ #
-            return [
-                {
-                    "created_at": _iso_local(dp.created_at),
-                    "date_from": _iso_local(dp.date_from),
-                    "date_to": _iso_local(dp.date_to),
-                    "value": dp.value,
-                }
-                for dp in steps_data
-            ]
+            return await StepsService.get_steps(user.id, date_from, date_to, timezone, aggregation)
 
         # Assemble and return the complete tool list
         tools_list = [
@@ -1306,6 +1055,7 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             tool_create_bar_chart,
             tool_calculate_zlm_scores,
             tool_create_zlm_chart,
+            tool_get_zlm_score_history,
             tool_create_line_chart,
             # Interaction tools
             tool_ask_multiple_choice,
@@ -1329,29 +1079,6 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
         ]
         return {tool.__name__: tool for tool in tools_list}
 
-    def _substitute_double_curly_placeholders(
-        self, template_string: str, data_dict: dict[str, Any]
-    ) -> str:
-        """Substitutes {{placeholder}} style placeholders in a string with values from data_dict."""
-
-        # First, replace all known placeholders
-        output_string = template_string
-        for key, value in data_dict.items():
-            placeholder = "{{" + key + "}}"
-            output_string = output_string.replace(placeholder, str(value))
-
-        # Then, find any remaining {{...}} placeholders that were not in data_dict
-        # and replace them with a [missing:key_name] indicator.
-        # This mimics the DefaultKeyDict behavior for unprovided keys.
-        def replace_missing_with_indicator(match: re.Match[str]) -> str:
-            var_name = match.group(1)  # Content inside {{...}}
-            return f"[missing:{var_name}]"
-
-        output_string = re.sub(
-            r"\{\{([^}]+)\}\}", replace_missing_with_indicator, output_string
-        )
-        return output_string
-
     async def on_message(
         self, messages: Iterable[ChatCompletionMessageParam], _: int = 0
     ) -> tuple[AsyncStream[ChatCompletionChunk] | ChatCompletion, list[Callable]]:
@@ -1397,61 +1124,71 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
 
         # Format the role prompt with questionnaire data
         try:
-            formatted_current_role_prompt = self._substitute_double_curly_placeholders(
-                role_config.prompt, questionnaire_format_kwargs
-            )
+            formatted_current_role_prompt = render_template(role_config.prompt, questionnaire_format_kwargs)
         except Exception as e:
             self.logger.warning(f"Error formatting role prompt: {e}")
             formatted_current_role_prompt = role_config.prompt
 
         # Gather reminders and recurring tasks
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
-        reminders = await self.get_metadata("reminders", [])
-        memories = await self.get_metadata("memories", [])
-        notifications = await self.get_metadata("notifications", [])
+        recurring_tasks = await ThreadItemsService.get_recurring_tasks(self.thread_id)
+        reminders = await ThreadItemsService.get_reminders(self.thread_id)
+
+        # Only the memories that matter for this message go into the prompt, within a fixed token budget
+        memories = await ThreadItemsService.get_memories(self.thread_id)
+        relevant_memories = select_memories(
+            memories,
+            last_user_message_text(messages),
+            settings.PROMPT_MEMORIES_MAX_ITEMS,
+            settings.PROMPT_MEMORIES_TOKEN_BUDGET,
+        )
+        recent_notifications = await ThreadItemsService.get_notifications(
+            self.thread_id, limit=settings.PROMPT_NOTIFICATIONS_MAX_ITEMS, newest_first=True
+        )
+        notifications = list(reversed(recent_notifications))
 
         # Prepare the main content for the LLM
-        main_prompt_format_args = {
-            "current_role": role_config.name,
-            "current_role_prompt": formatted_current_role_prompt,
-            "available_roles": "\n".join(
-                [f"- {role.name}" for role in self.config.roles]
-            ),
-            "current_time": datetime.now(pytz.timezone("Europe/Amsterdam")).strftime(
-                "%Y-%m-%d %H:%M:%S"
-            ),
-            "recurring_tasks": "\n".join(
-                [
-                    f"- {task['id']}: {task['cron_expression']} - {task['task']}"
-                    for task in recurring_tasks
-                ]
-            )
-            if recurring_tasks
-            else "<no recurring tasks>",
-            "reminders": "\n".join(
-                [
-                    f"- {reminder['id']}: {reminder['date']} - {reminder['message']}"
-                    for reminder in reminders
-                ]
-            )
-            if reminders
-            else "<no reminders>",
-            "memories": "\n".join(
-                [f"- {memory['id']}: {memory['memory']}" for memory in memories]
-            )
-            if memories
-            else "<no memories>",
-            "notifications": "\n".join(
-                [
-                    f"{notification.get('id')}: {notification.get('contents')} at {notification.get('sent_at')}"
-                    for notification in notifications
-                ]
-            )
-            if notifications
-            else "<no notifications>",
-            "metadata": json.dumps((await self._get_thread()).metadata),
-        }
-        main_prompt_format_args.update(questionnaire_format_kwargs)
+        budget = PromptBudget(settings.PROMPT_SECTION_TOKEN_CAPS)
+        main_prompt_format_args = budget.sections_from(
+            {
+                "current_role": role_config.name,
+                "current_role_prompt": formatted_current_role_prompt,
+                "available_roles": "\n".join(
+                    [f"- {role.name}" for role in self.config.roles]
+                ),
+                "current_time": datetime.now(pytz.timezone("Europe/Amsterdam")).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                "recurring_tasks": "\n".join(
+                    [
+                        f"- {task['id']}: {task['cron_expression']} - {task['task']}"
+                        for task in recurring_tasks
+                    ]
+                )
+                if recurring_tasks
+                else "<no recurring tasks>",
+                "reminders": "\n".join(
+                    [
+                        f"- {reminder['id']}: {reminder['date']} - {reminder['message']}"
+                        for reminder in reminders
+                    ]
+                )
+                if reminders
+                else "<no reminders>",
+                "memories": format_memories(relevant_memories, len(memories)),
+                "notifications": "\n".join(
+                    [
+                        f"{notification.get('id')}: {notification.get('contents')} at {notification.get('sent_at')}"
+                        for notification in notifications
+                    ]
+                )
+                if notifications
+                else "<no notifications>",
+                "metadata": json.dumps(await self.get_scalar_metadata(), ensure_ascii=False),
+            }
+        )
+        main_prompt_format_args.update(
+            budget.sections_from(questionnaire_format_kwargs, group="questionnaire")
+        )
 
         # Store session metadata from headers
         onesignal_id = self.request_headers.get("x-onesignal-external-user-id")
@@ -1463,40 +1200,45 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
         if assistant_field_name is not None:
             await self.set_metadata("assistant_field_name", assistant_field_name)
 
+        # The values that change every turn go after the static instructions, so the provider can cache the prefix
+        stable_format_args, volatile_format_args = split_volatile_sections(main_prompt_format_args)
+
         try:
-            llm_content = self._substitute_double_curly_placeholders(
-                self.config.prompt, main_prompt_format_args
-            )
+            system_prompt_prefix = render_template(self.config.prompt, stable_format_args)
         except Exception as e:
             self.logger.warning(f"Error formatting system prompt: {e}")
-            llm_content = (
-                f"Role: {role_config.name}\nPrompt: {formatted_current_role_prompt}"
-            )
+            system_prompt_prefix = f"Role: {role_config.name}\nPrompt: {formatted_current_role_prompt}"
+
+        system_prompt_suffix = format_volatile_suffix(system_prompt_prefix, volatile_format_args)
+
+        self.logger.debug(f"{system_prompt_prefix}\n\n{system_prompt_suffix}")
 
-        self.logger.debug(llm_content)
+        budget.system_prompt(f"{system_prompt_prefix}\n\n{system_prompt_suffix}")
+        # The schemas only depend on the role so they stay cached, the other tools can be loaded on demand
+        routed_tools, callable_tools = route_tools(tools_values, role_config.loaded_tools_regex)
+        tool_schemas = budget.tool_schemas(function_to_openai_tool(tool) for tool in routed_tools)
+        self.record_prompt_budget(budget)
 
         # Create the completion request
         response = await self.client.chat.completions.create(
             model=role_config.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": llm_content,
-                },
+                system_message(system_prompt_prefix, system_prompt_suffix, role_config.model),
                 *messages,
             ],
             stream=True,
+            stream_options={"include_usage": True},
             extra_body={
                 "reasoning": {
                     "enabled": role_config.reasoning.enabled,
                     "effort": role_config.reasoning.effort,
                 }
             },
-            tools=[function_to_openai_tool(tool) for tool in tools_values],
+            tools=tool_schemas,
             tool_choice="auto",
         )
 
-        return response, list(tools_values)
+        return response, callable_tools
 
     @staticmethod
     def super_agent_config() -> SuperAgentConfig[MUMCAgentConfig] | None:
@@ -1516,69 +1258,43 @@ class MUMCAgent(BaseAgent[MUMCAgentConfig]):
             self.logger.info("No onesignal id found, skipping super agent call")
             return
 
-        last_thread = await prisma.threads.query_first(
-            """
-        SELECT * FROM threads
-        WHERE metadata->>'onesignal_id' = $1
-        ORDER BY created_at DESC
-        LIMIT 1
-        """,
-            onesignal_id,
-        )
-
-        if last_thread is None:
-            self.logger.info("No last thread found, skipping super agent call")
-            return
-
-        if last_thread.id != self.thread_id:
-            self.logger.info(
-                "Last thread id does not match current thread id, skipping super agent call"
-            )
-            return
-
         tools = [
             BaseTools.tool_noop,
             self.get_tools()["tool_send_notification"],
         ]
 
-        notifications = await self.get_metadata("notifications", [])
-        reminders = await self.get_metadata("reminders", [])
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
+        notifications = await ThreadItemsService.get_notifications(self.thread_id, limit=1, newest_first=True)
+        now = datetime.now(DEFAULT_TIMEZONE)
+
+        # Work out what is due up front, so we only call the model when there is something to send
+        due_reminders = get_due_reminders(await ThreadItemsService.get_reminders(self.thread_id), notifications, now)
+        due_recurring_tasks = get_due_recurring_tasks(
+            await ThreadItemsService.get_recurring_tasks(self.thread_id), notifications, now
+        )
+
+        if not due_reminders and not due_recurring_tasks:
+            self.logger.info("No reminders or recurring tasks are due, skipping super agent call")
+            return
 
         prompt = f"""
 # Notification Management System
 
 ## Core Responsibility
-You are the notification management system responsible for delivering timely alerts without duplication. Your task is to analyze pending notifications and determine which ones need to be sent.
+You are the notification management system responsible for delivering timely alerts. The reminders and recurring tasks below are due now and the user has not been notified about them yet.
 
 ## Current Time
-Current system time: {datetime.now(pytz.timezone("Europe/Amsterdam")).strftime("%Y-%m-%d %H:%M:%S")}
-
-## Previously Sent Notifications
-The following notifications have already been sent and MUST NOT be resent:
-{json.dumps(notifications, indent=2)}
-
-## Items to Evaluate
-Please evaluate these items for notification eligibility:
+Current system time: {now.strftime("%Y-%m-%d %H:%M:%S")}
 
+## Due Items
 1. Reminders:
-{json.dumps(reminders, indent=2)}
+{json.dumps(due_reminders, indent=2)}
 
 2. Recurring Tasks:
-{json.dumps(recurring_tasks, indent=2)}
-
-## Decision Rules
-- A notification should be sent for any reminder that is currently due
-- For recurring tasks, evaluate the cron expression to determine if it should be triggered at the current time
-- If a cron expression indicates the task is due now and hasn't already been sent today, send a notification
-- If an item appears in the previously sent notifications list, it MUST be skipped
-- Parse cron expressions carefully to determine exact scheduling (minute, hour, day of month, month, day of week)
-- The date attribute of the reminders in the reminders list is the due date. If that date is before the current date, the reminder is due.
+{json.dumps(due_recurring_tasks, indent=2)}
 
 ## Required Action
-After analysis, you must take exactly ONE of these actions:
-- If any eligible notifications are found: invoke the send_notification tool with details
-- If no eligible notifications exist: invoke the noop tool
+- Invoke the send_notification tool once, with a title and text that cover all due items
+- Only invoke the noop tool if none of the items should be sent to the user as a notification
 """
 
         self.logger.info(f"Calling super agent with prompt: {prompt}")
@@ -1,8 +1,7 @@
 import io
 import re
-import uuid
 from collections.abc import Callable, Iterable
-from datetime import datetime, time
+from datetime import datetime
 from typing import Any, Literal
 
 import httpx
@@ -11,8 +10,7 @@ from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 from PIL import Image, ImageOps
-from prisma.enums import health_data_point_type
-from prisma.types import health_data_pointsWhereInput, usersWhereInput
+from prisma.types import usersWhereInput
 from pydantic import BaseModel, Field
 from src.agents.base_agent import BaseAgent
 from src.agents.tools.easylog_backend_tools import EasylogBackendTools
@@ -24,6 +22,8 @@ from src.models.chart_widget import (
     ZLMDataRow,
 )
 from src.models.multiple_choice_widget import Choice, MultipleChoiceWidget
+from src.services.steps.steps_service import StepsService
+from src.services.thread_items.thread_items_service import ThreadItemsService
 from src.settings import settings
 from src.utils.function_to_openai_tool import function_to_openai_tool
 from src.agents.tools.parse_horizontal_lines import parse_horizontal_lines
@@ -201,19 +201,7 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
                 task (str): The task to set the schedule for.
             """
 
-            existing_tasks: list[dict[str, str]] = await self.get_metadata(
-                "recurring_tasks", []
-            )
-
-            existing_tasks.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "cron_expression": cron_expression,
-                    "task": task,
-                }
-            )
-
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            await ThreadItemsService.add_recurring_task(self.thread_id, cron_expression, task)
 
             return f"Schedule set for {task} with cron expression {cron_expression}"
 
@@ -225,19 +213,7 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
                 message (str): The message to remind the user about.
             """
 
-            existing_reminders: list[dict[str, str]] = await self.get_metadata(
-                "reminders", []
-            )
-
-            existing_reminders.append(
-                {
-                    "id": str(uuid.uuid4())[:8],
-                    "date": date,
-                    "message": message,
-                }
-            )
-
-            await self.set_metadata("reminders", existing_reminders)
+            await ThreadItemsService.add_reminder(self.thread_id, date, message)
 
             return f"Reminder added for {message} at {date}"
 
@@ -247,13 +223,8 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
             Args:
                 id (str): The ID of the task to remove.
             """
-            existing_tasks: list[dict[str, str]] = await self.get_metadata(
-                "recurring_tasks", []
-            )
 
-            existing_tasks = [task for task in existing_tasks if task["id"] != id]
-
-            await self.set_metadata("recurring_tasks", existing_tasks)
+            await ThreadItemsService.remove_recurring_task(self.thread_id, id)
 
             return f"Recurring task {id} removed"
 
@@ -263,15 +234,8 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
             Args:
                 id (str): The ID of the reminder to remove.
             """
-            existing_reminders: list[dict[str, str]] = await self.get_metadata(
-                "reminders", []
-            )
-
-            existing_reminders = [
-                reminder for reminder in existing_reminders if reminder["id"] != id
-            ]
 
-            await self.set_metadata("reminders", existing_reminders)
+            await ThreadItemsService.remove_reminder(self.thread_id, id)
 
             return f"Reminder {id} removed"
 
@@ -355,9 +319,7 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
                 Confirmation message.
             """
 
-            memories = await self.get_metadata("memories", [])
-            memories.append({"id": str(uuid.uuid4())[0:8], "memory": memory})
-            await self.set_metadata("memories", memories)
+            await ThreadItemsService.add_memory(self.thread_id, memory)
 
             return f"Memory stored: {memory}"
 
@@ -576,17 +538,20 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
             Parameters
             ----------
             date_from, date_to : str | datetime
-                Inclusive ISO-8601 strings **or** ``datetime`` objects that define the
-                query window in the *local* timezone (see ``timezone``).
+                ISO-8601 strings **or** ``datetime`` objects that define the query
+                window in the *local* timezone (see ``timezone``). A data point counts
+                when it *starts* within the window, both ends included, so a range
+                over two days gives the same total as the two daily totals.
 
             timezone : str | None, default ``"Europe/Amsterdam"``
-                IANA timezone name used to interpret naïve datetimes **and** for the
-                timestamps returned by this tool.
+                IANA timezone name used to interpret naïve datetimes, to align the
+                buckets to local time **and** for the timestamps returned by this tool.
 
-            aggregation : {"quarter", "hour", "day", None}, default ``day``
+            aggregation : {"quarter", "hour", "day", "none", None}, default ``day``
                 • ``"quarter"`` → 15-minute buckets
                 • ``"hour"``     → hourly totals
                 • ``"day"``      → daily totals
+                • ``"none"``     → the raw data points
                 • ``None``/empty → **defaults to daily** (same as ``"day"``)
 
             The granularity increases from *quarter* (smallest) → *hour* → *day*.
@@ -601,185 +566,19 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
 
             Notes
             -----
-            • The result set is limited to **max 300 rows** to protect the UI and
-              network usage. If the database returns more rows, only the first 300
-              (ordered chronologically) are returned.
+            • The result set is limited to **max 300 rows** (buckets, or data points
+              in raw mode), ordered chronologically, to protect the UI and network usage.
             """
 
-            from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-
-            # ------------------------------------------------------------------ #
-            # 0. Normalise / validate aggregation parameter                     #
-            # ------------------------------------------------------------------ #
-            agg_raw = (aggregation or "").strip().lower()
-
-            if agg_raw in {"", "none"}:
-                aggregation_normalised = "day"
-            elif agg_raw in {"hour", "hourly"}:
-                aggregation_normalised = "hour"
-            elif agg_raw in {"day", "daily"}:
-                aggregation_normalised = "day"
-            elif agg_raw in {"quarter", "quarterly", "q", "15m", "15min", "15"}:
-                aggregation_normalised = "quarter"
-            else:
-                raise ValueError(
-                    "Invalid aggregation value. Use one of: 'quarter', 'hour', 'day', or None/empty."
-                )
-
-            aggregation = aggregation_normalised  # overwrite with canonical value
-
-            # ------------------------------------------------------------------ #
-            # 1. Resolve / validate timezone                                     #
-            # ------------------------------------------------------------------ #
-            tz_name = (timezone or "Europe/Amsterdam").strip()
-            if tz_name in {"CET", "CEST"}:
-                tz_name = "Europe/Amsterdam"
-
-            try:
-                tz = ZoneInfo(tz_name)
-            except ZoneInfoNotFoundError as exc:
-                raise ValueError(
-                    f"Invalid timezone '{timezone}'. Please provide a valid IANA name."
-                ) from exc
-
-            UTC = ZoneInfo("UTC")  # single UTC instance for reuse
-
-            # ------------------------------------------------------------------ #
-            # 2. Parse inputs → timezone-aware datetimes                         #
-            # ------------------------------------------------------------------ #
-            def _parse_input(val: str | datetime) -> datetime:
-                """ISO string → datetime; naïve → attach local tz."""
-                dt_obj = datetime.fromisoformat(val) if isinstance(val, str) else val
-                if dt_obj.tzinfo is None:  # treat naïve as local
-                    dt_obj = dt_obj.replace(tzinfo=tz)
-                return dt_obj
-
-            date_from_dt = _parse_input(date_from)
-            date_to_dt = _parse_input(date_to)
-
-            extra = ""
-            if date_from_dt.year < datetime.now().year:
-                raise ValueError("Date from is in the past")
-
-            # Expand “whole-day” range (00:00 → 23:59:59.999999)
-            if (
-                date_from_dt.date() == date_to_dt.date()
-                and date_from_dt.timetz() == time(0, tzinfo=tz)
-                and date_to_dt.timetz() == time(0, tzinfo=tz)
-            ):
-                date_to_dt = date_to_dt.replace(
-                    hour=23, minute=59, second=59, microsecond=999999
-                )
-
-            # Convert to **UTC** for querying
-            date_from_utc = date_from_dt.astimezone(UTC)
-            date_to_utc = date_to_dt.astimezone(UTC)
-
-            # ------------------------------------------------------------------ #
-            # 3. Fetch user id                                                   #
-            # ------------------------------------------------------------------ #
             external_user_id = self.request_headers.get("x-onesignal-external-user-id")
             if external_user_id is None:
                 raise ValueError("User ID not provided and not found in agent context.")
 
-            user = await prisma.users.find_first(
-                where=usersWhereInput(external_id=external_user_id)
-            )
+            user = await prisma.users.find_first(where=usersWhereInput(external_id=external_user_id))
             if user is None:
                 raise ValueError("User not found")
 
-            # ------------------------------------------------------------------ #
-            # 4. Retrieve raw datapoints                                         #
-            # ------------------------------------------------------------------ #
-            steps_data = await prisma.health_data_points.find_many(
-                where=health_data_pointsWhereInput(
-                    user_id=user.id,
-                    type=health_data_point_type.steps,
-                    date_from={"gte": date_from_utc},
-                    date_to={"lte": date_to_utc},
-                ),
-                order={"created_at": "asc"},
-                take=300,
-            )
-            if not steps_data:
-                return []
-
-            # ------------------------------------------------------------------ #
-            # 5. Helper: convert any str/naïve dt → ISO in *local* timezone      #
-            # ------------------------------------------------------------------ #
-            def _iso_local(val: str | datetime) -> str:
-                dt_obj = datetime.fromisoformat(val) if isinstance(val, str) else val
-                if dt_obj.tzinfo is None:  # DB can return naïve UTC
-                    dt_obj = dt_obj.replace(tzinfo=UTC)
-                return dt_obj.astimezone(tz).isoformat()
-
-            # ------------------------------------------------------------------ #
-            # 6. Aggregation                                                     #
-            # ------------------------------------------------------------------ #
-            if aggregation in {"hour", "day"}:
-                rows: list[dict[str, Any]] = await prisma.query_raw(
-                    f"""
-                    SELECT
-                        date_trunc('{aggregation}', date_from AT TIME ZONE 'UTC') AS bucket,
-                        SUM(value)::int                                          AS total
-                    FROM   health_data_points
-                    WHERE  user_id  = $1::uuid
-                    AND  type     = 'steps'
-                    AND  date_from >= $2::timestamptz
-                    AND  date_to   <= $3::timestamptz
-                    GROUP  BY bucket
-                    ORDER  BY bucket
-                    LIMIT 300
-                    """,
-                    user.id,
-                    date_from_utc,
-                    date_to_utc,
-                )
-
-                return [
-                    {
-                        "created_at": _iso_local(row["bucket"]),
-                        "value": row["total"],
-                    }
-                    for row in rows
-                ]
-
-            # ------------------------------------------------------------------ #
-            # 6b. Quarter-hour aggregation                                       #
-            # ------------------------------------------------------------------ #
-            if aggregation == "quarter":
-                from collections import defaultdict
-
-                bucket_totals: dict[str, int] = defaultdict(int)
-
-                for dp in steps_data:
-                    start_dt = _parse_input(dp.date_from)
-                    local_dt = start_dt.astimezone(tz)
-                    floored_minute = (local_dt.minute // 15) * 15
-                    bucket_dt = local_dt.replace(
-                        minute=floored_minute, second=0, microsecond=0
-                    )
-                    bucket_key = bucket_dt.isoformat()
-                    bucket_totals[bucket_key] += dp.value
-
-                sorted_rows = sorted(bucket_totals.items())[:300]
-
-                return [
-                    {"created_at": key, "value": total} for key, total in sorted_rows
-                ]
-
-            # ------------------------------------------------------------------ #
-            # 7. Raw datapoints                                                  #
-            # ------------------------------------------------------------------ #
-            return [
-                {
-                    "created_at": _iso_local(dp.created_at),
-                    "date_from": _iso_local(dp.date_from),
-                    "date_to": _iso_local(dp.date_to),
-                    "value": dp.value,
-                }
-                for dp in steps_data
-            ]
+            return await StepsService.get_steps(user.id, date_from, date_to, timezone, aggregation)
 
         def tool_create_bar_chart(
             title: str,
@@ -1149,8 +948,8 @@ class RickThropicAgent(BaseAgent[RickThropicAgentConfig]):
             tool for tool in tools if re.match(role_config.tools_regex, tool.__name__)
         ]
 
-        recurring_tasks = await self.get_metadata("recurring_tasks", [])
-        reminders = await self.get_metadata("reminders", [])
+        recurring_tasks = await ThreadItemsService.get_recurring_tasks(self.thread_id)
+        reminders = await ThreadItemsService.get_reminders(self.thread_id)
 
         response = await self.client.chat.completions.create(
             model=role_config.model,
@@ -0,0 +1,112 @@
+import json
+from collections.abc import Sequence
+from typing import Protocol
+
+from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
+from pydantic import ValidationError
+
+from src.models.multiple_choice_widget import Choice, MultipleChoiceWidget
+
+NOT_ANSWERED = "[not answered]"
+
+
+class QuestionnaireQuestion(Protocol):
+    """The shape of the `QuestionaireQuestionConfig` models of the agents."""
+
+    question: str
+    instructions: str | list[dict[str, str]]
+    name: str
+
+
+def structured_choices(question: QuestionnaireQuestion) -> list[Choice] | None:
+    """The choices of a question with a list of label and value pairs as instructions, None for free text questions."""
+
+    if not isinstance(question.instructions, list) or not question.instructions:
+        return None
+
+    if not all("label" in choice and "value" in choice for choice in question.instructions):
+        return None
+
+    return [Choice(label=choice["label"], value=choice["value"]) for choice in question.instructions]
+
+
+def is_answered(answer: str | None) -> bool:
+    return answer is not None and answer != NOT_ANSWERED and answer != ""
+
+
+def last_multiple_choice_widget(messages: Sequence[ChatCompletionMessageParam]) -> MultipleChoiceWidget | None:
+    """The multiple choice widget the last user message replies to, None when the message before it is not one."""
+
+    if len(messages) < 2 or messages[-1].get("role") != "user" or messages[-2].get("role") != "tool":
+        return None
+
+    content = messages[-2].get("content")
+
+    if not isinstance(content, str):
+        return None
+
+    try:
+        output = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+
+    if not isinstance(output, dict) or output.get("type") != "multiple_choice":
+        return None
+
+    try:
+        return MultipleChoiceWidget.model_validate(output)
+    except ValidationError:
+        return None
+
+
+def match_choice(widget: MultipleChoiceWidget, text: str) -> Choice | None:
+    """The choice the user picked, matched on its label or value, None for anything else."""
+
+    normalized_text = text.strip().casefold()
+
+    for choice in widget.choices:
+        if normalized_text in (choice.label.strip().casefold(), choice.value.strip().casefold()):
+            return choice
+
+    return None
+
+
+def find_question(
+    questions: Sequence[QuestionnaireQuestion], widget: MultipleChoiceWidget, answers: dict[str, str | None]
+) -> QuestionnaireQuestion | None:
+    """The structured question a widget asked.
+
+    Widgets from the engine carry the question text as is. A widget the model phrased itself is matched to the first
+    unanswered question with the same choice values.
+    """
+
+    structured_questions = [question for question in questions if structured_choices(question) is not None]
+
+    for question in structured_questions:
+        if question.question.strip() == widget.question.strip():
+            return question
+
+    widget_values = [choice.value for choice in widget.choices]
+
+    for question in structured_questions:
+        choices = structured_choices(question) or []
+
+        if not is_answered(answers.get(question.name)) and [choice.value for choice in choices] == widget_values:
+            return question
+
+    return None
+
+
+def next_question(
+    questions: Sequence[QuestionnaireQuestion], answers: dict[str, str | None], after: QuestionnaireQuestion
+) -> QuestionnaireQuestion | None:
+    """The first unanswered question after `after`, in the order of the questionnaire."""
+
+    names = [question.name for question in questions]
+    start = names.index(after.name) + 1 if after.name in names else 0
+
+    for question in questions[start:]:
+        if not is_answered(answers.get(question.name)):
+            return question
+
+    return None
@@ -1,24 +1,37 @@
+import asyncio
+import hashlib
 import json
 from collections.abc import AsyncGenerator
 from typing import Literal
 
-from fastapi import APIRouter, HTTPException, Path, Query, Request, Response
+from fastapi import APIRouter, Header, HTTPException, Path, Query, Request, Response
 from fastapi.responses import StreamingResponse
 
 from src.lib.prisma import prisma
 from src.logger import logger
 from src.models.chart_widget import ChartWidget
 from src.models.message_create import MessageCreateInput
-from src.models.messages import MessageResponse
+from src.models.messages import MessageContent, MessageResponse
 from src.models.multiple_choice_widget import MultipleChoiceWidget
 from src.models.pagination import Pagination
+from src.services.messages.idempotency_store import IdempotencyKeyConflictError, IdempotencyRecord, idempotency_store
 from src.services.messages.message_service import MessageService
+from src.services.messages.message_stream import (
+    MessageStream,
+    StreamReplayWindowExceededError,
+    message_streams,
+    parse_last_event_id,
+)
 from src.services.messages.utils.db_message_to_message_model import db_message_to_message_model
+from src.utils.cursor import decode_cursor, keyset_order, keyset_page, keyset_where
 from src.utils.is_valid_uuid import is_valid_uuid
-from src.utils.sse import create_sse_event
+from src.utils.prompt_budget import PromptBudget
 
 router = APIRouter()
 
+# How long a debug request waits for the first prompt to be assembled before it starts streaming without the headers
+PROMPT_BUDGET_HEADER_TIMEOUT_SECONDS = 10
+
 
 @router.get(
     "/threads/{thread_id}/messages",
@@ -35,18 +48,33 @@ async def get_messages(
     limit: int = Query(default=10, ge=1),
     offset: int = Query(default=0, ge=0),
     order: Literal["asc", "desc"] = Query(default="asc"),
+    cursor: str | None = Query(
+        default=None,
+        description="A `next_cursor` or `prev_cursor` from a previous page. Pages by cursor take the same time however "
+        "deep they are, `offset` is ignored when a cursor is given.",
+    ),
 ) -> Pagination[MessageResponse]:
+    try:
+        parsed_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+    where = {"thread_id": thread_id} if is_valid_uuid(thread_id) else {"thread": {"is": {"external_id": thread_id}}}
+
     messages = await prisma.messages.find_many(
-        where={"thread_id": thread_id} if is_valid_uuid(thread_id) else {"thread": {"is": {"external_id": thread_id}}},
-        order=[{"created_at": order}],
+        where={"AND": [where, keyset_where(order, parsed_cursor)]} if parsed_cursor else where,  # type: ignore
+        order=keyset_order(order, parsed_cursor),
         include={"contents": True},
-        take=limit,
-        skip=offset,
+        take=limit + 1,
+        skip=0 if parsed_cursor else offset,
+    )
+
+    messages, next_cursor, prev_cursor = keyset_page(
+        messages, limit, parsed_cursor, has_previous=parsed_cursor is None and offset > 0
     )
 
     message_data = [db_message_to_message_model(message) for message in messages]
 
-    return Pagination(data=message_data, limit=limit, offset=offset)
+    return Pagination(data=message_data, limit=limit, offset=offset, next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 
 @router.post(
@@ -63,6 +91,16 @@ async def create_message(
         ...,
         description="The unique identifier of the thread. Can be either the internal ID or external ID.",
     ),
+    idempotency_key: str | None = Header(
+        default=None,
+        alias="Idempotency-Key",
+        description="A unique key for this request. Retrying with the same key attaches to the running agent turn or replays its result instead of starting a new one.",
+    ),
+    debug_prompt_budget: bool = Header(
+        default=False,
+        alias="X-Debug-Prompt-Budget",
+        description="Return token estimates of the first prompt of the turn, per section and per tool schema, in `X-Prompt-Budget` response headers.",
+    ),
 ) -> StreamingResponse:
     thread = await prisma.threads.find_first(
         where={"id": thread_id} if is_valid_uuid(thread_id) else {"external_id": thread_id},
@@ -71,60 +109,242 @@ async def create_message(
     if not thread:
         raise HTTPException(status_code=404, detail="Thread not found")
 
+    fingerprint = hashlib.sha256(message.model_dump_json().encode()).hexdigest()
+
+    try:
+        idempotency_record = (
+            idempotency_store.get(thread.id, idempotency_key, fingerprint) if idempotency_key is not None else None
+        )
+    except IdempotencyKeyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+    if idempotency_record is not None:
+        message_stream = message_streams.get(idempotency_record.stream_id)
+
+        if message_stream is None:
+            # The replay buffer expired, rebuild the stream from the stored result
+            message_stream = message_streams.create(thread.id)
+            await publish_message_stream(message_stream, stored_messages(idempotency_record.message_ids))
+            idempotency_record.stream_id = message_stream.id
+
+        logger.info(f"Idempotency key {idempotency_key} matched stream {message_stream.id}, skipping agent run")
+
+        return StreamingResponse(
+            message_stream.subscribe(),
+            media_type="text/event-stream",
+            headers={
+                "Transfer-Encoding": "chunked",
+                "X-Accel-Buffering": "no",
+                "X-Stream-Id": message_stream.id,
+            },
+        )
+
     agent_config = message.agent_config.model_dump()
     del agent_config["agent_class"]
 
+    prompt_budget: asyncio.Future[PromptBudget] = asyncio.get_running_loop().create_future()
+
+    def on_prompt_budget(budget: PromptBudget) -> None:
+        if not prompt_budget.done():
+            prompt_budget.set_result(budget)
+
     forward_message_generator = MessageService.forward_message(
         thread_id=thread.id,
         agent_class=message.agent_config.agent_class,
         agent_config=agent_config,
         input_content=message.content,
         headers=dict(request.headers),
+        on_prompt_budget=on_prompt_budget if debug_prompt_budget else None,
+    )
+
+    # The agent turn runs independently of this connection so a client that drops can resume it
+    message_stream = message_streams.create(thread.id)
+
+    if idempotency_key is not None:
+        forward_message_generator = track_idempotent_messages(
+            idempotency_store.put(thread.id, idempotency_key, fingerprint, message_stream.id),
+            forward_message_generator,
+        )
+
+    message_stream.task = asyncio.create_task(publish_message_stream(message_stream, forward_message_generator))
+
+    headers = {
+        "Transfer-Encoding": "chunked",
+        "X-Accel-Buffering": "no",
+        "X-Stream-Id": message_stream.id,
+    }
+
+    if debug_prompt_budget:
+        # Headers go out before the body, so wait until the agent has built its first prompt
+        await asyncio.wait(
+            {prompt_budget, message_stream.task},
+            timeout=PROMPT_BUDGET_HEADER_TIMEOUT_SECONDS,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+
+        if prompt_budget.done():
+            headers.update(prompt_budget.result().headers())
+
+    return StreamingResponse(
+        message_stream.subscribe(),
+        media_type="text/event-stream",
+        headers=headers,
     )
 
-    async def stream() -> AsyncGenerator[str, None]:
-        max_chunk_size = 4000
-        chunk_count = 0
 
-        try:
-            async for chunk in forward_message_generator:
-                if isinstance(chunk, MessageResponse):
-                    yield create_sse_event("message", chunk.model_dump_json())
-                    continue
+@router.get(
+    "/threads/{thread_id}/messages/stream",
+    name="resume_message_stream",
+    tags=["messages"],
+    response_description="A stream of JSON-encoded message chunks",
+    responses={
+        404: {"description": "Stream not found"},
+        410: {"description": "The requested events are no longer available"},
+    },
+    description="Resumes an in-flight or recently finished message stream. Replays all events after the given `Last-Event-ID` and then follows the live stream, without calling the agent again.",
+)
+async def resume_message_stream(
+    thread_id: str = Path(
+        ...,
+        description="The unique identifier of the thread. Can be either the internal ID or external ID.",
+    ),
+    last_event_id: str = Header(
+        ...,
+        alias="Last-Event-ID",
+        description="The id of the last event the client received, as sent in the `id` field of the SSE event.",
+    ),
+) -> StreamingResponse:
+    try:
+        stream_id, last_sequence = parse_last_event_id(last_event_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    message_stream = message_streams.get(stream_id)
+
+    if not message_stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    thread = await prisma.threads.find_first(
+        where={"id": thread_id} if is_valid_uuid(thread_id) else {"external_id": thread_id},
+    )
 
-                data = chunk.model_dump_json()
-                if len(data) > max_chunk_size:
-                    yield create_sse_event("content_start", json.dumps({"chunk_id": chunk_count}))
-                    while len(data) > max_chunk_size:
-                        yield create_sse_event(
-                            "content_delta", json.dumps({"chunk_id": chunk_count, "delta": data[:max_chunk_size]})
-                        )
+    if not thread or thread.id != message_stream.thread_id:
+        raise HTTPException(status_code=404, detail="Stream not found")
 
-                        data = data[max_chunk_size:]
+    events = message_stream.subscribe(last_sequence)
 
-                    yield create_sse_event("content_delta", json.dumps({"chunk_id": chunk_count, "delta": data}))
-                    yield create_sse_event("content_end", json.dumps({"chunk_id": chunk_count}))
-                else:
-                    yield create_sse_event("content", data)
+    try:
+        # Pull the first event eagerly so an exhausted replay window surfaces as a 410 instead of a broken stream
+        first_event = await anext(events, None)
+    except StreamReplayWindowExceededError as e:
+        raise HTTPException(status_code=410, detail=str(e)) from e
 
-                chunk_count += 1
+    async def resumed_stream() -> AsyncGenerator[str, None]:
+        if first_event is None:
+            return
 
-        except Exception as e:
-            logger.exception("Error in SSE stream", exc_info=e)
-            sse_event = create_sse_event("error", json.dumps({"detail": str(e)[:max_chunk_size]}))
-            logger.warning(f"Sending sse error event to client: {sse_event}")
-            yield sse_event
+        yield first_event
+
+        async for event in events:
+            yield event
 
     return StreamingResponse(
-        stream(),
+        resumed_stream(),
         media_type="text/event-stream",
         headers={
             "Transfer-Encoding": "chunked",
             "X-Accel-Buffering": "no",
+            "X-Stream-Id": message_stream.id,
         },
     )
 
 
+async def publish_message_stream(
+    message_stream: MessageStream,
+    forward_message_generator: AsyncGenerator[MessageContent | MessageResponse, None],
+) -> None:
+    """Encode the chunks of an agent turn as SSE events and publish them to the replay buffer."""
+
+    max_chunk_size = 4000
+    chunk_count = 0
+
+    try:
+        async for chunk in forward_message_generator:
+            if isinstance(chunk, MessageResponse):
+                message_stream.publish("message", chunk.model_dump_json())
+                continue
+
+            data = chunk.model_dump_json()
+            if len(data) > max_chunk_size:
+                message_stream.publish("content_start", json.dumps({"chunk_id": chunk_count}))
+                while len(data) > max_chunk_size:
+                    message_stream.publish(
+                        "content_delta", json.dumps({"chunk_id": chunk_count, "delta": data[:max_chunk_size]})
+                    )
+
+                    data = data[max_chunk_size:]
+
+                message_stream.publish("content_delta", json.dumps({"chunk_id": chunk_count, "delta": data}))
+                message_stream.publish("content_end", json.dumps({"chunk_id": chunk_count}))
+            else:
+                message_stream.publish("content", data)
+
+            chunk_count += 1
+
+    except asyncio.CancelledError:
+        logger.info(f"Agent turn for stream {message_stream.id} was cancelled")
+        message_stream.publish("interrupted", json.dumps({"detail": "The agent turn was interrupted"}))
+        raise
+
+    except Exception as e:
+        logger.exception("Error in SSE stream", exc_info=e)
+        error_data = json.dumps({"detail": str(e)[:max_chunk_size]})
+        logger.warning(f"Sending sse error event to client: {error_data}")
+        message_stream.publish("error", error_data)
+    finally:
+        message_stream.finish()
+
+
+async def track_idempotent_messages(
+    idempotency_record: IdempotencyRecord,
+    forward_message_generator: AsyncGenerator[MessageContent | MessageResponse, None],
+) -> AsyncGenerator[MessageContent | MessageResponse, None]:
+    """Remember the messages of an idempotent run so it can be replayed after its stream expired."""
+
+    completed = False
+
+    try:
+        async for chunk in forward_message_generator:
+            if isinstance(chunk, MessageResponse):
+                idempotency_record.message_ids.append(chunk.id)
+
+            yield chunk
+
+        completed = True
+    finally:
+        # A run that failed or was interrupted must not be replayed, let the client retry with the same key
+        if not completed:
+            idempotency_store.delete(idempotency_record.thread_id, idempotency_record.key)
+
+
+async def stored_messages(message_ids: list[str]) -> AsyncGenerator[MessageContent | MessageResponse, None]:
+    """Yield stored messages in the same shape as a live agent run."""
+
+    messages = await prisma.messages.find_many(
+        where={"id": {"in": message_ids}},
+        include={"contents": {"order_by": [{"created_at": "asc"}, {"type": "asc"}]}},
+        order={"created_at": "asc"},
+    )
+
+    for message in messages:
+        message_model = db_message_to_message_model(message)
+
+        yield MessageResponse(**message_model.model_dump(exclude={"content"}), content=[])
+
+        for content in message_model.content:
+            yield content
+
+
 @router.delete(
     "/threads/{thread_id}/messages/{message_id}",
     tags=["messages"],
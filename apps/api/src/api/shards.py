@@ -0,0 +1,29 @@
+from fastapi import APIRouter
+
+from src.lib.prisma import prisma
+from src.models.scheduler import SchedulerReplicaResponse, SchedulerShardResponse, SchedulerShardsResponse
+from src.services.super_agent.shard_coordinator import shard_coordinator
+
+router = APIRouter()
+
+
+@router.get(
+    "/scheduler/shards",
+    name="get_scheduler_shards",
+    tags=["scheduler"],
+    response_model=SchedulerShardsResponse,
+    description="Returns the live API replicas and which replica runs the scheduled super agent work for each shard of the threads.",
+)
+async def get_scheduler_shards() -> SchedulerShardsResponse:
+    replicas = await prisma.scheduler_replicas.find_many(order={"id": "asc"})
+    leases = await prisma.scheduler_leases.find_many(
+        where={"shard": {"lt": shard_coordinator.shard_count}},
+        order={"shard": "asc"},
+    )
+
+    return SchedulerShardsResponse(
+        replica_id=shard_coordinator.replica_id,
+        shard_count=shard_coordinator.shard_count,
+        replicas=[SchedulerReplicaResponse(**replica.model_dump()) for replica in replicas],
+        shards=[SchedulerShardResponse(**lease.model_dump(exclude={"updated_at"})) for lease in leases],
+    )
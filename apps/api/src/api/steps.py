@@ -1,25 +1,74 @@
 import datetime
+import time
 import uuid
+from typing import Any
 
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Request, Response
 from prisma.enums import health_data_point_type, health_data_unit, health_platform
-from prisma.types import (
-    _health_data_pointsWhereUnique_source_uuid_Input,
-    health_data_pointsCreateInput,
-    health_data_pointsUpdateInput,
-    health_data_pointsUpsertInput,
-    health_data_pointsWhereInput,
-    usersCreateInput,
-    usersWhereInput,
-)
+from prisma.types import health_data_pointsWhereInput, usersCreateInput, usersWhereInput
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
 
 from src.lib.prisma import prisma
 from src.logger import logger
-from src.models.steps import LastSyncedResponse, SyncStepsInput
+from src.models.steps import (
+    LastSyncedResponse,
+    RejectedStepData,
+    StreamSyncStepsResponse,
+    SyncStepData,
+    SyncStepsInput,
+)
+from src.services.steps.steps_service import StepsService
+from src.settings import settings
+from src.utils.metrics import log_metric
+from src.utils.ndjson import iter_ndjson_lines
+
+# Invalid lines of a streamed sync that are reported back with their error, the others are only counted
+MAX_REPORTED_REJECTIONS = 100
 
 router = APIRouter()
 
 
+async def get_or_create_user_id(external_user_id: str) -> str:
+    user = await prisma.users.find_first(where=usersWhereInput(external_id=external_user_id))
+
+    if user is None:
+        user = await prisma.users.create(data=usersCreateInput(external_id=external_user_id))
+
+    return user.id
+
+
+def to_data_point(external_user_id: str, step_data: SyncStepData) -> dict[str, Any]:
+    return {
+        # Generate deterministic source_uuid if missing
+        "source_uuid": step_data.source_uuid
+        or str(
+            uuid.uuid5(
+                uuid.NAMESPACE_DNS,
+                f"{external_user_id}_{step_data.source_name}_{step_data.date_from.isoformat()}_{step_data.date_to.isoformat()}",
+            )
+        ),
+        "value": step_data.value,
+        "unit": health_data_unit(step_data.unit),
+        "date_from": step_data.date_from,
+        "date_to": step_data.date_to,
+        "health_platform": health_platform(step_data.health_platform),
+        "source_device_id": step_data.source_device_id,
+        "source_id": step_data.source_id,
+        "source_name": step_data.source_name,
+    }
+
+
+def log_sync_rate(external_user_id: str, rows: int, inserted: int, updated: int, duration: float) -> None:
+    rows_per_second = rows / duration if duration > 0 else 0.0
+
+    logger.info(
+        f"Synced {rows} steps data points for user {external_user_id} in {duration:.2f}s "
+        f"({rows_per_second:.0f} rows/s), {inserted} inserted, {updated} updated"
+    )
+    log_metric("steps.sync.rows_per_second", rows_per_second, rows=rows)
+
+
 @router.get(
     "/steps/last-synced", name="get_last_synced", description="Get the last synced date for steps", tags=["health"]
 )
@@ -55,59 +104,98 @@ async def sync_steps(
             if step_data.unit != health_data_unit.COUNT:
                 raise HTTPException(status_code=400, detail="Invalid unit")
 
-        user = await prisma.users.find_first(where=usersWhereInput(external_id=data.user_id))
-        user_id = user.id if user else None
-        if user is None:
-            user_create = await prisma.users.create(data=usersCreateInput(external_id=data.user_id))
-            user_id = user_create.id
+        user_id = await get_or_create_user_id(data.user_id)
 
-        if user_id is None:
-            # Cannot be None given the above...
-            raise HTTPException(status_code=500, detail="User not found")
+        started_at = time.perf_counter()
 
-        batcher = prisma.batch_()
-        for step_data in data.data_points:
-            # Generate deterministic source_uuid if missing
-            source_uuid_value = step_data.source_uuid or str(
-                uuid.uuid5(
-                    uuid.NAMESPACE_DNS,
-                    f"{data.user_id}_{step_data.source_name}_{step_data.date_from.isoformat()}_{step_data.date_to.isoformat()}",
-                )
-            )
+        data_points = [to_data_point(data.user_id, step_data) for step_data in data.data_points]
 
-            batcher.health_data_points.upsert(
-                where=_health_data_pointsWhereUnique_source_uuid_Input(source_uuid=source_uuid_value),
-                data=health_data_pointsUpsertInput(
-                    create=health_data_pointsCreateInput(
-                        user_id=user_id,
-                        type=health_data_point_type.steps,
-                        value=step_data.value,
-                        unit=health_data_unit(step_data.unit),
-                        date_from=step_data.date_from,
-                        date_to=step_data.date_to,
-                        source_uuid=source_uuid_value,
-                        health_platform=health_platform(step_data.health_platform),
-                        source_device_id=step_data.source_device_id,
-                        source_id=step_data.source_id,
-                        source_name=step_data.source_name,
-                    ),
-                    update=health_data_pointsUpdateInput(
-                        type=health_data_point_type.steps,
-                        value=step_data.value,
-                        unit=health_data_unit(step_data.unit),
-                        date_from=step_data.date_from,
-                        date_to=step_data.date_to,
-                        health_platform=health_platform(step_data.health_platform),
-                        source_device_id=step_data.source_device_id,
-                        source_id=step_data.source_id,
-                        source_name=step_data.source_name,
-                    ),
-                ),
-            )
+        inserted, updated = await StepsService.upsert_data_points(user_id, data_points)
+
+        log_sync_rate(data.user_id, len(data_points), inserted, updated, time.perf_counter() - started_at)
 
-        await batcher.commit()
         return Response(status_code=200)
 
     except Exception as e:
         logger.error(f"Error inserting steps data: {e}")
         raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.post(
+    "/steps/sync/stream",
+    name="sync_steps_stream",
+    description=(
+        "Sync steps data as NDJSON, one data point per line in the format of the data points of /steps/sync. "
+        "Data points are validated one by one and written in batches while the body is read, invalid lines are "
+        "rejected and reported without failing the others."
+    ),
+    tags=["health"],
+    openapi_extra={"requestBody": {"content": {"application/x-ndjson": {"schema": {"type": "string"}}}}},
+)
+async def sync_steps_stream(
+    user_id: str,
+    request: Request,
+) -> StreamSyncStepsResponse:
+    logger.info(f"Streaming steps data for user {user_id}")
+
+    try:
+        db_user_id = await get_or_create_user_id(user_id)
+        started_at = time.perf_counter()
+
+        accepted = 0
+        inserted = 0
+        updated = 0
+        rejected = 0
+        errors: list[RejectedStepData] = []
+        batch: list[dict[str, Any]] = []
+
+        async def write_batch() -> None:
+            nonlocal inserted, updated
+
+            batch_inserted, batch_updated = await StepsService.upsert_data_points(db_user_id, batch)
+            inserted += batch_inserted
+            updated += batch_updated
+            batch.clear()
+
+        async for line_number, line in iter_ndjson_lines(request.stream(), settings.STEPS_STREAM_MAX_LINE_BYTES):
+            try:
+                if line is None:
+                    raise ValueError(f"Line is longer than {settings.STEPS_STREAM_MAX_LINE_BYTES} bytes")
+
+                step_data = SyncStepData.model_validate_json(line)
+
+                if step_data.unit != health_data_unit.COUNT:
+                    raise ValueError("Invalid unit")
+            except (ValidationError, ValueError) as e:
+                rejected += 1
+
+                if len(errors) < MAX_REPORTED_REJECTIONS:
+                    errors.append(RejectedStepData(line=line_number, error=str(e)))
+
+                continue
+
+            accepted += 1
+            batch.append(to_data_point(user_id, step_data))
+
+            if len(batch) >= settings.STEPS_SYNC_CHUNK_SIZE:
+                await write_batch()
+
+        if batch:
+            await write_batch()
+
+        log_sync_rate(user_id, accepted, inserted, updated, time.perf_counter() - started_at)
+
+        if rejected:
+            logger.warning(f"Rejected {rejected} steps data points for user {user_id}")
+
+        return StreamSyncStepsResponse(
+            accepted=accepted, inserted=inserted, updated=updated, rejected=rejected, errors=errors
+        )
+
+    except ClientDisconnect as e:
+        logger.warning(f"Client disconnected while streaming steps data for user {user_id}")
+        raise HTTPException(status_code=400, detail="Client disconnected") from e
+
+    except Exception as e:
+        logger.error(f"Error inserting steps data: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
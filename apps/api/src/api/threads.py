@@ -1,22 +1,97 @@
-from typing import Literal
+import json
+from collections.abc import Collection
+from typing import Any, Literal
 
 from fastapi import APIRouter, HTTPException, Path, Query, Response
+from prisma import models
 
 from src.lib.prisma import prisma
 from src.models.pagination import Pagination
-from src.models.threads import ThreadCreateInput, ThreadResponse
+from src.models.threads import ThreadCreateInput, ThreadInclude, ThreadResponse
 from src.services.messages.utils.db_message_to_message_model import db_message_to_message_model
+from src.utils.cursor import decode_cursor, keyset_order, keyset_page, keyset_where
 from src.utils.is_valid_uuid import is_valid_uuid
 
 router = APIRouter()
 
+INCLUDE_DESCRIPTION = (
+    "What to return with each thread: `messages` for all messages with their contents, `last_message` for the most "
+    "recent message and `counts` for the number of messages. Repeat the parameter to include more than one."
+)
+SUMMARY_INCLUDE_QUERY = Query(default=["last_message", "counts"], description=INCLUDE_DESCRIPTION)
+MESSAGES_INCLUDE_QUERY = Query(default=["messages"], description=INCLUDE_DESCRIPTION)
+
+
+def messages_include(include: Collection[ThreadInclude], order: Literal["asc", "desc"]) -> dict[str, Any] | None:
+    if "messages" not in include:
+        return None
+
+    return {"messages": {"order_by": {"created_at": order}, "include": {"contents": True}}}
+
+
+async def to_thread_responses(
+    threads: list[models.threads], include: Collection[ThreadInclude]
+) -> list[ThreadResponse]:
+    """The responses for `threads`, with the message counts and last messages of all of them read in one query."""
+
+    summaries: dict[str, dict[str, Any]] = {}
+    last_messages: dict[str, models.messages] = {}
+
+    if threads and ("last_message" in include or "counts" in include):
+        rows = await prisma.query_raw(
+            """
+            SELECT
+                t.id AS thread_id,
+                (SELECT COUNT(*)::int FROM messages m WHERE m.thread_id = t.id) AS message_count,
+                (
+                    SELECT m.id FROM messages m
+                    WHERE m.thread_id = t.id
+                    ORDER BY m.created_at DESC, m.id DESC
+                    LIMIT 1
+                ) AS last_message_id
+            FROM threads t
+            WHERE t.id IN (SELECT value::uuid FROM jsonb_array_elements_text($1::jsonb))
+            """,
+            json.dumps([thread.id for thread in threads]),
+        )
+        summaries = {row["thread_id"]: row for row in rows}
+
+        last_message_ids = [row["last_message_id"] for row in rows if row["last_message_id"] is not None]
+
+        if "last_message" in include and last_message_ids:
+            last_messages = {
+                message.id: message
+                for message in await prisma.messages.find_many(
+                    where={"id": {"in": last_message_ids}}, include={"contents": True}
+                )
+            }
+
+    responses = []
+
+    for thread in threads:
+        summary = summaries.get(thread.id, {})
+        last_message = last_messages.get(summary.get("last_message_id") or "")
+
+        responses.append(
+            ThreadResponse(
+                **thread.model_dump(exclude={"messages"}),
+                messages=[db_message_to_message_model(message) for message in thread.messages or []]
+                if "messages" in include
+                else None,
+                last_message=db_message_to_message_model(last_message) if last_message else None,
+                message_count=summary.get("message_count", 0) if "counts" in include else None,
+            )
+        )
+
+    return responses
+
 
 @router.get(
     "/threads",
     name="get_threads",
     tags=["threads"],
     response_model=Pagination[ThreadResponse],
-    description="Retrieves all threads. Returns a list of all threads with their messages by default in descending chronological order (newest first). Each message includes its full content.",
+    description="Retrieves all threads, by default in descending chronological order (newest first). By default each thread comes with its last message and message count, include `messages` to get all messages with their full content.",
 )
 async def get_threads(
     limit: int = Query(
@@ -26,31 +101,36 @@ async def get_threads(
     ),
     offset: int = Query(default=0, ge=0),
     order: Literal["asc", "desc"] = Query(default="desc"),
+    cursor: str | None = Query(
+        default=None,
+        description="A `next_cursor` or `prev_cursor` from a previous page. Pages by cursor take the same time however "
+        "deep they are, `offset` is ignored when a cursor is given.",
+    ),
+    include: list[ThreadInclude] = SUMMARY_INCLUDE_QUERY,
 ) -> Pagination[ThreadResponse]:
+    try:
+        parsed_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
     threads = await prisma.threads.find_many(
-        take=limit,
-        skip=offset,
-        order={"created_at": order},
-        include={
-            "messages": {
-                "order_by": {"created_at": order},
-                "include": {
-                    "contents": True,
-                },
-            }
-        },
+        where=keyset_where(order, parsed_cursor) if parsed_cursor else None,
+        take=limit + 1,
+        skip=0 if parsed_cursor else offset,
+        order=keyset_order(order, parsed_cursor),
+        include=messages_include(include, order),  # type: ignore
+    )
+
+    threads, next_cursor, prev_cursor = keyset_page(
+        threads, limit, parsed_cursor, has_previous=parsed_cursor is None and offset > 0
     )
 
     return Pagination(
-        data=[
-            ThreadResponse(
-                **thread.model_dump(exclude={"messages"}),
-                messages=[db_message_to_message_model(message) for message in thread.messages or []],
-            )
-            for thread in threads
-        ],
+        data=await to_thread_responses(threads, include),
         limit=limit,
         offset=offset,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
     )
 
 
@@ -62,7 +142,7 @@ async def get_threads(
     responses={
         404: {"description": "Thread not found"},
     },
-    description="Retrieves a specific thread by its unique ID. Returns the thread details along with its messages in descending chronological order (newest first). Each message includes its full content.",
+    description="Retrieves a specific thread by its unique ID. Returns the thread details along with its messages in descending chronological order (newest first), each with its full content. Use `include` to get the last message and message count instead.",
 )
 async def get_thread_by_id(
     _id: str = Path(
@@ -70,26 +150,17 @@ async def get_thread_by_id(
         alias="id",
         description="The unique identifier of the thread. Can be either the internal ID or external ID.",
     ),
+    include: list[ThreadInclude] = MESSAGES_INCLUDE_QUERY,
 ) -> ThreadResponse:
     thread = await prisma.threads.find_first(
         where={"id": _id} if is_valid_uuid(_id) else {"external_id": _id},
-        include={
-            "messages": {
-                "order_by": {"created_at": "desc"},
-                "include": {
-                    "contents": True,
-                },
-            }
-        },
+        include=messages_include(include, "desc"),  # type: ignore
     )
 
     if not thread:
         raise HTTPException(status_code=404, detail="Thread not found")
 
-    return ThreadResponse(
-        **thread.model_dump(exclude={"messages"}),
-        messages=[db_message_to_message_model(message) for message in thread.messages or []],
-    )
+    return (await to_thread_responses([thread], include))[0]
 
 
 @router.post(
@@ -97,9 +168,12 @@ async def get_thread_by_id(
     name="create_thread",
     tags=["threads"],
     response_model=ThreadResponse,
-    description="Creates a new thread or returns the existing thread if it already exists.",
+    description="Creates a new thread or returns the existing thread if it already exists. The thread comes with its last message and message count, include `messages` to get all of its messages.",
 )
-async def create_thread(thread: ThreadCreateInput) -> ThreadResponse:
+async def create_thread(
+    thread: ThreadCreateInput,
+    include: list[ThreadInclude] = SUMMARY_INCLUDE_QUERY,
+) -> ThreadResponse:
     if thread.external_id:
         result = await prisma.threads.upsert(
             where={
@@ -111,32 +185,15 @@ async def create_thread(thread: ThreadCreateInput) -> ThreadResponse:
                 },
                 "update": {},
             },
-            include={
-                "messages": {
-                    "order_by": {"created_at": "desc"},
-                    "include": {
-                        "contents": True,
-                    },
-                }
-            },
+            include=messages_include(include, "desc"),  # type: ignore
         )
     else:
         result = await prisma.threads.create(
             data={"external_id": thread.external_id},
-            include={
-                "messages": {
-                    "order_by": {"created_at": "desc"},
-                    "include": {
-                        "contents": True,
-                    },
-                }
-            },
+            include=messages_include(include, "desc"),  # type: ignore
         )
 
-    return ThreadResponse(
-        **result.model_dump(exclude={"messages"}),
-        messages=[db_message_to_message_model(message) for message in result.messages or []],
-    )
+    return (await to_thread_responses([result], include))[0]
 
 
 @router.delete(
@@ -1,3 +1,18 @@
 from prisma import Prisma
 
 prisma = Prisma()
+
+# Indexes that schema.prisma cannot express. `prisma db push` may drop them, they are created again on startup
+EXPRESSION_INDEXES = {
+    # The latest thread per OneSignal id, see `SuperAgentService.get_super_agent_threads`
+    "threads_onesignal_id_created_at_idx": """
+        CREATE INDEX IF NOT EXISTS threads_onesignal_id_created_at_idx
+        ON threads ((metadata->>'onesignal_id'), created_at DESC)
+        WHERE metadata->>'onesignal_id' IS NOT NULL
+    """,
+}
+
+
+async def create_expression_indexes() -> None:
+    for sql in EXPRESSION_INDEXES.values():
+        await prisma.execute_raw(sql)
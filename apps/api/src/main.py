@@ -13,14 +13,17 @@ from graphiti_core import Graphiti
 from graphiti_core.llm_client import LLMConfig, OpenAIClient
 from weaviate.classes.config import DataType, Property
 
-from src.api import health, knowledge, messages, steps, threads
+from src.api import health, knowledge, messages, shards, steps, threads
 from src.lib import graphiti as graphiti_lib
 from src.lib.openai import openai_client
-from src.lib.prisma import prisma
+from src.lib.prisma import create_expression_indexes, prisma
 from src.lib.scheduler import scheduler
 from src.lib.weaviate import weaviate_client
 from src.logger import logger
 from src.security.api_token import verify_api_key
+from src.services.one_signal.one_signal_service import OneSignalService
+from src.services.super_agent.reminder_scheduler import ReminderScheduler
+from src.services.super_agent.shard_coordinator import shard_coordinator
 from src.services.super_agent.super_agent_service import SuperAgentService
 from src.settings import settings
 
@@ -69,16 +72,29 @@ async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
 
     await prisma.connect()
 
+    try:
+        await create_expression_indexes()
+    except Exception as e:
+        logger.warning(f"Error creating expression indexes: {e}", exc_info=True)
+
     scheduler.start()
 
+    await shard_coordinator.start(renew_seconds=settings.SUPER_AGENT_LEASE_RENEW_SECONDS)
+
     await SuperAgentService.register_super_agents()
 
+    await ReminderScheduler.start(reconcile_seconds=settings.SUPER_AGENT_LEASE_RENEW_SECONDS)
+
     yield
 
+    await shard_coordinator.stop()
+
     await prisma.disconnect()
 
     scheduler.shutdown()
 
+    OneSignalService.close()
+
     if graphiti_lib.graphiti_connection:
         await graphiti_lib.graphiti_connection.close()
 
@@ -111,8 +127,15 @@ async def add_process_time_header(request: Request, call_next: Callable[[Request
     return response
 
 
+# Endpoints that read large request bodies as a stream and may take longer than the request timeout
+TIMEOUT_EXEMPT_PATHS = {"/steps/sync/stream"}
+
+
 @app.middleware("http")
 async def timeout_middleware(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    if request.url.path.removeprefix(request.scope.get("root_path", "")) in TIMEOUT_EXEMPT_PATHS:
+        return await call_next(request)
+
     try:
         async with asyncio.timeout(90):  # 90 second timeout
             response = await call_next(request)
@@ -147,3 +170,4 @@ app.include_router(threads.router)
 app.include_router(messages.router)
 app.include_router(knowledge.router)
 app.include_router(steps.router)
+app.include_router(shards.router)
@@ -92,4 +92,6 @@ class MessageResponse(BaseModel):
 
     tool_use_id: str | None = None
 
+    interrupted: bool = Field(default=False, description="Whether the turn was cut short before it finished.")
+
     content: list[Annotated[MessageContent, Field(discriminator="type")]]
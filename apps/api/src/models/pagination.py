@@ -9,3 +9,5 @@ class Pagination(BaseModel, Generic[T]):
     data: list[T]
     limit: int
     offset: int
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
@@ -0,0 +1,22 @@
+import datetime
+
+from pydantic import BaseModel, Field
+
+
+class SchedulerReplicaResponse(BaseModel):
+    id: str
+    heartbeat_at: datetime.datetime
+    created_at: datetime.datetime
+
+
+class SchedulerShardResponse(BaseModel):
+    shard: int
+    owner: str | None = Field(description="The replica that runs the scheduled work for this shard, if any.")
+    expires_at: datetime.datetime
+
+
+class SchedulerShardsResponse(BaseModel):
+    replica_id: str = Field(description="The replica that handled this request.")
+    shard_count: int
+    replicas: list[SchedulerReplicaResponse]
+    shards: list[SchedulerShardResponse]
@@ -23,3 +23,16 @@ class SyncStepData(BaseModel):
 class SyncStepsInput(BaseModel):
     user_id: str
     data_points: list[SyncStepData]
+
+
+class RejectedStepData(BaseModel):
+    line: int
+    error: str
+
+
+class StreamSyncStepsResponse(BaseModel):
+    accepted: int
+    inserted: int
+    updated: int
+    rejected: int
+    errors: list[RejectedStepData]
@@ -1,4 +1,5 @@
 import datetime
+from typing import Literal
 
 from pydantic import BaseModel, Field
 
@@ -12,10 +13,21 @@ class ThreadCreateInput(BaseModel):
     )
 
 
+ThreadInclude = Literal["messages", "last_message", "counts"]
+
+
 class ThreadResponse(BaseModel):
     id: str
     external_id: str | None
     created_at: datetime.datetime
     updated_at: datetime.datetime
     metadata: dict
-    messages: list[MessageResponse]
+    messages: list[MessageResponse] | None = Field(
+        None, description="All messages of the thread, only returned when `messages` is included."
+    )
+    last_message: MessageResponse | None = Field(
+        None, description="The most recent message of the thread, only returned when `last_message` is included."
+    )
+    message_count: int | None = Field(
+        None, description="The number of messages in the thread, only returned when `counts` is included."
+    )
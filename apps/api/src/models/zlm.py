@@ -0,0 +1,40 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class ZLMQuestionnaireAnswers(BaseModel):
+    """Validated answers for the Ziektelastmeter COPD questionnaire (G1–G22)."""
+
+    G1: int = Field(..., ge=0, le=6)
+    G2: int = Field(..., ge=0, le=6)
+    G3: int = Field(..., ge=0, le=6)
+    G4: int = Field(..., ge=0, le=6)
+    G5: int = Field(..., ge=0, le=6)
+    G6: int = Field(..., ge=0, le=6)
+    G7: int = Field(..., ge=0, le=6)
+    G8: int = Field(..., ge=0, le=6)
+    G9: int = Field(..., ge=0, le=6)
+    G10: int = Field(..., ge=0, le=6)
+    G11: int = Field(..., ge=0, le=6)
+    G12: int = Field(..., ge=0, le=6)
+    G13: int = Field(..., ge=0, le=6)
+    G14: int = Field(..., ge=0, le=6)
+    G15: int = Field(..., ge=0, le=6)
+    G16: int = Field(..., ge=0, le=6)
+    G17: int = Field(..., ge=0, le=4)
+    G18: int = Field(..., ge=0, le=6)
+    G19: int = Field(..., ge=0, le=6)
+    G20: Literal["nooit", "vroeger", "ja"]
+    G21: float = Field(..., gt=0)
+    G22: float = Field(..., gt=0)
+
+
+class ZLMScores(BaseModel):
+    """Domain scores (0-6, 0 is good) of one completed questionnaire, with the scores of the one before it."""
+
+    scores: dict[str, float] = Field(..., description="The score per domain")
+    bmi_value: float = Field(..., description="The BMI the gewicht_bmi score is based on")
+    previous_scores: dict[str, float] | None = Field(
+        default=None, description="The score per domain of the previous questionnaire, if any"
+    )
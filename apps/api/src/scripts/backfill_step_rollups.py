@@ -0,0 +1,65 @@
+"""Build `health_step_rollups` from the existing step data points.
+
+Run after `prisma db push` adds the table, or after changing STEPS_ROLLUP_TIMEZONES, from `apps/api`:
+
+    uv run python src/scripts/backfill_step_rollups.py
+
+Every user is rebuilt in its own transaction, so the script can be stopped and run again.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from src.lib.prisma import prisma
+from src.logger import logger
+from src.services.steps.steps_service import StepsService
+
+BATCH_SIZE = 500
+
+
+async def main() -> None:
+    await prisma.connect()
+
+    rebuilt = 0
+    failed = 0
+    last_id = "00000000-0000-0000-0000-000000000000"
+
+    try:
+        while True:
+            batch = await prisma.users.query_raw(
+                """
+                SELECT * FROM users
+                WHERE id > $1::uuid AND EXISTS (
+                    SELECT 1 FROM health_data_points WHERE user_id = users.id AND type = 'steps'
+                )
+                ORDER BY id
+                LIMIT $2
+                """,
+                last_id,
+                BATCH_SIZE,
+            )
+
+            if not batch:
+                break
+
+            for user in batch:
+                try:
+                    await StepsService.rebuild_rollups(user.id)
+                    rebuilt += 1
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Could not rebuild the step rollups of user {user.id}: {e}", exc_info=e)
+
+            last_id = batch[-1].id
+            logger.info(f"Rebuilt the step rollups of {rebuilt} users, {failed} failed")
+    finally:
+        await prisma.disconnect()
+
+    logger.info(f"Done, rebuilt the step rollups of {rebuilt} users, {failed} failed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""Move the memories, reminders, recurring tasks and notifications out of `threads.metadata` into their own tables.
+
+Run once after `prisma db push`, from `apps/api`:
+
+    uv run python src/scripts/migrate_thread_metadata.py
+
+Threads are migrated one transaction at a time, and rows that already exist are skipped, so the script can be
+stopped and run again.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import UTC, datetime
+
+sys.path.append(os.getcwd())
+
+from prisma.models import threads
+
+from src.lib.prisma import prisma
+from src.logger import logger
+from src.services.super_agent.due_items import parse_datetime
+
+BATCH_SIZE = 500
+
+
+def new_id() -> str:
+    return str(uuid.uuid4())[:8]
+
+
+async def migrate_thread(thread: threads) -> None:
+    metadata = dict(thread.metadata) or {}
+    onesignal_id = metadata.get("onesignal_id")
+
+    async with prisma.tx() as tx:
+        await tx.thread_memories.create_many(
+            data=[
+                {"id": memory.get("id") or new_id(), "thread_id": thread.id, "memory": memory["memory"]}
+                for memory in metadata.get("memories", [])
+                if memory.get("memory")
+            ],
+            skip_duplicates=True,
+        )
+        await tx.thread_reminders.create_many(
+            data=[
+                {
+                    "id": reminder.get("id") or new_id(),
+                    "thread_id": thread.id,
+                    "date": reminder.get("date", ""),
+                    "due_at": parse_datetime(reminder.get("date", "")),
+                    "message": reminder.get("message", ""),
+                }
+                for reminder in metadata.get("reminders", [])
+            ],
+            skip_duplicates=True,
+        )
+        await tx.thread_recurring_tasks.create_many(
+            data=[
+                {
+                    "id": task.get("id") or new_id(),
+                    "thread_id": thread.id,
+                    "cron_expression": task.get("cron_expression", ""),
+                    "task": task.get("task", ""),
+                }
+                for task in metadata.get("recurring_tasks", [])
+            ],
+            skip_duplicates=True,
+        )
+        await tx.thread_notifications.create_many(
+            data=[
+                {
+                    "id": notification.get("id") or str(uuid.uuid4()),
+                    "thread_id": thread.id,
+                    "onesignal_id": onesignal_id,
+                    "title": notification.get("title", ""),
+                    "contents": notification.get("contents", ""),
+                    "sent_at": parse_datetime(notification.get("sent_at", "")) or datetime.now(UTC),
+                }
+                for notification in metadata.get("notifications", [])
+            ],
+            skip_duplicates=True,
+        )
+        await tx.execute_raw(
+            """
+            UPDATE threads
+            SET metadata = metadata - 'memories' - 'reminders' - 'recurring_tasks' - 'notifications'
+            WHERE id = $1::uuid
+            """,
+            thread.id,
+        )
+
+
+async def main() -> None:
+    await prisma.connect()
+
+    migrated = 0
+    failed = 0
+    last_id = "00000000-0000-0000-0000-000000000000"
+
+    try:
+        while True:
+            batch = await prisma.threads.query_raw(
+                """
+                SELECT * FROM threads
+                WHERE id > $1::uuid AND metadata ?| array['memories', 'reminders', 'recurring_tasks', 'notifications']
+                ORDER BY id
+                LIMIT $2
+                """,
+                last_id,
+                BATCH_SIZE,
+            )
+
+            if not batch:
+                break
+
+            for thread in batch:
+                try:
+                    await migrate_thread(thread)
+                    migrated += 1
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Could not migrate the metadata of thread {thread.id}: {e}", exc_info=e)
+
+            last_id = batch[-1].id
+            logger.info(f"Migrated {migrated} threads, {failed} failed")
+    finally:
+        await prisma.disconnect()
+
+    logger.info(f"Done, migrated {migrated} threads, {failed} failed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import time
+
+from pydantic import BaseModel, Field
+
+from src.settings import settings
+
+
+class IdempotencyKeyConflictError(Exception):
+    pass
+
+
+class IdempotencyRecord(BaseModel):
+    thread_id: str
+    key: str
+    fingerprint: str
+    stream_id: str
+    expires_at: float
+    message_ids: list[str] = Field(default_factory=list)
+
+
+class IdempotencyStore:
+    """In-memory store that maps `Idempotency-Key` headers to the agent run they started."""
+
+    def __init__(self, ttl_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._records: dict[tuple[str, str], IdempotencyRecord] = {}
+
+    def get(self, thread_id: str, key: str, fingerprint: str) -> IdempotencyRecord | None:
+        """Get the record for a key within a thread.
+
+        Raises:
+            IdempotencyKeyConflictError: The key was already used for a different request body.
+        """
+
+        self._prune()
+
+        record = self._records.get((thread_id, key))
+
+        if record is None:
+            return None
+
+        if record.fingerprint != fingerprint:
+            raise IdempotencyKeyConflictError(f"Idempotency key {key} was already used with a different request")
+
+        return record
+
+    def put(self, thread_id: str, key: str, fingerprint: str, stream_id: str) -> IdempotencyRecord:
+        record = IdempotencyRecord(
+            thread_id=thread_id,
+            key=key,
+            fingerprint=fingerprint,
+            stream_id=stream_id,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+
+        self._records[(thread_id, key)] = record
+
+        return record
+
+    def delete(self, thread_id: str, key: str) -> None:
+        self._records.pop((thread_id, key), None)
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+
+        for record_key, record in list(self._records.items()):
+            if record.expires_at <= now:
+                del self._records[record_key]
+
+
+idempotency_store = IdempotencyStore(ttl_seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
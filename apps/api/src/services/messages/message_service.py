@@ -1,5 +1,6 @@
+import asyncio
 import uuid
-from collections.abc import AsyncGenerator, Iterable
+from collections.abc import AsyncGenerator, Callable, Iterable
 
 from openai.types.chat import ChatCompletionMessageParam
 from prisma import Base64, Json
@@ -28,6 +29,7 @@ from src.models.messages import (
 from src.services.messages.utils.db_message_to_openai_param import db_message_to_openai_param
 from src.services.messages.utils.generated_message_to_openai_param import generated_message_to_openai_param
 from src.services.messages.utils.input_message_to_openai_param import input_content_to_openai_param
+from src.utils.prompt_budget import PromptBudget
 
 
 class AgentNotFoundError(Exception):
@@ -44,6 +46,7 @@ class MessageService:
         agent_config: dict,
         headers: dict,
         max_recursion_depth: int = 15,
+        on_prompt_budget: Callable[[PromptBudget], None] | None = None,
     ) -> AsyncGenerator[MessageContent | MessageResponse, None]:
         """Forward a message to the agent and yield the individual chunks of the response. Will also save the user message and the agent response to the database.
 
@@ -54,6 +57,7 @@ class MessageService:
             agent_config (dict): The config of the agent.
             headers (dict): The headers of the request.
             max_recursion_depth (int): The maximum depth of recursion for the agent.
+            on_prompt_budget (Callable[[PromptBudget], None] | None): Called with the token estimates of each prompt.
         Raises:
             AgentNotFoundError: The agent class was not found.
 
@@ -72,6 +76,8 @@ class MessageService:
         if not agent:
             raise AgentNotFoundError(f"Agent class {agent_class} not found")
 
+        agent.on_prompt_budget = on_prompt_budget
+
         logger.info(f"Agent {agent_class} loaded")
 
         logger.info("Getting thread history")
@@ -105,12 +111,20 @@ class MessageService:
 
         yielded_messages: set[str] = set()
 
+        # Text that has only been streamed as deltas so far, keyed by content id
+        partial_texts: dict[str, str] = {}
+
         try:
             async for content_chunk, messages in cls.call_agent(
                 agent, thread_history, generated_messages, max_recursion_depth
             ):
                 generated_messages = messages
 
+                if isinstance(content_chunk, TextDeltaContent):
+                    partial_texts[content_chunk.id] = partial_texts.get(content_chunk.id, "") + content_chunk.delta
+                elif isinstance(content_chunk, TextContent):
+                    partial_texts.pop(content_chunk.id, None)
+
                 for message in messages:
                     if message.id in yielded_messages:
                         continue
@@ -121,10 +135,46 @@ class MessageService:
 
                 yield content_chunk
 
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.warning(f"Forwarding message for thread {thread_id} was interrupted, saving the partial turn")
+
+            # Shield the save so a second cancellation doesn't lose the partial turn as well
+            await asyncio.shield(
+                cls.save_turn(
+                    thread_id,
+                    agent_class,
+                    input_content,
+                    interrupted_messages(generated_messages, partial_texts),
+                    interrupted=True,
+                )
+            )
+            raise
+
         except Exception as e:
             logger.error(f"Error forwarding message: {e}", exc_info=e)
             raise e
 
+        await cls.save_turn(thread_id, agent_class, input_content, generated_messages)
+
+    @classmethod
+    async def save_turn(
+        cls,
+        thread_id: str,
+        agent_class: str,
+        input_content: list[MessageCreateInputContent],
+        generated_messages: list[MessageResponse],
+        interrupted: bool = False,
+    ) -> None:
+        """Save the user message and the messages generated by the agent.
+
+        Args:
+            thread_id (str): The ID of the thread.
+            agent_class (str): The class of the agent.
+            input_content (list[MessageCreateInputContent]): The content of the user message.
+            generated_messages (list[MessageResponse]): The messages generated by the agent.
+            interrupted (bool): Whether the turn was cut short, e.g. because the client disconnected.
+        """
+
         await prisma.messages.create(
             data={
                 "agent_class": agent_class,
@@ -165,6 +215,7 @@ class MessageService:
                     "thread_id": thread_id,
                     "role": message_role[message.role],
                     "tool_use_id": message.tool_use_id,
+                    "interrupted": interrupted,
                     "contents": {
                         "create": [
                             {
@@ -277,3 +328,45 @@ class MessageService:
                 current_depth + 1,
             ):
                 yield nested_chunk, nested_messages
+
+
+def interrupted_messages(
+    generated_messages: list[MessageResponse], partial_texts: dict[str, str]
+) -> list[MessageResponse]:
+    """Close off the messages of an interrupted turn so they can be stored and replayed to the model.
+
+    Text that was only streamed as deltas is added to the last assistant message, and every tool use without
+    a result gets an error result so the history stays valid for the next model call.
+    """
+
+    messages = [message.model_copy(deep=True) for message in generated_messages]
+
+    last_assistant_message = next((message for message in reversed(messages) if message.role == "assistant"), None)
+
+    if last_assistant_message is not None:
+        last_assistant_message.content.extend(
+            TextContent(id=content_id, text=text) for content_id, text in partial_texts.items() if text.strip() != ""
+        )
+
+    answered_tool_use_ids = {message.tool_use_id for message in messages if message.role == "tool"}
+
+    for message in list(messages):
+        for content in message.content:
+            if isinstance(content, ToolUseContent) and content.tool_use_id not in answered_tool_use_ids:
+                messages.append(
+                    MessageResponse(
+                        id=str(uuid.uuid4()),
+                        role="tool",
+                        tool_use_id=content.tool_use_id,
+                        content=[
+                            ToolResultContent(
+                                id=str(uuid.uuid4()),
+                                tool_use_id=content.tool_use_id,
+                                output="Interrupted: the client disconnected before the tool finished",
+                                is_error=True,
+                            )
+                        ],
+                    )
+                )
+
+    return [message for message in messages if len(message.content) > 0]
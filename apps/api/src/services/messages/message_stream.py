@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from collections.abc import AsyncGenerator
+
+from src.logger import logger
+from src.settings import settings
+from src.utils.sse import create_sse_event
+
+
+class StreamReplayWindowExceededError(Exception):
+    pass
+
+
+class MessageStream:
+    """Bounded replay buffer for the SSE events of a single agent turn.
+
+    Every event gets a monotonic sequence number. Subscribers can (re)attach at any point and will first
+    receive the buffered events after their last seen sequence, followed by the live events.
+    """
+
+    def __init__(self, thread_id: str, max_events: int, disconnect_grace_seconds: float) -> None:
+        self.id = str(uuid.uuid4())
+        self.thread_id = thread_id
+        self.events: deque[tuple[int, str]] = deque(maxlen=max_events)
+        self.sequence = 0
+        self.is_finished = False
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self.subscriber_count = 0
+        self.disconnect_grace_seconds = disconnect_grace_seconds
+        self._updated = asyncio.Event()
+        self._cancel_handle: asyncio.TimerHandle | None = None
+
+    def event_id(self, sequence: int) -> str:
+        return f"{self.id}:{sequence}"
+
+    def publish(self, event: str, data: str) -> None:
+        if self.is_finished:
+            raise RuntimeError(f"Cannot publish to finished stream {self.id}")
+
+        self.sequence += 1
+        self.events.append((self.sequence, create_sse_event(event, data, self.event_id(self.sequence))))
+        self._notify()
+
+    def finish(self) -> None:
+        if self.is_finished:
+            return
+
+        self.is_finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def subscribe(self, last_sequence: int = 0) -> AsyncGenerator[str, None]:
+        """Yield all events after `last_sequence`, then follow the live stream until the turn finishes.
+
+        A subscriber that falls behind the replay buffer gets a final `replay_window_exceeded` event with the id of the
+        last event it received.
+
+        Raises:
+            StreamReplayWindowExceededError: The requested events were already evicted from the buffer.
+        """
+
+        self._check_replay_window(last_sequence)
+
+        cursor = last_sequence
+
+        self._attach()
+
+        try:
+            while True:
+                updated = self._updated
+
+                # A slow subscriber can fall behind by more than the buffer holds while it is suspended. End its
+                # stream rather than skip the evicted events, the client resumes from its last event and gets a 410
+                if self._is_evicted(cursor):
+                    logger.warning(f"Subscriber of stream {self.id} fell behind the replay buffer at event {cursor}")
+                    yield create_sse_event(
+                        "replay_window_exceeded", json.dumps({"last_event_id": self.event_id(cursor)})
+                    )
+                    return
+
+                # New events always sit at the right end of the buffer, so index from there. Take a snapshot
+                # first, the producer keeps appending while we are suspended in a yield.
+                pending = [
+                    self.events[-offset] for offset in range(min(self.sequence - cursor, len(self.events)), 0, -1)
+                ]
+
+                for sequence, encoded_event in pending:
+                    cursor = sequence
+                    yield encoded_event
+
+                if self.is_finished and cursor >= self.sequence:
+                    return
+
+                await updated.wait()
+        finally:
+            self._detach()
+
+    def _is_evicted(self, cursor: int) -> bool:
+        """Whether events right after `cursor` were already evicted from the buffer."""
+
+        return bool(self.events) and cursor < self.events[0][0] - 1
+
+    def _check_replay_window(self, cursor: int) -> None:
+        if self._is_evicted(cursor):
+            raise StreamReplayWindowExceededError(
+                f"Event {cursor} of stream {self.id} is no longer in the replay buffer"
+            )
+
+    def _attach(self) -> None:
+        self.subscriber_count += 1
+
+        if self._cancel_handle is not None:
+            logger.info(f"Client reattached to stream {self.id}, keeping the agent turn alive")
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+
+    def _detach(self) -> None:
+        self.subscriber_count -= 1
+
+        if self.subscriber_count > 0 or self.is_finished or self.task is None:
+            return
+
+        # Give flaky clients a moment to resume before we stop paying for the model and tools
+        self._cancel_handle = asyncio.get_running_loop().call_later(
+            self.disconnect_grace_seconds, self._cancel_abandoned_task
+        )
+
+    def _cancel_abandoned_task(self) -> None:
+        self._cancel_handle = None
+
+        if self.subscriber_count > 0 or self.is_finished or self.task is None or self.task.done():
+            return
+
+        logger.info(f"All clients disconnected from stream {self.id}, cancelling the agent turn")
+        self.task.cancel()
+
+    def _notify(self) -> None:
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+
+class MessageStreamRegistry:
+    """Keeps in-flight and recently finished message streams around so clients can resume them."""
+
+    def __init__(
+        self, max_events: int, retention_seconds: float, max_streams: int, disconnect_grace_seconds: float
+    ) -> None:
+        self.max_events = max_events
+        self.retention_seconds = retention_seconds
+        self.max_streams = max_streams
+        self.disconnect_grace_seconds = disconnect_grace_seconds
+        self._streams: dict[str, MessageStream] = {}
+
+    def create(self, thread_id: str) -> MessageStream:
+        self._prune()
+
+        stream = MessageStream(
+            thread_id=thread_id,
+            max_events=self.max_events,
+            disconnect_grace_seconds=self.disconnect_grace_seconds,
+        )
+        self._streams[stream.id] = stream
+
+        return stream
+
+    def get(self, stream_id: str) -> MessageStream | None:
+        self._prune()
+
+        return self._streams.get(stream_id)
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+
+        for stream_id, stream in list(self._streams.items()):
+            if stream.finished_at is not None and now - stream.finished_at > self.retention_seconds:
+                del self._streams[stream_id]
+
+        # Drop the oldest finished streams first when we hold too many
+        finished = sorted(
+            (stream for stream in self._streams.values() if stream.finished_at is not None),
+            key=lambda stream: stream.finished_at or 0,
+        )
+        while len(self._streams) >= self.max_streams and finished:
+            del self._streams[finished.pop(0).id]
+
+
+def parse_last_event_id(last_event_id: str) -> tuple[str, int]:
+    """Split a `Last-Event-ID` value of the form `<stream_id>:<sequence>`.
+
+    Raises:
+        ValueError: The event id is malformed.
+    """
+
+    stream_id, separator, sequence = last_event_id.strip().rpartition(":")
+
+    if not separator or not stream_id or not sequence.isdigit():
+        raise ValueError(f"Invalid event id: {last_event_id}")
+
+    return stream_id, int(sequence)
+
+
+message_streams = MessageStreamRegistry(
+    max_events=settings.SSE_REPLAY_MAX_EVENTS,
+    retention_seconds=settings.SSE_REPLAY_RETENTION_SECONDS,
+    max_streams=settings.SSE_REPLAY_MAX_STREAMS,
+    disconnect_grace_seconds=settings.SSE_DISCONNECT_GRACE_SECONDS,
+)
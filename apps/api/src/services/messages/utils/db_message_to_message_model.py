@@ -23,6 +23,7 @@ def db_message_to_message_model(message: messages) -> MessageResponse:
         id=message.id,
         role=cast(MessageRole, message.role),
         name=message.name,
+        interrupted=message.interrupted,
         content=[
             message_content
             for message_content in [
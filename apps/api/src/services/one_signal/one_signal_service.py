@@ -1,24 +1,191 @@
+import asyncio
+import copy
+import json
+import random
+import time
+import weakref
+
 import onesignal
 from onesignal.api import default_api
+from onesignal.exceptions import ApiException
 from onesignal.model.create_notification_success_response import CreateNotificationSuccessResponse
 from onesignal.model.notification import Notification
+from onesignal.model.notification_slice import NotificationSlice
+from urllib3.exceptions import ConnectTimeoutError, HTTPError, MaxRetryError, NewConnectionError
 
+from src.logger import logger
 from src.settings import settings
+from src.utils.metrics import log_metric
+
+# OneSignal accepts at most this many external user ids per notification
+MAX_EXTERNAL_USER_IDS = 2000
+
+
+class NotificationBatch:
+    """Notifications with the same content that go out as a single request."""
+
+    def __init__(self, notification: Notification) -> None:
+        self.notification = notification
+        self.external_user_ids: list[str] = []
+        self.task: asyncio.Task[CreateNotificationSuccessResponse] | None = None
+
+    def add(self, external_user_ids: list[str]) -> None:
+        for external_user_id in external_user_ids:
+            if external_user_id not in self.external_user_ids:
+                self.external_user_ids.append(external_user_id)
+
+    def has_room_for(self, external_user_ids: list[str]) -> bool:
+        return len(self.external_user_ids) + len(external_user_ids) <= MAX_EXTERNAL_USER_IDS
 
 
 class OneSignalService:
-    def __init__(self, api_key: str, app_id: str):
-        self.configuration = onesignal.Configuration(
-            app_key=api_key,
-        )
+    # The SDK client is synchronous, so we keep one per API key for the lifetime of the process and run its calls in
+    # worker threads, at most ONESIGNAL_MAX_CONCURRENT_REQUESTS at a time per event loop
+    _api_instances: dict[str, default_api.DefaultApi] = {}
+    _pending_batches: dict[tuple[str, str], NotificationBatch] = {}
+    _semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+    def __init__(self, api_key: str, app_id: str) -> None:
+        self.api_key = api_key
         self.app_id = app_id
+        self.api_instance = self._get_api_instance(api_key)
+
+    @classmethod
+    def close(cls) -> None:
+        for api_instance in cls._api_instances.values():
+            api_instance.api_client.close()
+
+        cls._api_instances.clear()
 
     async def send_notification(self, notification: Notification | None = None) -> CreateNotificationSuccessResponse:
-        with onesignal.ApiClient(self.configuration) as api_client:
-            api_instance = default_api.DefaultApi(api_client)
-            return api_instance.create_notification(notification)
-
-    async def get_notifications(self):
-        with onesignal.ApiClient(self.configuration) as api_client:
-            api_instance = default_api.DefaultApi(api_client)
-            return api_instance.get_notifications(self.app_id)
+        """Send a notification. Notifications with the same content that are sent to external user ids within
+        ONESIGNAL_BATCH_WINDOW_SECONDS of each other are combined into one request, and share its response."""
+
+        external_user_ids: list[str] = list(notification.get("include_external_user_ids", []) if notification else [])
+
+        if (
+            notification is None
+            or not external_user_ids
+            or settings.ONESIGNAL_BATCH_WINDOW_SECONDS <= 0
+            or len(external_user_ids) >= MAX_EXTERNAL_USER_IDS
+        ):
+            return await self._create_notification(notification)
+
+        batch_key = (self.api_key, self._batch_key(notification))
+        batch = self._pending_batches.get(batch_key)
+
+        if batch is None or not batch.has_room_for(external_user_ids):
+            batch = NotificationBatch(notification)
+            batch.task = asyncio.create_task(self._send_batch(batch_key, batch))
+            self._pending_batches[batch_key] = batch
+
+        batch.add(external_user_ids)
+
+        # A caller that is cancelled should not take the notifications of the other callers down with it
+        return await asyncio.shield(batch.task)
+
+    async def get_notifications(self) -> NotificationSlice:
+        async with self._get_semaphore():
+            return await asyncio.to_thread(self.api_instance.get_notifications, self.app_id)
+
+    async def _send_batch(
+        self, batch_key: tuple[str, str], batch: NotificationBatch
+    ) -> CreateNotificationSuccessResponse:
+        await asyncio.sleep(settings.ONESIGNAL_BATCH_WINDOW_SECONDS)
+
+        if self._pending_batches.get(batch_key) is batch:
+            del self._pending_batches[batch_key]
+
+        notification = copy.deepcopy(batch.notification)
+        notification.include_external_user_ids = batch.external_user_ids
+
+        return await self._create_notification(notification)
+
+    async def _create_notification(self, notification: Notification | None) -> CreateNotificationSuccessResponse:
+        recipients = len(notification.get("include_external_user_ids", [])) if notification else 0
+
+        for attempt in range(1, settings.ONESIGNAL_MAX_ATTEMPTS + 1):
+            started_at = time.monotonic()
+
+            try:
+                async with self._get_semaphore():
+                    response = await asyncio.to_thread(self.api_instance.create_notification, notification)
+            except (ApiException, HTTPError) as e:
+                log_metric(
+                    "onesignal.create_notification.duration_ms",
+                    (time.monotonic() - started_at) * 1000,
+                    status="error",
+                    attempt=attempt,
+                )
+
+                retry_delay = self._retry_delay(e, attempt)
+
+                if retry_delay is None or attempt == settings.ONESIGNAL_MAX_ATTEMPTS:
+                    raise
+
+                logger.warning(f"Sending notification failed on attempt {attempt}, retrying in {retry_delay:.2f}s: {e}")
+                await asyncio.sleep(retry_delay)
+                continue
+
+            log_metric(
+                "onesignal.create_notification.duration_ms",
+                (time.monotonic() - started_at) * 1000,
+                status="ok",
+                attempt=attempt,
+                recipients=recipients,
+            )
+
+            return response
+
+        raise RuntimeError("Unreachable, the last attempt either returns or raises")
+
+    @classmethod
+    def _get_semaphore(cls) -> asyncio.Semaphore:
+        """The semaphore of the running event loop, created on first use so it is never bound to another loop."""
+
+        loop = asyncio.get_running_loop()
+
+        if loop not in cls._semaphores:
+            cls._semaphores[loop] = asyncio.Semaphore(settings.ONESIGNAL_MAX_CONCURRENT_REQUESTS)
+
+        return cls._semaphores[loop]
+
+    @staticmethod
+    def _retry_delay(error: ApiException | HTTPError, attempt: int) -> float | None:
+        """Seconds to wait before retrying, None when the request should not be retried.
+
+        Creating a notification is not idempotent, so only requests that OneSignal certainly did not act on are
+        retried: rate limited ones and ones that never got a connection. After a read timeout or a 5xx response the
+        notification may have gone out already, and a retry could push it to the users twice.
+        """
+
+        if isinstance(error, ApiException):
+            if error.status != 429:
+                return None
+
+            retry_after = (error.headers or {}).get("Retry-After")
+
+            if retry_after is not None and retry_after.isdigit():
+                return float(retry_after)
+        else:
+            reason = error.reason if isinstance(error, MaxRetryError) else error
+
+            if not isinstance(reason, NewConnectionError | ConnectTimeoutError):
+                return None
+
+        # Exponential backoff with jitter, so retries from concurrent sends don't line up
+        return settings.ONESIGNAL_RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def _batch_key(notification: Notification) -> str:
+        content = {key: value for key, value in notification.to_dict().items() if key != "include_external_user_ids"}
+
+        return json.dumps(content, sort_keys=True, default=str)
+
+    @staticmethod
+    def _get_api_instance(api_key: str) -> default_api.DefaultApi:
+        if api_key not in OneSignalService._api_instances:
+            configuration = onesignal.Configuration(app_key=api_key)
+            OneSignalService._api_instances[api_key] = default_api.DefaultApi(onesignal.ApiClient(configuration))
+
+        return OneSignalService._api_instances[api_key]
@@ -0,0 +1,478 @@
+import json
+from collections.abc import Iterable
+from datetime import UTC, datetime, time, timedelta
+from typing import Any
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from prisma.enums import health_data_point_type
+
+from src.lib.prisma import prisma
+from src.settings import settings
+
+DEFAULT_STEPS_TIMEZONE = "Europe/Amsterdam"
+
+# Bucket width per aggregation, buckets are aligned to local midnight
+AGGREGATION_INTERVALS = {"quarter": "15 minutes", "hour": "1 hour", "day": "1 day"}
+
+AGGREGATION_ALIASES = {
+    "": "day",
+    "day": "day",
+    "daily": "day",
+    "hour": "hour",
+    "hourly": "hour",
+    "quarter": "quarter",
+    "quarterly": "quarter",
+    "q": "quarter",
+    "15m": "quarter",
+    "15min": "quarter",
+    "15": "quarter",
+    "none": "none",
+    "raw": "none",
+}
+
+MAX_ROWS = 300
+
+# Every rollup bucket, in every timezone, is made of whole quarters
+ROLLUP_BASE_INTERVAL = "15 minutes"
+
+
+class StepsService:
+    """Step counts of a user, summed per quarter, hour or day of the local timezone by Postgres.
+
+    Totals for the timezones in STEPS_ROLLUP_TIMEZONES are kept in health_step_rollups, other timezones are summed from
+    the data points on every query.
+    """
+
+    @staticmethod
+    def normalise_aggregation(aggregation: str | None) -> str:
+        """The canonical aggregation, `day` when none is given and `none` for raw data points."""
+
+        normalised = AGGREGATION_ALIASES.get((aggregation or "").strip().lower())
+
+        if normalised is None:
+            raise ValueError("Invalid aggregation value. Use one of: 'quarter', 'hour', 'day', 'none' or empty.")
+
+        return normalised
+
+    @staticmethod
+    def resolve_timezone(timezone: str | None) -> ZoneInfo:
+        tz_name = (timezone or DEFAULT_STEPS_TIMEZONE).strip()
+
+        if tz_name in {"CET", "CEST"}:
+            tz_name = DEFAULT_STEPS_TIMEZONE
+
+        try:
+            return ZoneInfo(tz_name)
+        except ZoneInfoNotFoundError as e:
+            raise ValueError(f"Invalid timezone '{timezone}'. Please provide a valid IANA name.") from e
+
+    @staticmethod
+    def resolve_range(date_from: str | datetime, date_to: str | datetime, tz: ZoneInfo) -> tuple[datetime, datetime]:
+        """Parse the inclusive range, naive values are local time. A range from midnight to midnight of the same day
+        covers that whole day."""
+
+        def parse(value: str | datetime) -> datetime:
+            parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+
+            return parsed.replace(tzinfo=tz) if parsed.tzinfo is None else parsed
+
+        date_from_dt = parse(date_from)
+        date_to_dt = parse(date_to)
+
+        if date_from_dt.year < datetime.now(tz).year:
+            raise ValueError("Date from is in the past")
+
+        if (
+            date_from_dt.date() == date_to_dt.date()
+            and date_from_dt.timetz() == time(0, tzinfo=tz)
+            and date_to_dt.timetz() == time(0, tzinfo=tz)
+        ):
+            date_to_dt = date_to_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+        return date_from_dt.astimezone(UTC), date_to_dt.astimezone(UTC)
+
+    @staticmethod
+    async def get_steps(
+        user_id: str,
+        date_from: str | datetime,
+        date_to: str | datetime,
+        timezone: str | None = None,
+        aggregation: str | None = None,
+        limit: int = MAX_ROWS,
+    ) -> list[dict[str, Any]]:
+        """Step counts between `date_from` and `date_to`, summed per bucket or as raw data points.
+
+        Every aggregation counts the data points that start within the inclusive range, so the raw data points add up
+        to the same total as the buckets.
+
+        Buckets are computed in the requested timezone, so a day runs from local midnight to local midnight, and
+        `limit` applies to the buckets rather than to the data points they are made of.
+
+        Returns:
+            One dict per bucket with `created_at`, the local start of the bucket, and `value`. Raw data points also
+            have `date_from` and `date_to`. All timestamps are ISO 8601 in the requested timezone.
+        """
+
+        aggregation = StepsService.normalise_aggregation(aggregation)
+        tz = StepsService.resolve_timezone(timezone)
+        date_from_utc, date_to_utc = StepsService.resolve_range(date_from, date_to, tz)
+
+        if aggregation == "none":
+            data_points = await prisma.health_data_points.find_many(
+                where={
+                    "user_id": user_id,
+                    "type": health_data_point_type.steps,
+                    "date_from": {"gte": date_from_utc, "lte": date_to_utc},
+                },
+                order={"date_from": "asc"},
+                take=limit,
+            )
+
+            return [
+                {
+                    "created_at": StepsService._iso_local(data_point.created_at, tz),
+                    "date_from": StepsService._iso_local(data_point.date_from, tz),
+                    "date_to": StepsService._iso_local(data_point.date_to, tz),
+                    "value": data_point.value,
+                }
+                for data_point in data_points
+            ]
+
+        if tz.key not in settings.STEPS_ROLLUP_TIMEZONES:
+            return await StepsService._sum_data_points(user_id, date_from_utc, date_to_utc, aggregation, tz, limit)
+
+        # Buckets that lie entirely within the range come from the rollups. The buckets at the edges of the range only
+        # count part of their data points, so they are summed from the data points like in other timezones
+        first_full_bucket = StepsService._bucket_floor(date_from_utc, aggregation, tz)
+
+        if first_full_bucket < date_from_utc:
+            first_full_bucket = StepsService._next_bucket(first_full_bucket, aggregation, tz)
+
+        last_bucket = StepsService._bucket_floor(date_to_utc, aggregation, tz)
+
+        if first_full_bucket >= last_bucket:
+            return await StepsService._sum_data_points(user_id, date_from_utc, date_to_utc, aggregation, tz, limit)
+
+        rollups = await prisma.health_step_rollups.find_many(
+            where={
+                "user_id": user_id,
+                "granularity": aggregation,
+                "timezone": tz.key,
+                "bucket_start": {"gte": first_full_bucket, "lt": last_bucket},
+            },
+            order={"bucket_start": "asc"},
+            take=limit,
+        )
+        buckets = [
+            {"created_at": StepsService._iso_local(rollup.bucket_start, tz), "value": rollup.value}
+            for rollup in rollups
+        ]
+
+        if date_from_utc < first_full_bucket:
+            buckets[:0] = await StepsService._sum_data_points(
+                user_id, date_from_utc, first_full_bucket - timedelta(microseconds=1), aggregation, tz, limit
+            )
+
+        if len(buckets) < limit:
+            buckets += await StepsService._sum_data_points(user_id, last_bucket, date_to_utc, aggregation, tz, limit)
+
+        return buckets[:limit]
+
+    @staticmethod
+    async def _sum_data_points(
+        user_id: str, date_from_utc: datetime, date_to_utc: datetime, aggregation: str, tz: ZoneInfo, limit: int
+    ) -> list[dict[str, Any]]:
+        """Sum the data points that start within the inclusive range per local bucket, the same way the rollups do."""
+
+        # The columns hold UTC without a timezone. Bin the local wall-clock time of each data point, then turn the
+        # bucket start back into an instant
+        rows = await prisma.query_raw(
+            """
+            SELECT
+                date_bin(
+                    $4::interval, date_from AT TIME ZONE 'UTC' AT TIME ZONE $5::text, TIMESTAMP '2000-01-01'
+                ) AT TIME ZONE $5::text AS bucket,
+                SUM(value)::int AS total
+            FROM health_data_points
+            WHERE user_id = $1::uuid
+              AND type = 'steps'
+              AND date_from >= $2::timestamptz AT TIME ZONE 'UTC'
+              AND date_from <= $3::timestamptz AT TIME ZONE 'UTC'
+            GROUP BY bucket
+            ORDER BY bucket
+            LIMIT $6::int
+            """,
+            user_id,
+            date_from_utc,
+            date_to_utc,
+            AGGREGATION_INTERVALS[aggregation],
+            tz.key,
+            limit,
+        )
+
+        return [{"created_at": StepsService._iso_local(row["bucket"], tz), "value": row["total"]} for row in rows]
+
+    @staticmethod
+    async def upsert_data_points(user_id: str, data_points: list[dict[str, Any]]) -> tuple[int, int]:
+        """Insert or update step data points by `source_uuid`, in chunks of STEPS_SYNC_CHUNK_SIZE rows per statement.
+
+        Data points that did not change are not written. The rollups of the changed buckets are refreshed after every
+        chunk, so a sync that fails halfway leaves them consistent with the rows that were written.
+
+        Args:
+            user_id: The id of the user the new data points belong to.
+            data_points: Dicts with the `source_uuid`, `value`, `unit`, `date_from`, `date_to`, `health_platform`,
+                `source_device_id`, `source_id` and `source_name` of each data point. A later dict with the same
+                `source_uuid` replaces an earlier one.
+
+        Returns:
+            The number of inserted and of updated data points.
+        """
+
+        unique_data_points = list({data_point["source_uuid"]: data_point for data_point in data_points}.values())
+        chunk_size = settings.STEPS_SYNC_CHUNK_SIZE
+        inserted = 0
+        updated = 0
+
+        for start in range(0, len(unique_data_points), chunk_size):
+            chunk = [
+                {
+                    **data_point,
+                    "date_from": StepsService._utc_naive(data_point["date_from"]).isoformat(),
+                    "date_to": StepsService._utc_naive(data_point["date_to"]).isoformat(),
+                }
+                for data_point in unique_data_points[start : start + chunk_size]
+            ]
+
+            # A data point that moved also changes the rollup of the bucket it was in, `moved` still sees the old row
+            rows = await prisma.query_raw(
+                """
+                WITH input AS (
+                    SELECT *
+                    FROM jsonb_to_recordset($2::jsonb) AS r(
+                        source_uuid text,
+                        value int,
+                        unit health_data_unit,
+                        date_from timestamp(3),
+                        date_to timestamp(3),
+                        health_platform health_platform,
+                        source_device_id text,
+                        source_id text,
+                        source_name text
+                    )
+                ),
+                moved AS (
+                    SELECT h.date_from
+                    FROM health_data_points h
+                    JOIN input i ON i.source_uuid = h.source_uuid
+                    WHERE h.date_from <> i.date_from
+                ),
+                upserted AS (
+                    INSERT INTO health_data_points (
+                        user_id, type, value, unit, date_from, date_to, source_uuid, health_platform,
+                        source_device_id, source_id, source_name
+                    )
+                    SELECT
+                        $1::uuid, 'steps', value, unit, date_from, date_to, source_uuid, health_platform,
+                        source_device_id, source_id, source_name
+                    FROM input
+                    ON CONFLICT (source_uuid) DO UPDATE SET
+                        type = EXCLUDED.type,
+                        value = EXCLUDED.value,
+                        unit = EXCLUDED.unit,
+                        date_from = EXCLUDED.date_from,
+                        date_to = EXCLUDED.date_to,
+                        health_platform = EXCLUDED.health_platform,
+                        source_device_id = EXCLUDED.source_device_id,
+                        source_id = EXCLUDED.source_id,
+                        source_name = EXCLUDED.source_name,
+                        updated_at = now() AT TIME ZONE 'UTC'
+                    WHERE (
+                        health_data_points.type,
+                        health_data_points.value,
+                        health_data_points.unit,
+                        health_data_points.date_from,
+                        health_data_points.date_to,
+                        health_data_points.health_platform,
+                        health_data_points.source_device_id,
+                        health_data_points.source_id,
+                        health_data_points.source_name
+                    ) IS DISTINCT FROM (
+                        EXCLUDED.type, EXCLUDED.value, EXCLUDED.unit, EXCLUDED.date_from, EXCLUDED.date_to,
+                        EXCLUDED.health_platform, EXCLUDED.source_device_id, EXCLUDED.source_id, EXCLUDED.source_name
+                    )
+                    RETURNING (xmax = 0) AS inserted, date_from
+                ),
+                changed_buckets AS (
+                    SELECT date_bin($3::interval, date_from, TIMESTAMP '2000-01-01') AS bucket FROM upserted
+                    UNION
+                    SELECT date_bin($3::interval, date_from, TIMESTAMP '2000-01-01') FROM moved
+                )
+                SELECT
+                    (SELECT COUNT(*) FILTER (WHERE inserted) FROM upserted)::int AS inserted,
+                    (SELECT COUNT(*) FILTER (WHERE NOT inserted) FROM upserted)::int AS updated,
+                    (SELECT COALESCE(jsonb_agg(bucket), '[]'::jsonb) FROM changed_buckets) AS changed_buckets
+                """,
+                user_id,
+                json.dumps(chunk),
+                ROLLUP_BASE_INTERVAL,
+            )
+
+            inserted += rows[0]["inserted"]
+            updated += rows[0]["updated"]
+
+            await StepsService.refresh_rollups(
+                user_id, [datetime.fromisoformat(bucket) for bucket in rows[0]["changed_buckets"]]
+            )
+
+        return inserted, updated
+
+    @staticmethod
+    async def refresh_rollups(user_id: str, timestamps: Iterable[datetime]) -> None:
+        """Recompute the rollups of the buckets that contain `timestamps`.
+
+        Pass the `date_from` of every data point that was inserted, changed or removed, before and after the change.
+        Buckets without data points left are deleted.
+        """
+
+        timestamps = sorted({StepsService._utc_naive(timestamp).isoformat() for timestamp in timestamps})
+
+        if not timestamps or not settings.STEPS_ROLLUP_TIMEZONES:
+            return
+
+        await prisma.execute_raw(
+            """
+            WITH buckets AS (
+                SELECT DISTINCT
+                    g.granularity,
+                    g.timezone,
+                    g.width,
+                    date_bin(
+                        g.width, t.ts::timestamp AT TIME ZONE 'UTC' AT TIME ZONE g.timezone, TIMESTAMP '2000-01-01'
+                    ) AS local_start
+                FROM jsonb_array_elements_text($2::jsonb) AS t(ts)
+                CROSS JOIN jsonb_to_recordset($3::jsonb) AS g(granularity text, width interval, timezone text)
+            ),
+            totals AS (
+                SELECT
+                    b.granularity,
+                    b.timezone,
+                    b.local_start AT TIME ZONE b.timezone AT TIME ZONE 'UTC' AS bucket_start,
+                    COALESCE(SUM(h.value), 0)::int AS value,
+                    COUNT(h.id)::int AS data_points
+                FROM buckets b
+                LEFT JOIN health_data_points h
+                    ON h.user_id = $1::uuid
+                    AND h.type = 'steps'
+                    AND h.date_from >= b.local_start AT TIME ZONE b.timezone AT TIME ZONE 'UTC'
+                    AND h.date_from < (b.local_start + b.width) AT TIME ZONE b.timezone AT TIME ZONE 'UTC'
+                GROUP BY b.granularity, b.timezone, b.local_start
+            ),
+            deleted AS (
+                DELETE FROM health_step_rollups r
+                USING totals t
+                WHERE t.data_points = 0
+                    AND r.user_id = $1::uuid
+                    AND r.granularity = t.granularity
+                    AND r.timezone = t.timezone
+                    AND r.bucket_start = t.bucket_start
+            )
+            INSERT INTO health_step_rollups
+                (user_id, granularity, timezone, bucket_start, value, data_points, updated_at)
+            SELECT $1::uuid, granularity, timezone, bucket_start, value, data_points, now() AT TIME ZONE 'UTC'
+            FROM totals
+            WHERE data_points > 0
+            ON CONFLICT (user_id, granularity, timezone, bucket_start)
+            DO UPDATE SET value = EXCLUDED.value, data_points = EXCLUDED.data_points, updated_at = EXCLUDED.updated_at
+            """,
+            user_id,
+            json.dumps(timestamps),
+            json.dumps(StepsService._rollup_buckets()),
+        )
+
+    @staticmethod
+    async def rebuild_rollups(user_id: str) -> None:
+        """Replace all rollups of a user with totals computed from their data points."""
+
+        async with prisma.tx() as tx:
+            await tx.health_step_rollups.delete_many(where={"user_id": user_id})
+
+            if not settings.STEPS_ROLLUP_TIMEZONES:
+                return
+
+            await tx.execute_raw(
+                """
+                INSERT INTO health_step_rollups
+                    (user_id, granularity, timezone, bucket_start, value, data_points, updated_at)
+                SELECT
+                    $1::uuid,
+                    g.granularity,
+                    g.timezone,
+                    date_bin(
+                        g.width, h.date_from AT TIME ZONE 'UTC' AT TIME ZONE g.timezone, TIMESTAMP '2000-01-01'
+                    ) AT TIME ZONE g.timezone AT TIME ZONE 'UTC' AS bucket_start,
+                    SUM(h.value)::int,
+                    COUNT(*)::int,
+                    now() AT TIME ZONE 'UTC'
+                FROM health_data_points h
+                CROSS JOIN jsonb_to_recordset($2::jsonb) AS g(granularity text, width interval, timezone text)
+                WHERE h.user_id = $1::uuid AND h.type = 'steps'
+                GROUP BY g.granularity, g.timezone, bucket_start
+                """,
+                user_id,
+                json.dumps(StepsService._rollup_buckets()),
+            )
+
+    @staticmethod
+    def _rollup_buckets() -> list[dict[str, str]]:
+        return [
+            {"granularity": granularity, "width": width, "timezone": timezone}
+            for timezone in settings.STEPS_ROLLUP_TIMEZONES
+            for granularity, width in AGGREGATION_INTERVALS.items()
+        ]
+
+    @staticmethod
+    def _bucket_floor(value: datetime, aggregation: str, tz: ZoneInfo) -> datetime:
+        """The start of the local bucket that contains `value`."""
+
+        local = value.astimezone(tz).replace(second=0, microsecond=0)
+
+        if aggregation == "day":
+            local = local.replace(hour=0, minute=0)
+        elif aggregation == "hour":
+            local = local.replace(minute=0)
+        else:
+            local = local.replace(minute=local.minute - local.minute % 15)
+
+        return local.astimezone(UTC)
+
+    @staticmethod
+    def _next_bucket(bucket_start: datetime, aggregation: str, tz: ZoneInfo) -> datetime:
+        """The start of the local bucket after the one that starts at `bucket_start`."""
+
+        local = bucket_start.astimezone(tz).replace(tzinfo=None)
+
+        if aggregation == "day":
+            local += timedelta(days=1)
+        elif aggregation == "hour":
+            local += timedelta(hours=1)
+        else:
+            local += timedelta(minutes=15)
+
+        return local.replace(tzinfo=tz).astimezone(UTC)
+
+    @staticmethod
+    def _utc_naive(value: datetime) -> datetime:
+        """A timestamp as stored by Prisma, naive values are taken to be UTC already."""
+
+        return value.astimezone(UTC).replace(tzinfo=None) if value.tzinfo is not None else value
+
+    @staticmethod
+    def _iso_local(value: str | datetime, tz: ZoneInfo) -> str:
+        parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+
+        # The database returns naive timestamps in UTC
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=UTC)
+
+        return parsed.astimezone(tz).isoformat()
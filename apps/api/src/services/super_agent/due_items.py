@@ -0,0 +1,127 @@
+"""Work out which reminders and recurring tasks of a thread are due for a notification.
+
+Sends are not tracked per item. A super agent turn gets every item that is due at that moment and sends one
+notification that covers all of them, so the time of the most recent notification marks everything that was due
+before it as handled. The flip side is that a notification sent outside the super agent, e.g. with the send
+notification tool in a chat, also counts as a send and hides the reminders that were due before it.
+"""
+
+from datetime import datetime, timedelta, tzinfo
+
+import pytz
+from apscheduler.triggers.cron import CronTrigger
+
+from src.logger import logger
+
+DEFAULT_TIMEZONE = pytz.timezone("Europe/Amsterdam")
+
+# How far back a recurring task can have fired and still be picked up, matches the hourly super agent jobs
+RECURRING_TASK_LOOKBACK = timedelta(hours=1)
+
+
+def parse_datetime(value: str, timezone: tzinfo = DEFAULT_TIMEZONE) -> datetime | None:
+    """Parse an ISO 8601 string, naive values are interpreted in `timezone`. Returns None when it can't be parsed."""
+
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+    if parsed.tzinfo is None:
+        return pytz.timezone(str(timezone)).localize(parsed)
+
+    return parsed
+
+
+def get_last_sent_at(notifications: list[dict], timezone: tzinfo = DEFAULT_TIMEZONE) -> datetime | None:
+    """Get the time the most recent notification was sent."""
+
+    sent_at = [
+        parsed
+        for parsed in (parse_datetime(notification.get("sent_at", ""), timezone) for notification in notifications)
+        if parsed is not None
+    ]
+
+    return max(sent_at, default=None)
+
+
+def get_due_reminders(
+    reminders: list[dict],
+    notifications: list[dict],
+    now: datetime,
+    timezone: tzinfo = DEFAULT_TIMEZONE,
+) -> list[dict]:
+    """Get the reminders whose date has passed and that nothing was sent for since.
+
+    A reminder is due when its date is not in the future and no notification was sent at or after its date, see the
+    module docstring for why the most recent notification stands for every item.
+
+    Args:
+        reminders: The reminders from the thread metadata, with an ISO 8601 `date`.
+        notifications: The log of sent notifications, with an ISO 8601 `sent_at`.
+        now: The current time, must be timezone aware.
+        timezone: The timezone of naive dates.
+    """
+
+    last_sent_at = get_last_sent_at(notifications, timezone)
+
+    due_reminders = []
+
+    for reminder in reminders:
+        date = parse_datetime(reminder.get("date", ""), timezone)
+
+        if date is None:
+            logger.warning(f"Skipping reminder {reminder.get('id')} with invalid date {reminder.get('date')}")
+            continue
+
+        if date <= now and (last_sent_at is None or last_sent_at < date):
+            due_reminders.append(reminder)
+
+    return due_reminders
+
+
+def get_due_recurring_tasks(
+    recurring_tasks: list[dict],
+    notifications: list[dict],
+    now: datetime,
+    timezone: tzinfo = DEFAULT_TIMEZONE,
+    lookback: timedelta = RECURRING_TASK_LOOKBACK,
+) -> list[dict]:
+    """Get the recurring tasks whose cron expression fired since the last run and that nothing was sent for since.
+
+    A task is due when it fired within the window that starts `lookback` before `now`, or at the last notification
+    when that is later, and ends at `now`. The start of the window is exclusive, so a fire time equal to the last
+    notification counts as sent.
+
+    Args:
+        recurring_tasks: The recurring tasks from the thread metadata, with a 5 field `cron_expression`.
+        notifications: The log of sent notifications, with an ISO 8601 `sent_at`.
+        now: The current time, must be timezone aware.
+        timezone: The timezone the cron expressions are evaluated in.
+        lookback: How far back a fire time still counts as due.
+    """
+
+    window_start = now - lookback
+    last_sent_at = get_last_sent_at(notifications, timezone)
+
+    if last_sent_at is not None and last_sent_at > window_start:
+        window_start = last_sent_at
+
+    due_tasks = []
+
+    for task in recurring_tasks:
+        try:
+            trigger = CronTrigger.from_crontab(task.get("cron_expression", ""), timezone=timezone)
+        except ValueError:
+            logger.warning(
+                f"Skipping recurring task {task.get('id')} with invalid cron expression {task.get('cron_expression')}"
+            )
+            continue
+
+        # First fire time strictly after the start of the window
+        fire_time = trigger.get_next_fire_time(None, window_start + timedelta(microseconds=1))
+
+        if fire_time is not None and fire_time <= now:
+            due_tasks.append(task)
+
+    return due_tasks
@@ -0,0 +1,251 @@
+from collections import defaultdict
+from datetime import UTC, datetime, timedelta
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from prisma.models import threads
+
+from src.agents.agent_loader import AgentLoader
+from src.agents.base_agent import BaseAgent
+from src.lib.prisma import prisma
+from src.lib.scheduler import scheduler
+from src.logger import logger
+from src.services.super_agent.due_items import DEFAULT_TIMEZONE, get_due_reminders, parse_datetime
+from src.services.super_agent.shard_coordinator import shard_coordinator, shard_for_thread
+from src.services.super_agent.super_agent_service import SuperAgentService
+from src.services.thread_items.thread_items_service import ThreadItemsService
+
+JOB_ID_PREFIXES = ("reminder:", "recurring_task:")
+
+# Threads written by another replica close to a reconcile run are picked up again by the next one
+RECONCILE_OVERLAP = timedelta(seconds=30)
+
+
+class ReminderScheduler:
+    """Schedules a job at the exact time a reminder or recurring task is due, scoped to the thread it belongs to.
+
+    The thread_reminders and thread_recurring_tasks tables are the source of truth. Each replica keeps the jobs for
+    the threads in the shards it owns and periodically reconciles them with those tables, which also picks up
+    reminders that were added through another replica. The hourly super agent sweep stays in place as a safety net.
+    """
+
+    _reconciled_shards: set[int] = set()
+    _reconciled_at: datetime | None = None
+
+    @staticmethod
+    def reminder_job_id(thread_id: str, reminder_id: str) -> str:
+        return f"reminder:{thread_id}:{reminder_id}"
+
+    @staticmethod
+    def recurring_task_job_id(thread_id: str, task_id: str) -> str:
+        return f"recurring_task:{thread_id}:{task_id}"
+
+    @staticmethod
+    def schedule_reminder(agent_type: type[BaseAgent], thread_id: str, reminder: dict) -> None:
+        job_args = ReminderScheduler._job_args(agent_type, thread_id)
+
+        if job_args is None:
+            return
+
+        date = parse_datetime(reminder.get("date", ""))
+
+        if date is None:
+            logger.warning(f"Not scheduling reminder {reminder.get('id')} with invalid date {reminder.get('date')}")
+            return
+
+        scheduler.add_job(
+            func=ReminderScheduler.run_thread_job,
+            trigger=DateTrigger(run_date=date),
+            id=ReminderScheduler.reminder_job_id(thread_id, reminder["id"]),
+            args=job_args,
+            replace_existing=True,
+            misfire_grace_time=None,
+        )
+
+        logger.info(f"Scheduled reminder {reminder['id']} for thread {thread_id} at {date.isoformat()}")
+
+    @staticmethod
+    def schedule_recurring_task(agent_type: type[BaseAgent], thread_id: str, task: dict) -> None:
+        job_args = ReminderScheduler._job_args(agent_type, thread_id)
+
+        if job_args is None:
+            return
+
+        try:
+            trigger = CronTrigger.from_crontab(task.get("cron_expression", ""), timezone=DEFAULT_TIMEZONE)
+        except ValueError:
+            logger.warning(
+                f"Not scheduling recurring task {task.get('id')} with invalid cron expression "
+                f"{task.get('cron_expression')}"
+            )
+            return
+
+        scheduler.add_job(
+            func=ReminderScheduler.run_thread_job,
+            trigger=trigger,
+            id=ReminderScheduler.recurring_task_job_id(thread_id, task["id"]),
+            args=job_args,
+            replace_existing=True,
+        )
+
+        logger.info(f"Scheduled recurring task {task['id']} for thread {thread_id} ({task['cron_expression']})")
+
+    @staticmethod
+    def unschedule(job_id: str) -> None:
+        try:
+            scheduler.remove_job(job_id)
+        except JobLookupError:
+            pass
+
+    @staticmethod
+    async def run_thread_job(agent_class: str, thread_id: str, agent_config: dict, headers: dict) -> None:
+        if not shard_coordinator.owns_thread(thread_id):
+            logger.info(f"Thread {thread_id} moved to another replica, skipping scheduled super agent run")
+            return
+
+        thread = await prisma.threads.find_unique(where={"id": thread_id})
+
+        if thread is None:
+            logger.info(f"Thread {thread_id} no longer exists, skipping scheduled super agent run")
+            return
+
+        await SuperAgentService.run_super_agent_for_thread(thread, agent_class, agent_config, headers, 15)
+
+    @staticmethod
+    async def start(reconcile_seconds: float) -> None:
+        await ReminderScheduler.reconcile_jobs()
+
+        scheduler.add_job(
+            func=ReminderScheduler.reconcile_jobs,
+            trigger=IntervalTrigger(seconds=reconcile_seconds),
+            id="reminder_scheduler:reconcile",
+            replace_existing=True,
+        )
+
+    @staticmethod
+    async def reconcile_jobs() -> None:
+        """Bring the jobs in line with the owned shards and with the stored reminders and recurring tasks.
+
+        Drops the jobs of shards we no longer own, loads every thread of a newly owned shard, and reloads the threads
+        of the other owned shards that were updated since the previous run.
+        """
+
+        started_at = datetime.now(UTC)
+        owned_shards = shard_coordinator.owned_shards
+        lost_shards = ReminderScheduler._reconciled_shards - owned_shards
+        gained_shards = owned_shards - ReminderScheduler._reconciled_shards
+        kept_shards = owned_shards & ReminderScheduler._reconciled_shards
+
+        jobs_by_thread = ReminderScheduler._jobs_by_thread()
+
+        for thread_id, job_ids in jobs_by_thread.items():
+            if shard_for_thread(thread_id, shard_coordinator.shard_count) in lost_shards:
+                for job_id in job_ids:
+                    ReminderScheduler.unschedule(job_id)
+
+        for agent_type in AgentLoader.get_all_agents():
+            if agent_type.super_agent_config() is None:
+                continue
+
+            changed_threads: list[threads] = []
+
+            if gained_shards:
+                changed_threads += await SuperAgentService.get_super_agent_threads(
+                    agent_type.__name__, shards=gained_shards
+                )
+
+            if kept_shards and ReminderScheduler._reconciled_at is not None:
+                changed_threads += await SuperAgentService.get_super_agent_threads(
+                    agent_type.__name__,
+                    shards=kept_shards,
+                    updated_since=ReminderScheduler._reconciled_at - RECONCILE_OVERLAP,
+                )
+
+            if not changed_threads:
+                continue
+
+            thread_ids = [thread.id for thread in changed_threads]
+            reminders = await ThreadItemsService.get_reminders_by_thread(thread_ids)
+            recurring_tasks = await ThreadItemsService.get_recurring_tasks_by_thread(thread_ids)
+            notifications = await ThreadItemsService.get_last_notifications_by_thread(thread_ids)
+
+            for thread_id in thread_ids:
+                ReminderScheduler._sync_thread_jobs(
+                    agent_type,
+                    thread_id,
+                    reminders[thread_id],
+                    recurring_tasks[thread_id],
+                    notifications[thread_id],
+                    jobs_by_thread.get(thread_id, set()),
+                )
+
+            logger.info(f"Reconciled reminder jobs for {len(changed_threads)} {agent_type.__name__} threads")
+
+        ReminderScheduler._reconciled_shards = owned_shards
+        ReminderScheduler._reconciled_at = started_at
+
+    @staticmethod
+    def _sync_thread_jobs(
+        agent_type: type[BaseAgent],
+        thread_id: str,
+        reminders: list[dict],
+        recurring_tasks: list[dict],
+        notifications: list[dict],
+        existing_job_ids: set[str],
+    ) -> None:
+        """Schedule the reminders and recurring tasks of a thread, and remove the jobs of the ones that are gone.
+
+        Reminders that became due while no replica was watching them, and were not sent yet, run right away.
+        """
+
+        now = datetime.now(DEFAULT_TIMEZONE)
+        missed_reminders = get_due_reminders(reminders, notifications, now)
+
+        wanted_job_ids: set[str] = set()
+
+        for reminder in reminders:
+            date = parse_datetime(reminder.get("date", ""))
+
+            if date is None or (date <= now and reminder not in missed_reminders):
+                continue
+
+            job_id = ReminderScheduler.reminder_job_id(thread_id, reminder["id"])
+            wanted_job_ids.add(job_id)
+
+            if job_id not in existing_job_ids:
+                ReminderScheduler.schedule_reminder(agent_type, thread_id, reminder)
+
+        for task in recurring_tasks:
+            job_id = ReminderScheduler.recurring_task_job_id(thread_id, task["id"])
+            wanted_job_ids.add(job_id)
+
+            # Re-adding a job that is already waiting would only reset its next run time
+            if job_id not in existing_job_ids:
+                ReminderScheduler.schedule_recurring_task(agent_type, thread_id, task)
+
+        for job_id in existing_job_ids - wanted_job_ids:
+            ReminderScheduler.unschedule(job_id)
+
+    @staticmethod
+    def _jobs_by_thread() -> dict[str, set[str]]:
+        jobs_by_thread: dict[str, set[str]] = defaultdict(set)
+
+        for job in scheduler.get_jobs():
+            if job.id.startswith(JOB_ID_PREFIXES):
+                jobs_by_thread[job.id.split(":")[1]].add(job.id)
+
+        return jobs_by_thread
+
+    @staticmethod
+    def _job_args(agent_type: type[BaseAgent], thread_id: str) -> list | None:
+        """Arguments for `run_thread_job`. None when the agent has no super agent to notify with, or when the
+        thread belongs to another replica, which picks it up the next time it reconciles."""
+
+        config = agent_type.super_agent_config()
+
+        if config is None or not shard_coordinator.owns_thread(thread_id):
+            return None
+
+        return [agent_type.__name__, thread_id, config.agent_config.model_dump(), config.headers]
@@ -0,0 +1,174 @@
+import os
+import socket
+import time
+import uuid
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.interval import IntervalTrigger
+
+from src.lib.prisma import prisma
+from src.lib.scheduler import scheduler
+from src.logger import logger
+from src.settings import settings
+
+# Serialises rebalancing across replicas, any constant works as long as every replica uses the same one
+ADVISORY_LOCK_KEY = 7_264_531
+
+
+def shard_for_thread(thread_id: str, shard_count: int) -> int:
+    """Map a thread to a shard, keep in sync with `shard_sql`."""
+
+    return int(uuid.UUID(thread_id).hex[-7:], 16) % shard_count
+
+
+def shard_sql(column: str, shard_count: int) -> str:
+    """SQL expression that maps a uuid column to a shard, keep in sync with `shard_for_thread`."""
+
+    return f"(('x' || right(replace({column}::text, '-', ''), 7))::bit(28)::int % {int(shard_count)})"
+
+
+class ShardCoordinator:
+    """Spreads the scheduled super agent work over the running replicas.
+
+    Threads are hashed into a fixed number of shards. Every replica sends a heartbeat to `scheduler_replicas` and
+    leases its share of the shards in `scheduler_leases`, rebalancing under a Postgres advisory lock. A replica only
+    takes over a shard once the previous owner released it or let its lease expire, so a shard never has two owners.
+    """
+
+    def __init__(self, shard_count: int, lease_seconds: float, replica_id: str | None = None) -> None:
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        self.replica_id = replica_id or f"{socket.gethostname()}:{os.getpid()}:{str(uuid.uuid4())[:8]}"
+        self._owned_shards: set[int] = set()
+        self._owned_until = 0.0
+
+    @property
+    def owned_shards(self) -> set[int]:
+        # Stop acting on our shards once the lease could have expired, e.g. when heartbeats fail
+        if time.monotonic() >= self._owned_until:
+            return set()
+
+        return set(self._owned_shards)
+
+    @property
+    def _heartbeat_job_id(self) -> str:
+        return f"shard_coordinator:{self.replica_id}"
+
+    def owns_thread(self, thread_id: str) -> bool:
+        return shard_for_thread(thread_id, self.shard_count) in self.owned_shards
+
+    async def start(self, renew_seconds: float) -> None:
+        await self.heartbeat()
+
+        scheduler.add_job(
+            func=self.heartbeat,
+            trigger=IntervalTrigger(seconds=renew_seconds),
+            id=self._heartbeat_job_id,
+            replace_existing=True,
+        )
+
+        logger.info(f"Replica {self.replica_id} owns shards {sorted(self._owned_shards)} of {self.shard_count}")
+
+    async def stop(self) -> None:
+        """Hand our shards back right away instead of letting the other replicas wait for the leases to expire."""
+
+        try:
+            scheduler.remove_job(self._heartbeat_job_id)
+        except JobLookupError:
+            pass
+
+        self._owned_shards = set()
+
+        try:
+            await prisma.execute_raw(
+                "UPDATE scheduler_leases SET owner = NULL, updated_at = now() WHERE owner = $1",
+                self.replica_id,
+            )
+            await prisma.execute_raw("DELETE FROM scheduler_replicas WHERE id = $1", self.replica_id)
+        except Exception as e:
+            logger.warning(f"Could not release the shards of replica {self.replica_id}: {e}")
+
+    async def heartbeat(self) -> None:
+        """Register this replica, drop dead ones and renew, claim or release shards to match the live replicas.
+
+        Every replica derives the same assignment from the sorted list of live replicas, shard `s` belongs to
+        replica `s % len(replicas)`.
+        """
+
+        started_at = time.monotonic()
+
+        try:
+            async with prisma.tx() as tx:
+                await tx.execute_raw(f"SELECT pg_advisory_xact_lock({ADVISORY_LOCK_KEY})")
+
+                await tx.execute_raw(
+                    """
+                    INSERT INTO scheduler_replicas (id, heartbeat_at, created_at) VALUES ($1, now(), now())
+                    ON CONFLICT (id) DO UPDATE SET heartbeat_at = now()
+                    """,
+                    self.replica_id,
+                )
+                await tx.execute_raw(
+                    "DELETE FROM scheduler_replicas WHERE heartbeat_at < now() - make_interval(secs => $1::float8)",
+                    self.lease_seconds,
+                )
+
+                replicas = [row["id"] for row in await tx.query_raw("SELECT id FROM scheduler_replicas ORDER BY id")]
+                replica_index = replicas.index(self.replica_id)
+
+                await tx.execute_raw(
+                    """
+                    INSERT INTO scheduler_leases (shard, expires_at, updated_at)
+                    SELECT generate_series(0, $1::int - 1), now(), now()
+                    ON CONFLICT (shard) DO NOTHING
+                    """,
+                    self.shard_count,
+                )
+                await tx.execute_raw("DELETE FROM scheduler_leases WHERE shard >= $1::int", self.shard_count)
+
+                # Release the shards that moved to another replica, then renew ours and claim the free ones
+                await tx.execute_raw(
+                    """
+                    UPDATE scheduler_leases SET owner = NULL, updated_at = now()
+                    WHERE owner = $1 AND shard % $2::int <> $3::int
+                    """,
+                    self.replica_id,
+                    len(replicas),
+                    replica_index,
+                )
+                await tx.execute_raw(
+                    """
+                    UPDATE scheduler_leases
+                    SET owner = $1, expires_at = now() + make_interval(secs => $4::float8), updated_at = now()
+                    WHERE shard % $2::int = $3::int AND (owner IS NULL OR owner = $1 OR expires_at < now())
+                    """,
+                    self.replica_id,
+                    len(replicas),
+                    replica_index,
+                    self.lease_seconds,
+                )
+
+                rows = await tx.query_raw(
+                    "SELECT shard FROM scheduler_leases WHERE owner = $1 ORDER BY shard",
+                    self.replica_id,
+                )
+        except Exception as e:
+            logger.error(f"Shard lease renewal failed for replica {self.replica_id}: {e}", exc_info=e)
+            return
+
+        owned_shards = {row["shard"] for row in rows}
+
+        if owned_shards != self._owned_shards:
+            logger.info(
+                f"Replica {self.replica_id} now owns shards {sorted(owned_shards)} "
+                f"of {self.shard_count} across {len(replicas)} replicas"
+            )
+
+        self._owned_shards = owned_shards
+        self._owned_until = started_at + self.lease_seconds
+
+
+shard_coordinator = ShardCoordinator(
+    shard_count=settings.SUPER_AGENT_SHARDS,
+    lease_seconds=settings.SUPER_AGENT_LEASE_SECONDS,
+)
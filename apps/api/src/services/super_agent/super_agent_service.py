@@ -1,10 +1,17 @@
+import asyncio
+import time
 import uuid
+from collections import Counter
 from collections.abc import AsyncGenerator, Iterable
+from contextlib import aclosing
+from datetime import UTC, datetime
+from weakref import WeakValueDictionary
 
 from apscheduler.triggers.cron import CronTrigger
 from openai.types.chat import ChatCompletionMessageParam
 from prisma import Base64, Json
 from prisma.enums import message_content_type, message_role, widget_type
+from prisma.models import threads
 
 from src.agents.agent_loader import AgentLoader
 from src.agents.base_agent import BaseAgent
@@ -23,6 +30,9 @@ from src.models.messages import (
 )
 from src.services.messages.utils.db_message_to_openai_param import db_message_to_openai_param
 from src.services.messages.utils.generated_message_to_openai_param import generated_message_to_openai_param
+from src.services.super_agent.shard_coordinator import shard_coordinator, shard_sql
+from src.settings import settings
+from src.utils.metrics import log_metric
 
 
 class AgentNotFoundError(Exception):
@@ -30,6 +40,12 @@ class AgentNotFoundError(Exception):
 
 
 class SuperAgentService:
+    # Runs for the same thread never overlap, e.g. a reminder job and the hourly sweep
+    _thread_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+    # When threads last finished a run, only kept while a job that read its threads before then is still running
+    _thread_finished_at: dict[str, float] = {}
+    _running_snapshots: list[float] = []
+
     @staticmethod
     async def register_super_agents() -> None:
         for agent in AgentLoader.get_all_agents():
@@ -54,29 +70,229 @@ class SuperAgentService:
         headers: dict,
         max_recursion_depth: int,
     ) -> None:
-        threads = await prisma.threads.find_many(
-            where={
-                "messages": {
-                    "some": {
-                        "agent_class": agent_class,
-                    },
-                },
-            },
+        owned_shards = shard_coordinator.owned_shards
+
+        if not owned_shards:
+            logger.info(f"Replica {shard_coordinator.replica_id} owns no shards, skipping super agent {agent_class}")
+            return
+
+        started_at = time.monotonic()
+        SuperAgentService._running_snapshots.append(started_at)
+
+        try:
+            await SuperAgentService._run_super_agent_job(
+                agent_class, agent_config, headers, max_recursion_depth, owned_shards, started_at
+            )
+        finally:
+            SuperAgentService._running_snapshots.remove(started_at)
+            SuperAgentService._prune_thread_finished_at()
+
+    @staticmethod
+    async def _run_super_agent_job(
+        agent_class: str,
+        agent_config: dict,
+        headers: dict,
+        max_recursion_depth: int,
+        owned_shards: set[int],
+        started_at: float,
+    ) -> None:
+        target_threads = await SuperAgentService.get_super_agent_threads(agent_class, shards=owned_shards)
+
+        logger.info(
+            f"Running super agent {agent_class} for {len(target_threads)} threads "
+            f"with concurrency {settings.SUPER_AGENT_CONCURRENCY}"
         )
 
-        logger.info(f"Running super agent {agent_class} for {len(threads)} threads")
+        statuses: Counter[str] = Counter()
+        progress_interval = max(1, len(target_threads) // 10)
+
+        # Workers pull from a shared iterator, so at most SUPER_AGENT_CONCURRENCY threads are in flight
+        pending_threads = iter(target_threads)
+
+        async def worker() -> None:
+            for thread in pending_threads:
+                status = await SuperAgentService.run_super_agent_for_thread(
+                    thread,
+                    agent_class,
+                    agent_config,
+                    headers,
+                    max_recursion_depth,
+                    snapshot_at=started_at,
+                )
+                statuses[status] += 1
 
-        for thread in threads:
-            logger.info(f"Running super agent {agent_class} for thread {thread.id}")
+                completed = statuses.total()
+                if completed % progress_interval == 0 or completed == len(target_threads):
+                    logger.info(f"Super agent {agent_class} progress: {completed}/{len(target_threads)} threads")
 
-            async for chunk in SuperAgentService.call_super_agent(
-                thread.id,
-                agent_class,
-                agent_config,
-                headers,
-                max_recursion_depth,
-            ):
-                logger.info(f"Chunk: {chunk}")
+        await asyncio.gather(*(worker() for _ in range(min(settings.SUPER_AGENT_CONCURRENCY, len(target_threads)))))
+
+        duration = time.monotonic() - started_at
+
+        logger.info(
+            f"Super agent {agent_class} finished {len(target_threads)} threads in {duration:.1f}s "
+            f"({statuses['ok']} ok, {statuses['skipped']} skipped, {statuses['timeout']} timed out, "
+            f"{statuses['error']} failed)"
+        )
+        log_metric("super_agent.job.duration_ms", duration * 1000, agent_class=agent_class)
+        for status in ("ok", "skipped", "timeout", "error"):
+            log_metric("super_agent.job.threads", statuses[status], agent_class=agent_class, status=status)
+
+    @staticmethod
+    async def get_super_agent_threads(
+        agent_class: str,
+        shards: Iterable[int] | None = None,
+        updated_since: datetime | None = None,
+    ) -> list[threads]:
+        """Get the threads a super agent job should run for, including their metadata.
+
+        A user can have many threads, but notifications should only come from their most recent one. This selects
+        the latest thread per `onesignal_id` across all threads in a single query, and keeps it when the agent
+        class has taken part in it.
+
+        Args:
+            agent_class (str): The class of the agent.
+            shards (Iterable[int] | None): Only return threads in these shards, see `ShardCoordinator`.
+            updated_since (datetime | None): Only return threads that were updated after this UTC time.
+        """
+
+        filters = [
+            """
+            EXISTS (
+                SELECT 1 FROM messages
+                WHERE messages.thread_id = latest_threads.id AND messages.agent_class = $1
+            )
+            """
+        ]
+        args: list[str] = [agent_class]
+
+        if shards is not None:
+            shard_list = ", ".join(str(int(shard)) for shard in sorted(shards)) or "NULL"
+            filters.append(f"{shard_sql('latest_threads.id', shard_coordinator.shard_count)} IN ({shard_list})")
+
+        if updated_since is not None:
+            args.append(updated_since.astimezone(UTC).replace(tzinfo=None).isoformat())
+            filters.append(f"latest_threads.updated_at > ${len(args)}::timestamp")
+
+        return await prisma.threads.query_raw(
+            f"""
+            WITH latest_threads AS (
+                SELECT DISTINCT ON (metadata->>'onesignal_id') *
+                FROM threads
+                WHERE metadata->>'onesignal_id' IS NOT NULL
+                ORDER BY metadata->>'onesignal_id', created_at DESC
+            )
+            SELECT latest_threads.*
+            FROM latest_threads
+            WHERE {" AND ".join(filters)}
+            """,
+            *args,
+        )
+
+    @staticmethod
+    async def run_super_agent_for_thread(
+        thread: threads,
+        agent_class: str,
+        agent_config: dict,
+        headers: dict,
+        max_recursion_depth: int,
+        snapshot_at: float | None = None,
+    ) -> str:
+        """Run the super agent for a single thread within its own time budget.
+
+        Errors and timeouts are logged and reported through the returned status instead of raised, so one
+        misbehaving thread cannot take down the rest of the job.
+
+        Args:
+            snapshot_at (float | None): When the thread was read, as `time.monotonic()`. The run is skipped when the
+                thread already finished another run after that, as its metadata may be stale by now.
+
+        Returns:
+            str: `ok`, `skipped`, `timeout` or `error`.
+        """
+
+        lock = SuperAgentService._thread_locks.setdefault(thread.id, asyncio.Lock())
+
+        async with lock:
+            if snapshot_at is not None and SuperAgentService._thread_finished_at.get(thread.id, 0) > snapshot_at:
+                logger.info(f"Thread {thread.id} already ran since it was read, skipping super agent {agent_class}")
+                return "skipped"
+
+            try:
+                return await SuperAgentService._run_super_agent_for_thread(
+                    thread,
+                    agent_class,
+                    agent_config,
+                    headers,
+                    max_recursion_depth,
+                )
+            finally:
+                # Only a job that is running now can have read the thread before this run finished
+                if SuperAgentService._running_snapshots:
+                    SuperAgentService._thread_finished_at[thread.id] = time.monotonic()
+
+    @staticmethod
+    def _prune_thread_finished_at() -> None:
+        """Forget the runs that finished before the oldest running job read its threads, as they cannot make any
+        snapshot stale anymore."""
+
+        if not SuperAgentService._running_snapshots:
+            SuperAgentService._thread_finished_at.clear()
+            return
+
+        oldest_snapshot = min(SuperAgentService._running_snapshots)
+
+        SuperAgentService._thread_finished_at = {
+            thread_id: finished_at
+            for thread_id, finished_at in SuperAgentService._thread_finished_at.items()
+            if finished_at > oldest_snapshot
+        }
+
+    @staticmethod
+    async def _run_super_agent_for_thread(
+        thread: threads,
+        agent_class: str,
+        agent_config: dict,
+        headers: dict,
+        max_recursion_depth: int,
+    ) -> str:
+        logger.info(f"Running super agent {agent_class} for thread {thread.id}")
+
+        started_at = time.monotonic()
+        status = "ok"
+
+        try:
+            async with asyncio.timeout(settings.SUPER_AGENT_THREAD_TIMEOUT_SECONDS):
+                async with aclosing(
+                    SuperAgentService.call_super_agent(
+                        thread.id,
+                        agent_class,
+                        agent_config,
+                        headers,
+                        max_recursion_depth,
+                        thread=thread,
+                    )
+                ) as chunks:
+                    async for chunk in chunks:
+                        logger.debug(f"Chunk: {chunk}")
+        except TimeoutError:
+            status = "timeout"
+            logger.warning(
+                f"Super agent {agent_class} timed out for thread {thread.id} "
+                f"after {settings.SUPER_AGENT_THREAD_TIMEOUT_SECONDS}s"
+            )
+        except Exception as e:
+            status = "error"
+            logger.error(f"Super agent {agent_class} failed for thread {thread.id}: {e}", exc_info=e)
+
+        log_metric(
+            "super_agent.thread.duration_ms",
+            (time.monotonic() - started_at) * 1000,
+            agent_class=agent_class,
+            status=status,
+        )
+
+        return status
 
     @staticmethod
     async def call_super_agent(
@@ -85,6 +301,7 @@ class SuperAgentService:
         agent_config: dict,
         headers: dict,
         max_recursion_depth: int = 15,
+        thread: threads | None = None,
     ) -> AsyncGenerator[MessageContent | MessageResponse, None]:
         """Forward a message to the agent and yield the individual chunks of the response. Will also save the user message and the agent response to the database.
 
@@ -95,6 +312,7 @@ class SuperAgentService:
             agent_config (dict): The config of the agent.
             headers (dict): The headers of the request.
             max_recursion_depth (int): The maximum depth of recursion for the agent.
+            thread (threads | None): The already fetched thread, saves the agent from loading it again.
         Raises:
             AgentNotFoundError: The agent class was not found.
 
@@ -115,6 +333,9 @@ class SuperAgentService:
 
         logger.info(f"Agent {agent_class} loaded")
 
+        if thread is not None:
+            agent.preload_thread(thread)
+
         logger.info("Getting thread history")
 
         # Fetch the thread history including the new user message
@@ -0,0 +1,219 @@
+import uuid
+from datetime import UTC, datetime
+
+from prisma import Prisma
+from prisma.models import thread_memories, thread_notifications, thread_recurring_tasks, thread_reminders
+
+from src.lib.prisma import prisma
+from src.services.super_agent.due_items import DEFAULT_TIMEZONE, parse_datetime
+
+
+class ThreadItemsService:
+    """Memories, reminders, recurring tasks and sent notifications of a thread.
+
+    Each item is a row of its own, so adding one is a single insert instead of a rewrite of the thread metadata.
+    Items are returned as dicts in the shape the agents and their prompts have always used.
+    """
+
+    @staticmethod
+    async def get_memories(thread_id: str, limit: int | None = None, offset: int = 0) -> list[dict]:
+        rows = await prisma.thread_memories.find_many(
+            where={"thread_id": thread_id},
+            order=[{"created_at": "asc"}, {"id": "asc"}],
+            take=limit,
+            skip=offset,
+        )
+
+        return [ThreadItemsService._memory_to_dict(row) for row in rows]
+
+    @staticmethod
+    async def get_memory(thread_id: str, memory_id: str) -> dict | None:
+        row = await prisma.thread_memories.find_first(where={"thread_id": thread_id, "id": memory_id})
+
+        return ThreadItemsService._memory_to_dict(row) if row else None
+
+    @staticmethod
+    async def add_memory(thread_id: str, memory: str) -> dict:
+        row = await prisma.thread_memories.create(
+            data={"id": ThreadItemsService._new_id(), "thread_id": thread_id, "memory": memory}
+        )
+
+        return ThreadItemsService._memory_to_dict(row)
+
+    @staticmethod
+    async def get_reminders(thread_id: str, limit: int | None = None, offset: int = 0) -> list[dict]:
+        rows = await prisma.thread_reminders.find_many(
+            where={"thread_id": thread_id},
+            order=[{"created_at": "asc"}, {"id": "asc"}],
+            take=limit,
+            skip=offset,
+        )
+
+        return [ThreadItemsService._reminder_to_dict(row) for row in rows]
+
+    @staticmethod
+    async def get_reminders_by_thread(thread_ids: list[str]) -> dict[str, list[dict]]:
+        rows = await prisma.thread_reminders.find_many(
+            where={"thread_id": {"in": thread_ids}},
+            order=[{"created_at": "asc"}, {"id": "asc"}],
+        )
+
+        reminders: dict[str, list[dict]] = {thread_id: [] for thread_id in thread_ids}
+
+        for row in rows:
+            reminders[row.thread_id].append(ThreadItemsService._reminder_to_dict(row))
+
+        return reminders
+
+    @staticmethod
+    async def add_reminder(thread_id: str, date: str, message: str) -> dict:
+        async with prisma.tx() as tx:
+            row = await tx.thread_reminders.create(
+                data={
+                    "id": ThreadItemsService._new_id(),
+                    "thread_id": thread_id,
+                    "date": date,
+                    "due_at": parse_datetime(date),
+                    "message": message,
+                }
+            )
+            await ThreadItemsService._touch_thread(tx, thread_id)
+
+        return ThreadItemsService._reminder_to_dict(row)
+
+    @staticmethod
+    async def remove_reminder(thread_id: str, reminder_id: str) -> bool:
+        async with prisma.tx() as tx:
+            deleted = await tx.thread_reminders.delete_many(where={"thread_id": thread_id, "id": reminder_id})
+            await ThreadItemsService._touch_thread(tx, thread_id)
+
+        return deleted > 0
+
+    @staticmethod
+    async def get_recurring_tasks(thread_id: str, limit: int | None = None, offset: int = 0) -> list[dict]:
+        rows = await prisma.thread_recurring_tasks.find_many(
+            where={"thread_id": thread_id},
+            order=[{"created_at": "asc"}, {"id": "asc"}],
+            take=limit,
+            skip=offset,
+        )
+
+        return [ThreadItemsService._recurring_task_to_dict(row) for row in rows]
+
+    @staticmethod
+    async def get_recurring_tasks_by_thread(thread_ids: list[str]) -> dict[str, list[dict]]:
+        rows = await prisma.thread_recurring_tasks.find_many(
+            where={"thread_id": {"in": thread_ids}},
+            order=[{"created_at": "asc"}, {"id": "asc"}],
+        )
+
+        recurring_tasks: dict[str, list[dict]] = {thread_id: [] for thread_id in thread_ids}
+
+        for row in rows:
+            recurring_tasks[row.thread_id].append(ThreadItemsService._recurring_task_to_dict(row))
+
+        return recurring_tasks
+
+    @staticmethod
+    async def add_recurring_task(thread_id: str, cron_expression: str, task: str) -> dict:
+        async with prisma.tx() as tx:
+            row = await tx.thread_recurring_tasks.create(
+                data={
+                    "id": ThreadItemsService._new_id(),
+                    "thread_id": thread_id,
+                    "cron_expression": cron_expression,
+                    "task": task,
+                }
+            )
+            await ThreadItemsService._touch_thread(tx, thread_id)
+
+        return ThreadItemsService._recurring_task_to_dict(row)
+
+    @staticmethod
+    async def remove_recurring_task(thread_id: str, task_id: str) -> bool:
+        async with prisma.tx() as tx:
+            deleted = await tx.thread_recurring_tasks.delete_many(where={"thread_id": thread_id, "id": task_id})
+            await ThreadItemsService._touch_thread(tx, thread_id)
+
+        return deleted > 0
+
+    @staticmethod
+    async def get_notifications(
+        thread_id: str, limit: int | None = None, offset: int = 0, newest_first: bool = False
+    ) -> list[dict]:
+        order = "desc" if newest_first else "asc"
+        rows = await prisma.thread_notifications.find_many(
+            where={"thread_id": thread_id},
+            order=[{"sent_at": order}, {"id": order}],
+            take=limit,
+            skip=offset,
+        )
+
+        return [ThreadItemsService._notification_to_dict(row) for row in rows]
+
+    @staticmethod
+    async def get_last_notifications_by_thread(thread_ids: list[str]) -> dict[str, list[dict]]:
+        """The most recent notification of each thread, as a list of at most one so it fits the due item helpers."""
+
+        rows = await prisma.thread_notifications.find_many(
+            where={"thread_id": {"in": thread_ids}},
+            order=[{"thread_id": "asc"}, {"sent_at": "desc"}],
+            distinct=["thread_id"],
+        )
+
+        notifications: dict[str, list[dict]] = {thread_id: [] for thread_id in thread_ids}
+
+        for row in rows:
+            notifications[row.thread_id] = [ThreadItemsService._notification_to_dict(row)]
+
+        return notifications
+
+    @staticmethod
+    async def add_notification(
+        thread_id: str, notification_id: str, onesignal_id: str | None, title: str, contents: str
+    ) -> dict:
+        row = await prisma.thread_notifications.upsert(
+            where={"thread_id_id": {"thread_id": thread_id, "id": notification_id}},
+            data={
+                "create": {
+                    "id": notification_id,
+                    "thread_id": thread_id,
+                    "onesignal_id": onesignal_id,
+                    "title": title,
+                    "contents": contents,
+                },
+                "update": {},
+            },
+        )
+
+        return ThreadItemsService._notification_to_dict(row)
+
+    @staticmethod
+    async def _touch_thread(tx: Prisma, thread_id: str) -> None:
+        # The reminder jobs are reconciled from the threads that were updated recently
+        await tx.threads.update(where={"id": thread_id}, data={"updated_at": datetime.now(UTC)})
+
+    @staticmethod
+    def _new_id() -> str:
+        return str(uuid.uuid4())[:8]
+
+    @staticmethod
+    def _memory_to_dict(row: thread_memories) -> dict:
+        return {"id": row.id, "memory": row.memory}
+
+    @staticmethod
+    def _reminder_to_dict(row: thread_reminders) -> dict:
+        return {"id": row.id, "date": row.date, "message": row.message}
+
+    @staticmethod
+    def _recurring_task_to_dict(row: thread_recurring_tasks) -> dict:
+        return {"id": row.id, "cron_expression": row.cron_expression, "task": row.task}
+
+    @staticmethod
+    def _notification_to_dict(row: thread_notifications) -> dict:
+        return {
+            "id": row.id,
+            "title": row.title,
+            "contents": row.contents,
+            "sent_at": row.sent_at.astimezone(DEFAULT_TIMEZONE).isoformat(),
+        }
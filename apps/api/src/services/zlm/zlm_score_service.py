@@ -0,0 +1,172 @@
+from statistics import mean
+from typing import Any, Literal
+
+from prisma.models import zlm_scores
+
+from src.lib.prisma import prisma
+from src.models.chart_widget import ChartWidget, ZLMDataRow
+from src.models.zlm import ZLMQuestionnaireAnswers, ZLMScores
+
+# The domains of the Ziektelastmeter in chart order, with their labels. The keys are the columns of `zlm_scores`.
+ZLM_DOMAIN_LABELS: dict[str, dict[str, str]] = {
+    "longklachten": {"nl": "Long klachten", "en": "Lung symptoms"},
+    "longaanvallen": {"nl": "Long aanvallen", "en": "Lung attacks"},
+    "lichamelijke_beperkingen": {"nl": "Lichamelijke beperkingen", "en": "Physical limitations"},
+    "vermoeidheid": {"nl": "Vermoeidheid", "en": "Fatigue"},
+    "nachtrust": {"nl": "Nachtrust", "en": "Sleep"},
+    "gevoelens_emoties": {"nl": "Emoties", "en": "Emotions"},
+    "seksualiteit": {"nl": "Seksualiteit", "en": "Sexuality"},
+    "relaties_en_werk": {"nl": "Relaties en werk", "en": "Relationships and work"},
+    "medicijnen": {"nl": "Medicijnen", "en": "Medication"},
+    "gewicht_bmi": {"nl": "BMI", "en": "BMI"},
+    "bewegen": {"nl": "Bewegen", "en": "Exercise"},
+    "alcohol": {"nl": "Alcohol", "en": "Alcohol"},
+    "roken": {"nl": "Roken", "en": "Smoking"},
+}
+
+QUESTION_CODES = [f"G{i}" for i in range(1, 23)]
+
+
+class ZLMScoreService:
+    """Calculates Ziektelastmeter COPD scores and keeps the score history of a user in `zlm_scores`."""
+
+    @staticmethod
+    def parse_answers(raw_answers: dict[str, Any]) -> ZLMQuestionnaireAnswers:
+        """Validate the stored questionnaire answers, keyed by question code.
+
+        Raises:
+            ValueError: When answers are missing or out of range.
+        """
+
+        missing = [code for code in QUESTION_CODES if raw_answers.get(code) in (None, "", "[not answered]")]
+
+        if missing:
+            raise ValueError("Missing questionnaire answers for: " + ", ".join(missing))
+
+        try:
+            parsed = {
+                **{f"G{i}": int(raw_answers[f"G{i}"]) for i in range(1, 20)},
+                "G20": str(raw_answers["G20"]).strip().lower(),
+                "G21": float(raw_answers["G21"]),
+                "G22": float(raw_answers["G22"]),
+            }
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid questionnaire answer: {e}") from e
+
+        return ZLMQuestionnaireAnswers(**parsed)
+
+    @staticmethod
+    def calculate_scores(answers: ZLMQuestionnaireAnswers) -> tuple[dict[str, float], float]:
+        """The score per domain, in the order of ZLM_DOMAIN_LABELS, and the BMI value."""
+
+        bmi_value = answers.G21 / (answers.G22 / 100.0) ** 2
+
+        scores = {
+            "longklachten": float(mean([answers.G12, answers.G13, answers.G15, answers.G16])),
+            # Lung attacks are answered on a 0-4 scale
+            "longaanvallen": answers.G17 * 1.5,
+            "lichamelijke_beperkingen": float(mean([answers.G5, answers.G6, answers.G7])),
+            "vermoeidheid": float(answers.G1),
+            "nachtrust": float(answers.G2),
+            "gevoelens_emoties": float(mean([answers.G3, answers.G11, answers.G14])),
+            "seksualiteit": float(answers.G10),
+            "relaties_en_werk": float(mean([answers.G8, answers.G9])),
+            "medicijnen": float(answers.G4),
+            "gewicht_bmi": float(ZLMScoreService._bmi_score(bmi_value)),
+            "bewegen": float(answers.G18),
+            "alcohol": float(answers.G19),
+            "roken": float({"nooit": 0, "vroeger": 2, "ja": 6}[answers.G20]),
+        }
+
+        return scores, bmi_value
+
+    @staticmethod
+    async def get_user_id(external_id: str) -> str:
+        user = await prisma.users.upsert(
+            where={"external_id": external_id},
+            data={"create": {"external_id": external_id}, "update": {}},
+        )
+
+        return user.id
+
+    @staticmethod
+    async def save_scores(user_id: str, thread_id: str | None, scores: dict[str, float], bmi_value: float) -> ZLMScores:
+        """Store the scores and return them together with the previous scores of the user."""
+
+        previous = await prisma.zlm_scores.find_first(where={"user_id": user_id}, order={"created_at": "desc"})
+
+        await prisma.zlm_scores.create(
+            data={
+                "user_id": user_id,
+                "thread_id": thread_id,
+                "bmi_value": bmi_value,
+                **{domain: scores[domain] for domain in ZLM_DOMAIN_LABELS},
+            }
+        )
+
+        return ZLMScores(
+            scores=scores,
+            bmi_value=bmi_value,
+            previous_scores=ZLMScoreService._row_scores(previous) if previous else None,
+        )
+
+    @staticmethod
+    async def get_history(user_id: str, limit: int = 10) -> list[zlm_scores]:
+        """The most recent results of a user, newest first."""
+
+        return await prisma.zlm_scores.find_many(where={"user_id": user_id}, order={"created_at": "desc"}, take=limit)
+
+    @staticmethod
+    async def get_latest(user_id: str) -> ZLMScores | None:
+        """The most recent result of a user joined with the one before it, None when there is none."""
+
+        history = await ZLMScoreService.get_history(user_id, limit=2)
+
+        if not history:
+            return None
+
+        return ZLMScores(
+            scores=ZLMScoreService._row_scores(history[0]),
+            bmi_value=history[0].bmi_value,
+            previous_scores=ZLMScoreService._row_scores(history[1]) if len(history) > 1 else None,
+        )
+
+    @staticmethod
+    def to_chart(result: ZLMScores, language: Literal["nl", "en"]) -> ChartWidget:
+        """A balloon chart of the scores, with the previous scores as the old values."""
+
+        previous_scores = result.previous_scores or {}
+
+        return ChartWidget.create_balloon_chart(
+            title="Resultaten ziektelastmeter" if language == "nl" else "Disease burden results",
+            data=[
+                ZLMDataRow(
+                    x_value=labels[language],
+                    y_current=result.scores[domain],
+                    y_old=previous_scores.get(domain),
+                    y_label="Score (0-6)",
+                    meta=f"BMI {result.bmi_value:.1f}" if domain == "gewicht_bmi" else None,
+                )
+                for domain, labels in ZLM_DOMAIN_LABELS.items()
+            ],
+        )
+
+    @staticmethod
+    def _row_scores(row: zlm_scores) -> dict[str, float]:
+        return {domain: getattr(row, domain) for domain in ZLM_DOMAIN_LABELS}
+
+    @staticmethod
+    def _bmi_score(bmi_value: float) -> int:
+        """0 for a healthy BMI of 21 to 25, up to 6 for under- and overweight."""
+
+        if bmi_value < 21:
+            underweight_limits = [18.5, 19, 19.5, 20, 20.5, 21]
+
+            return 6 - next(index for index, limit in enumerate(underweight_limits) if bmi_value < limit)
+
+        if bmi_value < 25:
+            return 0
+
+        overweight_limits = [27, 29, 31, 33, 35]
+
+        return 1 + next((index for index, limit in enumerate(overweight_limits) if bmi_value < limit), 5)
@@ -44,5 +44,71 @@ class Settings(BaseSettings):
     ONESIGNAL_HEALTH_APP_ID: str = Field(default="137356f1-6558-4910-b51e-a9a4bb31a623")
     ONESIGNAL_HEUVEL_APP_ID: str = Field(default="6aafb443-2d4b-4629-9372-2a6d7afae4ee")
 
+    # SSE replay buffer for resumable message streams
+    SSE_REPLAY_MAX_EVENTS: int = Field(default=5000)
+    SSE_REPLAY_RETENTION_SECONDS: float = Field(default=300)
+    SSE_REPLAY_MAX_STREAMS: int = Field(default=1000)
+    # Seconds to wait for a disconnected client to resume before the agent turn is cancelled
+    SSE_DISCONNECT_GRACE_SECONDS: float = Field(default=5)
+
+    # How long an Idempotency-Key on POST /threads/{thread_id}/messages is remembered
+    IDEMPOTENCY_KEY_TTL_SECONDS: float = Field(default=24 * 60 * 60)
+
+    # Number of threads a super agent job processes at the same time, and the time budget per thread
+    SUPER_AGENT_CONCURRENCY: int = Field(default=10)
+    SUPER_AGENT_THREAD_TIMEOUT_SECONDS: float = Field(default=120)
+
+    # Super agent work is sharded across replicas by thread id, each replica leases its shards in Postgres
+    SUPER_AGENT_SHARDS: int = Field(default=16)
+    SUPER_AGENT_LEASE_SECONDS: float = Field(default=30)
+    SUPER_AGENT_LEASE_RENEW_SECONDS: float = Field(default=10)
+
+    # How many memories and notifications the agents put in their system prompt, the rest stays available to tools
+    PROMPT_MEMORIES_MAX_ITEMS: int = Field(default=25)
+    PROMPT_MEMORIES_TOKEN_BUDGET: int = Field(default=1000)
+    PROMPT_NOTIFICATIONS_MAX_ITEMS: int = Field(default=10)
+
+    # Token caps for named sections of the agent system prompts, a section over its cap is cut off at the end
+    PROMPT_SECTION_TOKEN_CAPS: dict[str, int] = Field(
+        default={
+            "current_role_prompt": 12000,
+            "recurring_tasks": 1000,
+            "reminders": 1000,
+            "notifications": 1000,
+            "metadata": 1000,
+        }
+    )
+
+    # The tools whose schemas are sent with every agent request, on top of the ones a role declares. The other tools
+    # are loaded on demand with the tool_load_tools tool
+    TOOL_ROUTER_ENABLED: bool = Field(default=True)
+    TOOL_ROUTER_CORE_TOOLS: list[str] = Field(
+        default=[
+            "tool_noop",
+            "tool_call_super_agent",
+            "tool_set_current_role",
+            "tool_store_memory",
+            "tool_answer_questionaire_question",
+            "tool_ask_multiple_choice",
+        ]
+    )
+
+    # Models that need an explicit cache breakpoint in the system prompt to use provider-side prompt caching
+    PROMPT_CACHE_CONTROL_MODEL_PREFIXES: list[str] = Field(default=["anthropic/"])
+
+    # Timezones with precomputed step totals in health_step_rollups, other timezones are aggregated per query
+    STEPS_ROLLUP_TIMEZONES: list[str] = Field(default=["UTC", "Europe/Amsterdam"])
+    # Step data points written per INSERT statement by POST /steps/sync
+    STEPS_SYNC_CHUNK_SIZE: int = Field(default=5000)
+    # Longest NDJSON line POST /steps/sync/stream accepts, longer lines are rejected
+    STEPS_STREAM_MAX_LINE_BYTES: int = Field(default=64 * 1024)
+
+    # Limits and retries for calls to the OneSignal API
+    ONESIGNAL_MAX_CONCURRENT_REQUESTS: int = Field(default=8)
+    ONESIGNAL_MAX_ATTEMPTS: int = Field(default=4)
+    ONESIGNAL_RETRY_BASE_SECONDS: float = Field(default=0.5)
+    # Notifications with the same content sent within this window go out as one request, 0 disables batching
+    ONESIGNAL_BATCH_WINDOW_SECONDS: float = Field(default=0.25)
+
 
 settings = Settings()  # type: ignore
@@ -0,0 +1,109 @@
+import base64
+from datetime import datetime
+from typing import Any, Literal, Protocol
+
+from pydantic import BaseModel
+
+Order = Literal["asc", "desc"]
+
+
+class KeysetRow(Protocol):
+    created_at: datetime
+    id: str
+
+
+class Cursor(BaseModel):
+    """A position in a list ordered by `(created_at, id)`, and whether to read the page after or before it."""
+
+    created_at: datetime
+    id: str
+    direction: Literal["next", "prev"] = "next"
+
+
+def encode_cursor(created_at: datetime, row_id: str, direction: Literal["next", "prev"]) -> str:
+    cursor = Cursor(created_at=created_at, id=row_id, direction=direction)
+
+    return base64.urlsafe_b64encode(cursor.model_dump_json().encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Parse a cursor from `encode_cursor`, raises a ValueError when it is not one."""
+
+    try:
+        return Cursor.model_validate_json(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def reading_order(order: Order, cursor: Cursor | None) -> Order:
+    """The order to read rows in, pages before a cursor are read backwards and reversed afterwards."""
+
+    if cursor is not None and cursor.direction == "prev":
+        return "asc" if order == "desc" else "desc"
+
+    return order
+
+
+def keyset_order(order: Order, cursor: Cursor | None) -> list[dict[str, Any]]:
+    direction = reading_order(order, cursor)
+
+    return [{"created_at": direction}, {"id": direction}]
+
+
+def keyset_where(order: Order, cursor: Cursor) -> dict[str, Any]:
+    """A Prisma filter for the rows that come after the cursor in the order they are read in.
+
+    The bound on `created_at` alone is implied by the `OR`, but it lets Postgres seek to the cursor in the
+    `(created_at, id)` index instead of filtering every row before it.
+    """
+
+    operator = "gt" if reading_order(order, cursor) == "asc" else "lt"
+
+    return {
+        "created_at": {f"{operator}e": cursor.created_at},
+        "OR": [
+            {"created_at": {operator: cursor.created_at}},
+            {"created_at": cursor.created_at, "id": {operator: cursor.id}},
+        ],
+    }
+
+
+def keyset_page[T: KeysetRow](
+    rows: list[T], limit: int, cursor: Cursor | None, has_previous: bool = False
+) -> tuple[list[T], str | None, str | None]:
+    """Turn the rows of a keyset query into a page and the cursors of the pages after and before it.
+
+    Args:
+        rows: Up to `limit + 1` rows in reading order, the extra row only tells there is more.
+        limit: The page size.
+        cursor: The cursor the rows were read from, None for the first page or an offset page.
+        has_previous: Whether there are rows before the first one without a cursor, e.g. because of an offset.
+
+    Returns:
+        The rows of the page in the requested order, the next cursor and the previous cursor.
+    """
+
+    has_more = len(rows) > limit
+    page = rows[:limit]
+
+    if cursor is not None and cursor.direction == "prev":
+        page.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None or has_previous
+
+    if not page:
+        # Nothing left in this direction, the way back starts at the cursor itself
+        if cursor is None:
+            return page, None, None
+
+        back = "next" if cursor.direction == "prev" else "prev"
+        back_cursor = encode_cursor(cursor.created_at, cursor.id, back)
+
+        return page, back_cursor if back == "next" else None, back_cursor if back == "prev" else None
+
+    first, last = page[0], page[-1]
+    next_cursor = encode_cursor(last.created_at, last.id, "next") if has_next else None
+    prev_cursor = encode_cursor(first.created_at, first.id, "prev") if has_prev else None
+
+    return page, next_cursor, prev_cursor
@@ -0,0 +1,105 @@
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable
+
+from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
+
+from src.utils.tokens import estimate_tokens
+
+WORD_PATTERN = re.compile(r"\w{3,}")
+
+# A memory this many memories older than the newest one gets half its recency score
+RECENCY_HALF_LIFE = 20
+
+# How much a full match with the user message counts compared to being the newest memory
+SIMILARITY_WEIGHT = 2.0
+
+
+def last_user_message_text(messages: Iterable[ChatCompletionMessageParam]) -> str:
+    """Get the text of the most recent user message, an empty string when there is none."""
+
+    for message in reversed(list(messages)):
+        if message.get("role") != "user":
+            continue
+
+        content = message.get("content")
+
+        if isinstance(content, str):
+            return content
+
+        return " ".join(
+            part.get("text", "") for part in content or [] if isinstance(part, dict) and part.get("type") == "text"
+        )
+
+    return ""
+
+
+def format_memory(memory: dict) -> str:
+    return f"- {memory['id']}: {memory['memory']}"
+
+
+def select_memories(memories: list[dict], query: str, max_items: int, token_budget: int) -> list[dict]:
+    """Pick the memories that are most worth putting in the prompt.
+
+    Every memory is scored on how recent it is and on the words it shares with `query`, where rare words count for
+    more than words that appear in many memories. The best scoring memories are taken for as long as they fit in
+    `max_items` and `token_budget`.
+
+    Args:
+        memories: The memories of the thread, oldest first.
+        query: The text to rank against, usually the latest user message.
+        max_items: The maximum number of memories to return.
+        token_budget: The maximum estimated number of tokens of the formatted memories.
+
+    Returns:
+        The selected memories, oldest first.
+    """
+
+    memory_words = [set(WORD_PATTERN.findall(memory["memory"].lower())) for memory in memories]
+    query_words = set(WORD_PATTERN.findall(query.lower()))
+
+    document_frequency = Counter(word for words in memory_words for word in words & query_words)
+    inverse_document_frequency = {
+        word: math.log(1 + len(memories) / frequency) for word, frequency in document_frequency.items()
+    }
+    max_similarity = sum(inverse_document_frequency.values()) or 1.0
+
+    scores = []
+
+    for index, words in enumerate(memory_words):
+        recency = 0.5 ** ((len(memories) - 1 - index) / RECENCY_HALF_LIFE)
+        similarity = sum(inverse_document_frequency[word] for word in words & query_words) / max_similarity
+        scores.append(recency + SIMILARITY_WEIGHT * similarity)
+
+    selected: list[int] = []
+    used_tokens = 0
+
+    for index in sorted(range(len(memories)), key=lambda index: scores[index], reverse=True):
+        if len(selected) >= max_items:
+            break
+
+        tokens = estimate_tokens(format_memory(memories[index]))
+
+        # A long memory that doesn't fit shouldn't keep the shorter ones after it out
+        if used_tokens + tokens > token_budget:
+            continue
+
+        selected.append(index)
+        used_tokens += tokens
+
+    return [memories[index] for index in sorted(selected)]
+
+
+def format_memories(selected_memories: list[dict], total: int) -> str:
+    """Render the selected memories for a prompt, noting how many were left out."""
+
+    if total == 0:
+        return "<no memories>"
+
+    lines = [format_memory(memory) for memory in selected_memories]
+
+    if len(selected_memories) < total:
+        lines.append(f"({total - len(selected_memories)} older or less relevant memories not shown)")
+
+    return "\n".join(lines)
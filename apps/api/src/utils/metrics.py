@@ -0,0 +1,15 @@
+from src.logger import logger
+
+
+def log_metric(name: str, value: float, **tags: str | int | float | bool | None) -> None:
+    """Emit a metric as a single structured log line, e.g. `metric super_agent.thread.duration_ms=812.4 status=ok`.
+
+    Args:
+        name: Dotted name of the metric.
+        value: Numeric value of the metric.
+        **tags: Dimensions to attach to the metric.
+    """
+
+    formatted_tags = " ".join(f"{key}={tag}" for key, tag in tags.items() if tag is not None)
+
+    logger.info(f"metric {name}={round(value, 3)} {formatted_tags}".rstrip())
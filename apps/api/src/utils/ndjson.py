@@ -0,0 +1,37 @@
+from collections.abc import AsyncGenerator, AsyncIterable
+
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterable[bytes], max_line_bytes: int
+) -> AsyncGenerator[tuple[int, bytes | None], None]:
+    """Split a stream of bytes into NDJSON lines without holding more than one line in memory.
+
+    Yields `(line_number, line)` pairs, numbered from 1 by their position in the stream. Blank lines are skipped but
+    still counted. A line longer than `max_line_bytes` is dropped while it streams in and yielded as None, so the caller
+    can reject it and carry on with the next line.
+    """
+
+    buffer = b""
+    line_number = 0
+    oversized = False
+
+    async for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+
+        for line in lines:
+            line_number += 1
+
+            if oversized or len(line) > max_line_bytes:
+                oversized = False
+                yield line_number, None
+            elif line.strip():
+                yield line_number, line
+
+        if len(buffer) > max_line_bytes:
+            buffer = b""
+            oversized = True
+
+    if oversized:
+        yield line_number + 1, None
+    elif buffer.strip():
+        yield line_number + 1, buffer
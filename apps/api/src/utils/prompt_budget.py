@@ -0,0 +1,116 @@
+import json
+from collections.abc import Iterable
+
+from openai.types.chat import ChatCompletionToolParam
+
+from src.utils.metrics import log_metric
+from src.utils.tokens import estimate_tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` down to about `max_tokens`, at the last line break that fits when there is one, and say so."""
+
+    max_length = max_tokens * 4
+    cut = text[:max_length]
+    line_break = cut.rfind("\n")
+
+    if line_break > 0:
+        cut = cut[:line_break]
+
+    return f"{cut}\n[truncated {estimate_tokens(text) - estimate_tokens(cut)} tokens]"
+
+
+class PromptBudget:
+    """Token estimates for the named sections of a system prompt and for the tool schemas sent along with it.
+
+    Sections with a cap are truncated to it, always from the end, so the same input gives the same prompt.
+    """
+
+    def __init__(self, caps: dict[str, int] | None = None) -> None:
+        self.caps = caps or {}
+        self.sections: dict[str, int] = {}
+        self.truncated_sections: set[str] = set()
+        self.tools: dict[str, int] = {}
+        self.system_prompt_tokens = 0
+
+    @property
+    def tool_tokens(self) -> int:
+        return sum(self.tools.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.system_prompt_tokens + self.tool_tokens
+
+    def section(self, name: str, text: str) -> str:
+        """Record a section of the prompt and return its text, truncated when it goes over the cap for `name`."""
+
+        cap = self.caps.get(name)
+
+        if cap is not None and estimate_tokens(text) > cap:
+            text = truncate_to_tokens(text, cap)
+            self.truncated_sections.add(name)
+
+        self.sections[name] = self.sections.get(name, 0) + estimate_tokens(text)
+
+        return text
+
+    def sections_from(self, format_args: dict[str, str], group: str | None = None) -> dict[str, str]:
+        """Record every value of a dict of prompt placeholders as a section, or all of them together as `group`.
+
+        Grouped values are counted but never truncated.
+        """
+
+        if group is not None:
+            self.sections[group] = self.sections.get(group, 0) + sum(
+                estimate_tokens(str(value)) for value in format_args.values()
+            )
+
+            return {name: str(value) for name, value in format_args.items()}
+
+        return {name: self.section(name, str(value)) for name, value in format_args.items()}
+
+    def system_prompt(self, text: str) -> None:
+        self.system_prompt_tokens = estimate_tokens(text)
+
+    def tool_schemas(self, schemas: Iterable[ChatCompletionToolParam]) -> list[ChatCompletionToolParam]:
+        schemas = list(schemas)
+
+        for schema in schemas:
+            self.tools[schema["function"]["name"]] = estimate_tokens(json.dumps(schema))
+
+        return schemas
+
+    def log_metrics(self, **tags: str) -> None:
+        for name, tokens in self.sections.items():
+            log_metric("prompt.section.tokens", tokens, section=name, truncated=name in self.truncated_sections, **tags)
+
+        for name, tokens in self.tools.items():
+            log_metric("prompt.tool.tokens", tokens, tool=name, **tags)
+
+        log_metric("prompt.system.tokens", self.system_prompt_tokens, **tags)
+        log_metric("prompt.tools.tokens", self.tool_tokens, tools=len(self.tools), **tags)
+        log_metric("prompt.total.tokens", self.total_tokens, **tags)
+
+    def headers(self) -> dict[str, str]:
+        """Debug response headers with the estimates, largest first, e.g. `system=5210, tools=3822, memories=640`.
+
+        Truncated sections are marked with a `*`.
+        """
+
+        def format_counts(counts: dict[str, int]) -> str:
+            return ", ".join(
+                f"{name}={tokens}" for name, tokens in sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            )
+
+        return {
+            "X-Prompt-Budget": format_counts(
+                {"total": self.total_tokens, "system": self.system_prompt_tokens, "tools": self.tool_tokens}
+            ),
+            "X-Prompt-Budget-Sections": format_counts(
+                {
+                    f"{name}*" if name in self.truncated_sections else name: tokens
+                    for name, tokens in self.sections.items()
+                }
+            ),
+            "X-Prompt-Budget-Tools": format_counts(self.tools),
+        }
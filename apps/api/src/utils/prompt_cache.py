@@ -0,0 +1,56 @@
+from openai.types.chat import ChatCompletionSystemMessageParam
+
+from src.settings import settings
+
+# System prompt placeholders whose values change from turn to turn. They are kept out of the cacheable prefix of the
+# system prompt and rendered in a suffix after it instead.
+VOLATILE_SECTIONS = ("current_time", "recurring_tasks", "reminders", "memories", "notifications", "metadata")
+
+
+def volatile_placeholder(name: str) -> str:
+    return f"[{name}: see the current context at the end of this prompt]"
+
+
+def split_volatile_sections(format_args: dict[str, str]) -> tuple[dict[str, str], dict[str, str]]:
+    """Split system prompt placeholders into stable values, with the volatile ones pointing to the suffix, and the
+    volatile values themselves."""
+
+    stable_args = {
+        name: volatile_placeholder(name) if name in VOLATILE_SECTIONS else value for name, value in format_args.items()
+    }
+    volatile_args = {name: format_args[name] for name in VOLATILE_SECTIONS if name in format_args}
+
+    return stable_args, volatile_args
+
+
+def format_volatile_suffix(prefix: str, volatile_args: dict[str, str]) -> str:
+    """The volatile values the prefix refers to, in a fixed order, or an empty string when it refers to none."""
+
+    sections = [f"## {name}\n{value}" for name, value in volatile_args.items() if volatile_placeholder(name) in prefix]
+
+    if not sections:
+        return ""
+
+    return "\n\n".join(["# Current context", *sections])
+
+
+def supports_cache_control(model: str) -> bool:
+    return model.startswith(tuple(settings.PROMPT_CACHE_CONTROL_MODEL_PREFIXES))
+
+
+def system_message(prefix: str, suffix: str, model: str) -> ChatCompletionSystemMessageParam:
+    """The system message with a cache breakpoint after the stable prefix for models that need one.
+
+    Providers cache the tools and the system prompt up to the breakpoint, so it covers the tool schemas too. Models
+    that cache prefixes automatically get the prefix and suffix as a single text.
+    """
+
+    if not supports_cache_control(model):
+        return {"role": "system", "content": "\n\n".join(part for part in (prefix, suffix) if part)}
+
+    content: list[dict] = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+
+    if suffix:
+        content.append({"type": "text", "text": suffix})
+
+    return {"role": "system", "content": content}  # type: ignore
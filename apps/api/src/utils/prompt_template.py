@@ -0,0 +1,43 @@
+import re
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Any
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([^}]+)\}\}")
+
+
+class PromptTemplate:
+    """A prompt with `{{placeholder}}` style placeholders, parsed into literal text and placeholder segments once.
+
+    Placeholders without a value render as `[missing:name]`. Values are inserted as is, placeholders inside them are
+    not substituted.
+    """
+
+    def __init__(self, template: str) -> None:
+        parts = PLACEHOLDER_PATTERN.split(template)
+
+        # `split` with a capturing group alternates literal text and placeholder names, starting with literal text
+        self.literals = parts[0::2]
+        self.placeholders = parts[1::2]
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        parts = [self.literals[0]]
+
+        for name, literal in zip(self.placeholders, self.literals[1:], strict=True):
+            parts.append(str(values[name]) if name in values else f"[missing:{name}]")
+            parts.append(literal)
+
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(template: str) -> PromptTemplate:
+    """Parse a template, cached by its text so the same role and system prompts are only parsed once per process."""
+
+    return PromptTemplate(template)
+
+
+def render_template(template: str, values: Mapping[str, Any]) -> str:
+    """Substitute the `{{placeholder}}` style placeholders in `template` with `values` in a single pass."""
+
+    return compile_template(template).render(values)
@@ -1,2 +1,5 @@
-def create_sse_event(event: str, data: str) -> str:
+def create_sse_event(event: str, data: str, event_id: str | None = None) -> str:
+    if event_id is not None:
+        return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
     return f"event: {event}\ndata: {data}\n\n"
@@ -0,0 +1,4 @@
+def estimate_tokens(text: str) -> int:
+    """Rough token count for prompt budgeting, about 4 characters per token for English and Dutch text."""
+
+    return (len(text) + 3) // 4
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import re
+from collections.abc import Callable
+from typing import Any
+
+from src.settings import settings
+from src.utils.function_to_openai_tool import function_to_openai_tool
+
+LOAD_TOOLS_TOOL_NAME = "tool_load_tools"
+CALL_LOADED_TOOL_TOOL_NAME = "tool_call_loaded_tool"
+
+
+def tool_summary(tool: Callable) -> str:
+    """The first line of the docstring of a tool."""
+
+    for line in (tool.__doc__ or "").splitlines():
+        if line.strip():
+            return line.strip()
+
+    return ""
+
+
+def make_load_tools_tool(tools: list[Callable]) -> Callable:
+    """A meta-tool the model can call to get the schemas of tools that were not sent with the request.
+
+    The schemas come back as a tool result, so they end up in the conversation after the cache breakpoint instead of
+    changing the tool schemas that are sent with every request.
+    """
+
+    available_tools = {tool.__name__: tool for tool in tools}
+
+    def tool_load_tools(names: list[str]) -> str:
+        loaded = [available_tools[name] for name in names if name in available_tools]
+        unknown = [name for name in names if name not in available_tools]
+
+        if not loaded:
+            return f"No tools loaded, unknown tools: {', '.join(unknown)}"
+
+        schemas = json.dumps([function_to_openai_tool(tool)["function"] for tool in loaded], default=str)
+        result = f"Loaded tools, call them with {CALL_LOADED_TOOL_TOOL_NAME}:\n{schemas}"
+
+        if unknown:
+            result += f"\nUnknown tools: {', '.join(unknown)}"
+
+        return result
+
+    # The catalog only depends on the tools of the role, so the schema stays the same from turn to turn
+    catalog = "\n".join(f"- {name}: {tool_summary(tool)}" for name, tool in sorted(available_tools.items()))
+    tool_load_tools.__doc__ = (
+        "Load tools that are not available to you yet. Call this tool with the names of the tools you need to get "
+        f"their parameters, then call them with {CALL_LOADED_TOOL_TOOL_NAME}.\n\nTools:\n{catalog}"
+    )
+
+    return tool_load_tools
+
+
+def make_call_loaded_tool_tool(tools: list[Callable]) -> Callable:
+    """A meta-tool that calls a tool loaded with the load tools meta-tool, so its schema never has to be sent."""
+
+    available_tools = {tool.__name__: tool for tool in tools}
+
+    async def tool_call_loaded_tool(name: str, arguments: dict) -> Any:
+        """Call a tool that was loaded with tool_load_tools.
+
+        Args:
+            name (str): The name of the tool.
+            arguments (dict): The arguments of the tool, as described by the parameters tool_load_tools returned.
+        """
+
+        tool = available_tools.get(name)
+
+        if tool is None:
+            raise ValueError(f"Tool {name} not found, load it with {LOAD_TOOLS_TOOL_NAME} first")
+
+        return await tool(**arguments) if asyncio.iscoroutinefunction(tool) else tool(**arguments)
+
+    return tool_call_loaded_tool
+
+
+def route_tools(tools: list[Callable], loaded_tools_regex: str | None = None) -> tuple[list[Callable], list[Callable]]:
+    """Pick the tools whose schemas are sent to the model with every request of a role.
+
+    The selection only depends on the role, so the tool schemas, which come before the system prompt in the prompt
+    cache, are the same on every turn and every step. Roles that opt in with `loaded_tools_regex` get the always-on
+    core tools, the tools matching the regex and two meta-tools. The model loads the schemas of the other tools with
+    tool_load_tools and calls them with tool_call_loaded_tool. Other roles get all of their tools.
+
+    Args:
+        tools: The tools the current role is allowed to use.
+        loaded_tools_regex: A regular expression for the tools of the role whose schemas are always sent, None to
+            send all of them.
+
+    Returns:
+        The tools to send schemas for, in their original order, and the tools that may be called.
+    """
+
+    if not settings.TOOL_ROUTER_ENABLED or loaded_tools_regex is None:
+        return tools, tools
+
+    on_demand_tools = [
+        tool
+        for tool in tools
+        if tool.__name__ not in settings.TOOL_ROUTER_CORE_TOOLS
+        and not (loaded_tools_regex and re.match(loaded_tools_regex, tool.__name__))
+    ]
+
+    if not on_demand_tools:
+        return tools, tools
+
+    meta_tools = [make_load_tools_tool(on_demand_tools), make_call_loaded_tool_tool(on_demand_tools)]
+    routed_tools = [tool for tool in tools if tool not in on_demand_tools]
+
+    return [*routed_tools, *meta_tools], [*tools, *meta_tools]
@@ -0,0 +1,51 @@
+from pydantic import BaseModel
+
+from src.agents.questionnaire_engine import find_question, last_multiple_choice_widget, match_choice, next_question
+from src.models.multiple_choice_widget import Choice, MultipleChoiceWidget
+
+SCALE = [{"label": "Nooit", "value": "0"}, {"label": "Soms", "value": "3"}, {"label": "Altijd", "value": "6"}]
+
+
+class Question(BaseModel):
+    question: str
+    instructions: str | list[dict[str, str]]
+    name: str
+
+
+QUESTIONS = [
+    Question(question="Hoe vaak was u kortademig?", instructions=SCALE, name="G1"),
+    Question(question="Hoe vaak hoestte u?", instructions=SCALE, name="G2"),
+    Question(question="Hoe lang bent u?", instructions="Vraag de lengte in meters", name="G21"),
+]
+
+
+def conversation(widget: MultipleChoiceWidget, reply: str) -> list[dict]:
+    return [
+        {"role": "assistant", "content": "", "tool_calls": []},
+        {"role": "tool", "tool_call_id": "call_1", "content": widget.model_dump_json()},
+        {"role": "user", "content": reply},
+    ]
+
+
+def test_a_pick_from_the_last_widget_is_matched_to_its_question():
+    widget = MultipleChoiceWidget(question="Was u de afgelopen week kortademig?", choices=[Choice(**c) for c in SCALE])
+    messages = conversation(widget, " soms ")
+
+    assert last_multiple_choice_widget(messages) == widget
+    assert match_choice(widget, messages[-1]["content"]) == Choice(label="Soms", value="3")
+    assert find_question(QUESTIONS, widget, {}) is QUESTIONS[0]
+    assert find_question(QUESTIONS, widget, {"G1": "3"}) is QUESTIONS[1]
+
+
+def test_free_text_replies_are_left_to_the_model():
+    widget = MultipleChoiceWidget(question=QUESTIONS[0].question, choices=[Choice(**c) for c in SCALE])
+
+    assert match_choice(widget, "Dat weet ik eigenlijk niet") is None
+    assert last_multiple_choice_widget([{"role": "user", "content": "Soms"}]) is None
+
+
+def test_next_question_skips_answered_questions():
+    answers = {"G1": "3", "G2": "6"}
+
+    assert next_question(QUESTIONS, answers, after=QUESTIONS[0]) is QUESTIONS[2]
+    assert next_question(QUESTIONS, {**answers, "G21": "1.80"}, after=QUESTIONS[0]) is None
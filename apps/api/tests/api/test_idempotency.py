@@ -0,0 +1,49 @@
+import asyncio
+from collections.abc import AsyncGenerator
+
+import pytest
+
+from src.api.messages import publish_message_stream, track_idempotent_messages
+from src.services.messages.idempotency_store import idempotency_store
+from src.services.messages.message_stream import message_streams
+
+
+async def run_until_cancelled(started: asyncio.Event) -> AsyncGenerator[None, None]:
+    started.set()
+    await asyncio.Event().wait()
+    yield
+
+
+async def run_to_completion() -> AsyncGenerator[None, None]:
+    return
+    yield
+
+
+@pytest.mark.asyncio
+async def test_a_disconnected_run_can_be_retried_with_the_same_key():
+    record = idempotency_store.put("thread", "disconnected", "fingerprint", "stream")
+    message_stream = message_streams.create("thread")
+    started = asyncio.Event()
+
+    task = asyncio.create_task(
+        publish_message_stream(message_stream, track_idempotent_messages(record, run_until_cancelled(started)))
+    )
+    await started.wait()
+
+    # What the disconnect grace period does when no client comes back
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert idempotency_store.get("thread", "disconnected", "fingerprint") is None
+
+
+@pytest.mark.asyncio
+async def test_a_completed_run_is_replayed():
+    record = idempotency_store.put("thread", "completed", "fingerprint", "stream")
+    message_stream = message_streams.create("thread")
+
+    await publish_message_stream(message_stream, track_idempotent_messages(record, run_to_completion()))
+
+    assert idempotency_store.get("thread", "completed", "fingerprint") is record
@@ -51,12 +51,6 @@ async def test_failing_chat():
         "G20": "vroeger",
         "G21": "75",
         "G22": "180",
-        "memories": [
-            {
-                "id": "cca85f83",
-                "memory": "Gebruiker heeft contact gemaakt en is begonnen met onboarding proces op 2025-06-02 23:12:33",
-            }
-        ],
         "current_role": "ZLMuitslag",
         "onesignal_id": "staging2-9",
         "assistant_field_name": "mumc-xi-12",
@@ -76,6 +70,18 @@ async def test_failing_chat():
         },
     )
 
+    await prisma.thread_memories.upsert(
+        where={"thread_id_id": {"thread_id": thread.id, "id": "cca85f83"}},
+        data={
+            "create": {
+                "id": "cca85f83",
+                "thread_id": thread.id,
+                "memory": "Gebruiker heeft contact gemaakt en is begonnen met onboarding proces op 2025-06-02 23:12:33",
+            },
+            "update": {},
+        },
+    )
+
     message_df = pd.read_csv(os.path.join(os.path.dirname(__file__), "messages_rows.csv"))
 
     # Parse the date columns as datetime objects
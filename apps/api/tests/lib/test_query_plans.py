@@ -0,0 +1,137 @@
+import json
+import uuid
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+import pytest
+from dotenv import load_dotenv
+from prisma import Json
+from prisma.enums import health_data_point_type, health_data_unit, health_platform
+
+from src.lib.prisma import create_expression_indexes, prisma
+
+load_dotenv()
+
+# The hot queries of the API, with the ids of the seeded rows filled in
+HOT_QUERIES = {
+    "messages_of_thread": "SELECT * FROM messages WHERE thread_id = '{thread_id}'::uuid ORDER BY created_at ASC",
+    "messages_page_by_cursor": """
+        SELECT * FROM messages
+        WHERE thread_id = '{thread_id}'::uuid
+          AND created_at >= '2026-01-01'
+          AND (created_at > '2026-01-01' OR (created_at = '2026-01-01' AND id > '{message_id}'::uuid))
+        ORDER BY created_at ASC, id ASC
+        LIMIT 21
+    """,
+    "threads_page_by_cursor": """
+        SELECT * FROM threads
+        WHERE created_at <= '2026-01-01'
+          AND (created_at < '2026-01-01' OR (created_at = '2026-01-01' AND id < '{thread_id}'::uuid))
+        ORDER BY created_at DESC, id DESC
+        LIMIT 21
+    """,
+    "contents_of_messages": """
+        SELECT * FROM message_contents
+        WHERE message_id IN ('{message_id}'::uuid)
+        ORDER BY created_at ASC, type ASC
+    """,
+    "document_by_path": "SELECT * FROM documents WHERE path = '{document_path}' LIMIT 1",
+    "documents_by_file_name": "SELECT * FROM documents WHERE file_name IN ('{document_file_name}')",
+    "steps_in_range": """
+        SELECT * FROM health_data_points
+        WHERE user_id = '{user_id}'::uuid AND type = 'steps' AND date_from >= '2026-01-01' AND date_from <= '2026-02-01'
+        ORDER BY date_from ASC
+    """,
+    "last_synced_steps": """
+        SELECT * FROM health_data_points
+        WHERE user_id = '{user_id}'::uuid AND type = 'steps'
+        ORDER BY date_to DESC
+        LIMIT 1
+    """,
+    "latest_thread_per_onesignal_id": """
+        SELECT DISTINCT ON (metadata->>'onesignal_id') *
+        FROM threads
+        WHERE metadata->>'onesignal_id' IS NOT NULL
+        ORDER BY metadata->>'onesignal_id', created_at DESC
+    """,
+}
+
+
+@pytest.fixture
+async def seeded_ids():
+    if not prisma.is_connected():
+        await prisma.connect()
+
+    await create_expression_indexes()
+
+    key = str(uuid.uuid4())
+    user = await prisma.users.create(data={"external_id": f"query-plans-{key}"})
+    thread = await prisma.threads.create(data={"metadata": Json({"onesignal_id": f"query-plans-{key}"})})
+    message = await prisma.messages.create(
+        data={"thread_id": thread.id, "agent_class": "QueryPlans", "contents": {"create": [{"text": "Hello"}]}}
+    )
+    document = await prisma.documents.create(
+        data={
+            "file_name": f"{key}.pdf",
+            "path": f"query-plans/{key}.pdf",
+            "content": Json({}),
+            "summary": "",
+            "subject": "",
+        }
+    )
+
+    start = datetime(2026, 1, 1, tzinfo=UTC)
+    await prisma.health_data_points.create_many(
+        data=[
+            {
+                "user_id": user.id,
+                "type": health_data_point_type.steps,
+                "value": 100,
+                "unit": health_data_unit.COUNT,
+                "date_from": start + timedelta(minutes=15 * i),
+                "date_to": start + timedelta(minutes=15 * i + 5),
+                "source_uuid": f"query-plans-{key}-{i}",
+                "health_platform": health_platform.apple_health,
+            }
+            for i in range(100)
+        ]
+    )
+
+    yield {
+        "user_id": user.id,
+        "thread_id": thread.id,
+        "message_id": message.id,
+        "document_path": document.path,
+        "document_file_name": document.file_name,
+    }
+
+    await prisma.documents.delete(where={"id": document.id})
+    await prisma.threads.delete(where={"id": thread.id})
+    await prisma.users.delete(where={"id": user.id})
+
+
+def seq_scans(plan: dict[str, Any]) -> list[str]:
+    """The tables a query plan reads with a sequential scan."""
+
+    tables = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+
+    for child in plan.get("Plans", []):
+        tables.extend(seq_scans(child))
+
+    return tables
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", HOT_QUERIES)
+async def test_hot_queries_use_an_index(seeded_ids: dict[str, str], name: str):
+    # With sequential scans disabled, the planner only picks one when there is no usable index
+    async with prisma.tx() as tx:
+        await tx.execute_raw("SET LOCAL enable_seqscan = off")
+        rows = await tx.query_raw(f"EXPLAIN (FORMAT JSON) {HOT_QUERIES[name].format(**seeded_ids)}")
+
+    plan = rows[0]["QUERY PLAN"]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    assert seq_scans(plan[0]["Plan"]) == []
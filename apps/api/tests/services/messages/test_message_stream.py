@@ -0,0 +1,54 @@
+import pytest
+
+from src.services.messages.message_stream import MessageStream, StreamReplayWindowExceededError
+
+
+def make_stream() -> MessageStream:
+    return MessageStream(thread_id="thread", max_events=3, disconnect_grace_seconds=5)
+
+
+@pytest.mark.asyncio
+async def test_subscriber_receives_replayed_and_live_events():
+    stream = make_stream()
+    stream.publish("delta", "1")
+
+    events = stream.subscribe()
+    assert "data: 1" in await anext(events)
+
+    stream.publish("delta", "2")
+    stream.finish()
+
+    remaining = [event async for event in events]
+
+    assert len(remaining) == 1
+    assert "data: 2" in remaining[0]
+
+
+@pytest.mark.asyncio
+async def test_lagging_subscriber_is_not_served_a_gap():
+    stream = make_stream()
+    stream.publish("delta", "1")
+
+    events = stream.subscribe()
+    assert "data: 1" in await anext(events)
+
+    # Events 2 and 3 are evicted before the subscriber reads them
+    for data in ["2", "3", "4", "5"]:
+        stream.publish("delta", data)
+
+    remaining = [event async for event in events]
+
+    assert len(remaining) == 1
+    assert "event: replay_window_exceeded" in remaining[0]
+    assert stream.event_id(1) in remaining[0]
+
+
+@pytest.mark.asyncio
+async def test_resuming_before_the_replay_window_fails():
+    stream = make_stream()
+
+    for data in ["1", "2", "3", "4", "5"]:
+        stream.publish("delta", data)
+
+    with pytest.raises(StreamReplayWindowExceededError):
+        await anext(stream.subscribe(last_sequence=1))
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from onesignal.exceptions import ApiException
+from onesignal.model.notification import Notification
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ReadTimeoutError
+
+from src.services.one_signal import one_signal_service
+from src.services.one_signal.one_signal_service import OneSignalService
+from src.settings import settings
+
+
+class FakeApi:
+    """Stands in for the synchronous SDK client, failing with the queued errors before it succeeds."""
+
+    def __init__(self, errors: list[Exception] | None = None) -> None:
+        self.errors = list(errors or [])
+        self.sent: list[list[str]] = []
+
+    def create_notification(self, notification: Notification) -> dict:
+        if self.errors:
+            raise self.errors.pop(0)
+
+        self.sent.append(list(notification.include_external_user_ids))
+
+        return {"id": f"notification-{len(self.sent)}"}
+
+
+def make_service(monkeypatch: pytest.MonkeyPatch, api: FakeApi) -> OneSignalService:
+    monkeypatch.setitem(OneSignalService._api_instances, "test-key", api)
+    monkeypatch.setattr(OneSignalService, "_pending_batches", {})
+
+    return OneSignalService(api_key="test-key", app_id="app")
+
+
+def make_notification(external_user_id: str, contents: str = "Hello") -> Notification:
+    return Notification(
+        app_id="app",
+        include_external_user_ids=[external_user_id],
+        contents={"en": contents},
+    )
+
+
+def rate_limited(retry_after: str | None = None) -> ApiException:
+    error = ApiException(status=429, reason="Too Many Requests")
+    error.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+
+    return error
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    """Record retry delays instead of waiting for them."""
+
+    delays: list[float] = []
+
+    async def sleep(delay: float) -> None:
+        delays.append(delay)
+
+    monkeypatch.setattr(settings, "ONESIGNAL_BATCH_WINDOW_SECONDS", 0)
+    monkeypatch.setattr(one_signal_service.asyncio, "sleep", sleep)
+
+    return delays
+
+
+@pytest.mark.asyncio
+async def test_notifications_with_the_same_content_are_sent_together(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "ONESIGNAL_BATCH_WINDOW_SECONDS", 0.01)
+    api = FakeApi()
+    service = make_service(monkeypatch, api)
+
+    responses = await asyncio.gather(
+        service.send_notification(make_notification("a")),
+        service.send_notification(make_notification("b")),
+        service.send_notification(make_notification("a")),
+        service.send_notification(make_notification("c", contents="Bye")),
+    )
+
+    assert sorted(api.sent) == [["a", "b"], ["c"]]
+    assert responses[0] is responses[1] is responses[2]
+    assert responses[3] is not responses[0]
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_wait_for_retry_after(monkeypatch: pytest.MonkeyPatch, sleeps: list[float]):
+    api = FakeApi(errors=[rate_limited("3"), rate_limited("1")])
+
+    response = await make_service(monkeypatch, api).send_notification(make_notification("a"))
+
+    assert response == {"id": "notification-1"}
+    assert sleeps == [3.0, 1.0]
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_without_retry_after_back_off_with_jitter(
+    monkeypatch: pytest.MonkeyPatch, sleeps: list[float]
+):
+    monkeypatch.setattr(settings, "ONESIGNAL_RETRY_BASE_SECONDS", 1.0)
+    monkeypatch.setattr(one_signal_service.random, "uniform", lambda low, high: high)
+    api = FakeApi(errors=[rate_limited(), rate_limited()])
+
+    await make_service(monkeypatch, api).send_notification(make_notification("a"))
+
+    assert sleeps == [1.5, 3.0]
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_give_up_after_the_last_attempt(
+    monkeypatch: pytest.MonkeyPatch, sleeps: list[float]
+):
+    monkeypatch.setattr(settings, "ONESIGNAL_MAX_ATTEMPTS", 2)
+    api = FakeApi(errors=[rate_limited("1"), rate_limited("1"), rate_limited("1")])
+
+    with pytest.raises(ApiException):
+        await make_service(monkeypatch, api).send_notification(make_notification("a"))
+
+    assert sleeps == [1.0]
+    assert api.sent == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [400, 500, 503])
+async def test_errors_that_may_have_sent_the_notification_are_not_retried(
+    monkeypatch: pytest.MonkeyPatch, sleeps: list[float], status: int
+):
+    api = FakeApi(errors=[ApiException(status=status, reason="Error")])
+
+    with pytest.raises(ApiException):
+        await make_service(monkeypatch, api).send_notification(make_notification("a"))
+
+    assert sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_read_timeouts_are_not_retried(monkeypatch: pytest.MonkeyPatch, sleeps: list[float]):
+    api = FakeApi(errors=[ReadTimeoutError(None, "/notifications", "Read timed out")])
+
+    with pytest.raises(ReadTimeoutError):
+        await make_service(monkeypatch, api).send_notification(make_notification("a"))
+
+    assert sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_refused_connections_are_retried(monkeypatch: pytest.MonkeyPatch, sleeps: list[float]):
+    refused = NewConnectionError(None, "Connection refused")
+    api = FakeApi(errors=[MaxRetryError(None, "/notifications", refused)])
+
+    assert await make_service(monkeypatch, api).send_notification(make_notification("a")) == {"id": "notification-1"}
+    assert len(sleeps) == 1
+
+
+def test_every_event_loop_gets_its_own_semaphore():
+    async def get_semaphore() -> asyncio.Semaphore:
+        return OneSignalService._get_semaphore()
+
+    assert asyncio.run(get_semaphore()) is not asyncio.run(get_semaphore())
@@ -0,0 +1,103 @@
+import uuid
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from dotenv import load_dotenv
+from prisma.enums import health_data_unit, health_platform
+
+from src.lib.prisma import prisma
+from src.services.steps.steps_service import StepsService
+from src.settings import settings
+
+
+@pytest.mark.parametrize(
+    ("aggregation", "expected"),
+    [(None, "day"), ("", "day"), ("Hourly", "hour"), ("15m", "quarter"), ("raw", "none")],
+)
+def test_normalise_aggregation(aggregation: str | None, expected: str):
+    assert StepsService.normalise_aggregation(aggregation) == expected
+
+
+def test_invalid_aggregation():
+    with pytest.raises(ValueError, match="Invalid aggregation"):
+        StepsService.normalise_aggregation("weekly")
+
+
+def test_a_single_local_day_covers_the_whole_day():
+    tz = StepsService.resolve_timezone("Europe/Amsterdam")
+    year = datetime.now(tz).year + 1
+
+    date_from, date_to = StepsService.resolve_range(f"{year}-07-01T00:00:00", f"{year}-07-01T00:00:00", tz)
+
+    assert date_from == datetime(year, 6, 30, 22, tzinfo=UTC)
+    assert date_to == datetime(year, 7, 1, 21, 59, 59, 999999, tzinfo=UTC)
+
+
+@pytest.mark.parametrize(
+    ("aggregation", "timezone", "expected"),
+    [
+        ("day", "Europe/Amsterdam", datetime(2026, 6, 30, 22, tzinfo=UTC)),
+        ("hour", "Asia/Kolkata", datetime(2026, 7, 1, 9, 30, tzinfo=UTC)),
+        ("quarter", "UTC", datetime(2026, 7, 1, 10, 0, tzinfo=UTC)),
+    ],
+)
+def test_bucket_floor_is_aligned_to_local_time(aggregation: str, timezone: str, expected: datetime):
+    value = datetime(2026, 7, 1, 10, 7, 30, tzinfo=UTC)
+
+    assert StepsService._bucket_floor(value, aggregation, StepsService.resolve_timezone(timezone)) == expected
+
+
+@pytest.fixture
+async def user_id():
+    load_dotenv()
+
+    if not prisma.is_connected():
+        await prisma.connect()
+
+    user = await prisma.users.create(data={"external_id": f"steps-service-{uuid.uuid4()}"})
+
+    yield user.id
+
+    await prisma.users.delete(where={"id": user.id})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("aggregation", ["quarter", "hour", "day"])
+async def test_rollups_and_data_points_agree_on_partial_buckets(
+    monkeypatch: pytest.MonkeyPatch, user_id: str, aggregation: str
+):
+    tz = StepsService.resolve_timezone("Europe/Amsterdam")
+    start = datetime(datetime.now(tz).year, 7, 1, 6, tzinfo=tz)
+
+    # A data point every 5 minutes for two days
+    await StepsService.upsert_data_points(
+        user_id,
+        [
+            {
+                "source_uuid": f"{user_id}-{i}",
+                "value": i + 1,
+                "unit": health_data_unit.COUNT,
+                "date_from": start + timedelta(minutes=5 * i),
+                "date_to": start + timedelta(minutes=5 * i + 4),
+                "health_platform": health_platform.apple_health,
+                "source_device_id": None,
+                "source_id": None,
+                "source_name": None,
+            }
+            for i in range(2 * 24 * 12)
+        ],
+    )
+
+    date_from = start + timedelta(hours=2, minutes=20)
+    date_to = start + timedelta(days=1, hours=3, minutes=40)
+
+    from_rollups = await StepsService.get_steps(user_id, date_from, date_to, tz.key, aggregation)
+
+    monkeypatch.setattr(settings, "STEPS_ROLLUP_TIMEZONES", [])
+    from_data_points = await StepsService.get_steps(user_id, date_from, date_to, tz.key, aggregation)
+
+    raw_data_points = await StepsService.get_steps(user_id, date_from, date_to, tz.key, "none", limit=1000)
+
+    assert from_rollups == from_data_points
+    assert sum(bucket["value"] for bucket in from_rollups) == sum(range(2 * 12 + 4 + 1, (24 + 3) * 12 + 8 + 2))
+    assert sum(data_point["value"] for data_point in raw_data_points) == sum(bucket["value"] for bucket in from_rollups)
@@ -0,0 +1,92 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from src.services.super_agent.due_items import (
+    DEFAULT_TIMEZONE,
+    get_due_recurring_tasks,
+    get_due_reminders,
+    parse_datetime,
+)
+
+# 12:00 in Amsterdam, 10:00 UTC
+NOW = DEFAULT_TIMEZONE.localize(datetime(2026, 7, 1, 12, 0))
+
+
+def sent_at(value: datetime) -> list[dict]:
+    return [{"id": "notification", "sent_at": value.isoformat()}]
+
+
+def test_naive_dates_are_local_time():
+    assert parse_datetime("2026-07-01T12:00:00") == NOW
+    assert parse_datetime("2026-07-01T10:00:00+00:00") == NOW
+
+
+def test_invalid_dates_are_none():
+    assert parse_datetime("tomorrow") is None
+    assert parse_datetime("") is None
+
+
+def test_reminders_are_due_once_their_date_has_passed():
+    reminders = [
+        {"id": "past", "date": "2026-07-01T11:00:00"},
+        {"id": "now", "date": "2026-07-01T10:00:00Z"},
+        {"id": "future", "date": "2026-07-01T12:30:00"},
+        {"id": "invalid", "date": "later"},
+    ]
+
+    assert [reminder["id"] for reminder in get_due_reminders(reminders, [], NOW)] == ["past", "now"]
+
+
+def test_reminders_before_the_last_notification_are_not_due():
+    reminders = [{"id": "before", "date": "2026-07-01T11:00:00"}, {"id": "after", "date": "2026-07-01T11:45:00"}]
+
+    # A notification at 11:30 Amsterdam time, stored in UTC
+    notifications = sent_at(datetime(2026, 7, 1, 9, 30, tzinfo=UTC))
+
+    assert [reminder["id"] for reminder in get_due_reminders(reminders, notifications, NOW)] == ["after"]
+
+
+def test_a_notification_at_the_reminder_date_counts_as_sent():
+    reminders = [{"id": "reminder", "date": "2026-07-01T11:00:00"}]
+
+    assert get_due_reminders(reminders, sent_at(NOW - timedelta(hours=1)), NOW) == []
+
+
+@pytest.mark.parametrize(
+    ("cron_expression", "due"),
+    [
+        ("30 11 * * *", True),  # Fired 30 minutes ago
+        ("0 12 * * *", True),  # Fires right now
+        ("0 11 * * *", False),  # Fired exactly at the start of the lookback window, which is exclusive
+        ("0 10 * * *", False),  # Fired before the lookback window
+        ("30 12 * * *", False),  # Fires later today
+    ],
+)
+def test_recurring_tasks_are_due_within_the_lookback_window(cron_expression: str, due: bool):
+    tasks = [{"id": "task", "cron_expression": cron_expression}]
+
+    assert bool(get_due_recurring_tasks(tasks, [], NOW)) is due
+
+
+def test_the_window_starts_at_the_last_notification():
+    tasks = [
+        {"id": "before", "cron_expression": "15 11 * * *"},
+        {"id": "at", "cron_expression": "30 11 * * *"},
+        {"id": "after", "cron_expression": "45 11 * * *"},
+    ]
+    notifications = sent_at(NOW - timedelta(minutes=30))
+
+    assert [task["id"] for task in get_due_recurring_tasks(tasks, notifications, NOW)] == ["after"]
+
+
+def test_an_older_notification_does_not_widen_the_window():
+    tasks = [{"id": "task", "cron_expression": "0 9 * * *"}]
+
+    assert get_due_recurring_tasks(tasks, sent_at(NOW - timedelta(days=1)), NOW) == []
+
+
+def test_invalid_cron_expressions_are_skipped():
+    tasks = [{"id": "invalid", "cron_expression": "every day"}, {"id": "valid", "cron_expression": "30 11 * * *"}]
+
+    assert [task["id"] for task in get_due_recurring_tasks(tasks, [], NOW)] == ["valid"]
@@ -0,0 +1,107 @@
+import uuid
+
+import pytest
+from dotenv import load_dotenv
+
+from src.lib.prisma import prisma
+from src.services.super_agent.shard_coordinator import ShardCoordinator, shard_for_thread, shard_sql
+
+load_dotenv()
+
+SHARD_COUNT = 8
+
+
+@pytest.fixture(autouse=True)
+async def scheduler_tables():
+    if not prisma.is_connected():
+        await prisma.connect()
+
+    await prisma.scheduler_leases.delete_many()
+    await prisma.scheduler_replicas.delete_many()
+
+    yield
+
+    await prisma.scheduler_leases.delete_many()
+    await prisma.scheduler_replicas.delete_many()
+
+
+def all_shards() -> set[int]:
+    return set(range(SHARD_COUNT))
+
+
+@pytest.mark.asyncio
+async def test_single_replica_owns_all_shards():
+    replica = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-a")
+
+    await replica.heartbeat()
+
+    assert replica.owned_shards == all_shards()
+
+
+@pytest.mark.asyncio
+async def test_shards_are_split_between_replicas_without_overlap():
+    replica_a = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-a")
+    replica_b = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-b")
+
+    await replica_a.heartbeat()
+    await replica_b.heartbeat()
+
+    # Replica b has to wait until replica a hands its shards over
+    assert replica_a.owned_shards == all_shards()
+    assert replica_b.owned_shards == set()
+
+    await replica_a.heartbeat()
+    await replica_b.heartbeat()
+
+    assert replica_a.owned_shards & replica_b.owned_shards == set()
+    assert replica_a.owned_shards | replica_b.owned_shards == all_shards()
+    assert len(replica_a.owned_shards) == len(replica_b.owned_shards) == SHARD_COUNT // 2
+
+
+@pytest.mark.asyncio
+async def test_shards_of_a_dead_replica_are_taken_over():
+    replica_a = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-a")
+    replica_b = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-b")
+
+    await replica_a.heartbeat()
+    await replica_b.heartbeat()
+    await replica_a.heartbeat()
+    await replica_b.heartbeat()
+
+    # Replica b stops sending heartbeats and its leases run out
+    await prisma.execute_raw(
+        "UPDATE scheduler_replicas SET heartbeat_at = now() - interval '1 hour' WHERE id = $1", "replica-b"
+    )
+    await prisma.execute_raw(
+        "UPDATE scheduler_leases SET expires_at = now() - interval '1 second' WHERE owner = $1", "replica-b"
+    )
+
+    await replica_a.heartbeat()
+
+    assert replica_a.owned_shards == all_shards()
+    assert [replica.id for replica in await prisma.scheduler_replicas.find_many()] == ["replica-a"]
+
+
+@pytest.mark.asyncio
+async def test_stopped_replica_hands_back_its_shards():
+    replica_a = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-a")
+    replica_b = ShardCoordinator(shard_count=SHARD_COUNT, lease_seconds=30, replica_id="replica-b")
+
+    await replica_a.heartbeat()
+    await replica_b.heartbeat()
+
+    await replica_a.stop()
+    await replica_b.heartbeat()
+
+    assert replica_a.owned_shards == set()
+    assert replica_b.owned_shards == all_shards()
+
+
+@pytest.mark.asyncio
+async def test_shard_sql_matches_shard_for_thread():
+    thread_ids = [str(uuid.uuid4()) for _ in range(50)]
+
+    for thread_id in thread_ids:
+        rows = await prisma.query_raw(f"SELECT {shard_sql('$1::uuid', SHARD_COUNT)} AS shard", thread_id)
+
+        assert rows[0]["shard"] == shard_for_thread(thread_id, SHARD_COUNT)
@@ -0,0 +1,56 @@
+import pytest
+from dotenv import load_dotenv
+
+from src.lib.prisma import prisma
+from src.services.thread_items.thread_items_service import ThreadItemsService
+
+load_dotenv()
+
+
+@pytest.fixture
+async def thread_id():
+    if not prisma.is_connected():
+        await prisma.connect()
+
+    thread = await prisma.threads.create(data={})
+
+    yield thread.id
+
+    await prisma.threads.delete(where={"id": thread.id})
+
+
+@pytest.mark.asyncio
+async def test_memories_are_returned_in_the_order_they_were_stored(thread_id: str):
+    first = await ThreadItemsService.add_memory(thread_id, "first")
+    second = await ThreadItemsService.add_memory(thread_id, "second")
+
+    assert await ThreadItemsService.get_memories(thread_id) == [first, second]
+    assert await ThreadItemsService.get_memories(thread_id, limit=1, offset=1) == [second]
+    assert await ThreadItemsService.get_memory(thread_id, first["id"]) == first
+    assert await ThreadItemsService.get_memory(thread_id, "missing") is None
+
+
+@pytest.mark.asyncio
+async def test_reminders_resolve_their_due_date_and_touch_the_thread(thread_id: str):
+    before = await prisma.threads.find_unique_or_raise(where={"id": thread_id})
+
+    reminder = await ThreadItemsService.add_reminder(thread_id, "2025-01-01T09:00:00", "Take a walk")
+
+    row = await prisma.thread_reminders.find_first_or_raise(where={"thread_id": thread_id})
+    after = await prisma.threads.find_unique_or_raise(where={"id": thread_id})
+
+    assert reminder == {"id": row.id, "date": "2025-01-01T09:00:00", "message": "Take a walk"}
+    # Naive dates are in Europe/Amsterdam, which is UTC+1 in winter
+    assert row.due_at is not None and row.due_at.isoformat().startswith("2025-01-01T08:00:00")
+    assert after.updated_at > before.updated_at
+
+    assert await ThreadItemsService.remove_reminder(thread_id, reminder["id"])
+    assert await ThreadItemsService.get_reminders_by_thread([thread_id]) == {thread_id: []}
+
+
+@pytest.mark.asyncio
+async def test_last_notification_per_thread(thread_id: str):
+    await ThreadItemsService.add_notification(thread_id, "notification-1", "user-1", "Hi", "First")
+    last = await ThreadItemsService.add_notification(thread_id, "notification-2", "user-1", "Hi", "Second")
+
+    assert await ThreadItemsService.get_last_notifications_by_thread([thread_id]) == {thread_id: [last]}
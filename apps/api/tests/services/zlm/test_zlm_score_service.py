@@ -0,0 +1,30 @@
+import pytest
+
+from src.services.zlm.zlm_score_service import ZLM_DOMAIN_LABELS, ZLMScoreService
+
+
+def make_answers(**overrides: str) -> dict[str, str]:
+    return {**{f"G{i}": "2" for i in range(1, 20)}, "G20": "vroeger", "G21": "80", "G22": "180", **overrides}
+
+
+def test_scores_are_calculated_for_every_domain():
+    scores, bmi_value = ZLMScoreService.calculate_scores(ZLMScoreService.parse_answers(make_answers(G17="4")))
+
+    assert list(scores) == list(ZLM_DOMAIN_LABELS)
+    assert scores["longaanvallen"] == 6.0
+    assert scores["roken"] == 2.0
+    assert round(bmi_value, 1) == 24.7
+    assert scores["gewicht_bmi"] == 0.0
+
+
+@pytest.mark.parametrize(
+    ("bmi_value", "score"),
+    [(18.0, 6), (20.7, 1), (23.0, 0), (25.5, 1), (28.0, 2), (34.0, 5), (40.0, 6)],
+)
+def test_bmi_score(bmi_value: float, score: int):
+    assert ZLMScoreService._bmi_score(bmi_value) == score
+
+
+def test_missing_answers_are_reported():
+    with pytest.raises(ValueError, match="G3, G21"):
+        ZLMScoreService.parse_answers(make_answers(G3="[not answered]", G21=""))
@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from src.utils.cursor import decode_cursor, encode_cursor, keyset_page, keyset_where
+
+
+@dataclass
+class Row:
+    id: str
+    created_at: datetime
+
+
+START = datetime(2026, 1, 1, tzinfo=UTC)
+ROWS = [Row(id=f"{i:02d}", created_at=START + timedelta(minutes=i)) for i in range(10)]
+
+
+def test_cursor_round_trip():
+    cursor = decode_cursor(encode_cursor(START, "01", "prev"))
+
+    assert (cursor.created_at, cursor.id, cursor.direction) == (START, "01", "prev")
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", encode_cursor(START, "01", "next")[:-4]])
+def test_invalid_cursor(cursor: str):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_rows_are_read_away_from_the_cursor():
+    cursor = decode_cursor(encode_cursor(START, "01", "prev"))
+
+    assert keyset_where("asc", cursor)["created_at"] == {"lte": START}
+    assert keyset_where("asc", cursor)["OR"][0] == {"created_at": {"lt": START}}
+    assert keyset_where("desc", cursor)["OR"][1] == {"created_at": START, "id": {"gt": "01"}}
+
+
+def test_first_page():
+    page, next_cursor, prev_cursor = keyset_page(ROWS[:4], 3, None)
+
+    assert [row.id for row in page] == ["00", "01", "02"]
+    assert prev_cursor is None
+    assert decode_cursor(next_cursor or "").id == "02"
+
+
+def test_page_before_a_cursor_is_reversed():
+    cursor = decode_cursor(encode_cursor(ROWS[5].created_at, ROWS[5].id, "prev"))
+
+    page, next_cursor, prev_cursor = keyset_page([ROWS[4], ROWS[3]], 3, cursor)
+
+    assert [row.id for row in page] == ["03", "04"]
+    assert prev_cursor is None
+    assert decode_cursor(next_cursor or "").id == "04"
+
+
+def test_empty_page_points_back_at_the_cursor():
+    cursor = decode_cursor(encode_cursor(ROWS[9].created_at, ROWS[9].id, "next"))
+
+    page, next_cursor, prev_cursor = keyset_page([], 3, cursor)
+
+    assert page == []
+    assert next_cursor is None
+    assert decode_cursor(prev_cursor or "").direction == "prev"
@@ -0,0 +1,41 @@
+from src.utils.memory_selection import format_memories, last_user_message_text, select_memories
+
+
+def make_memories(count: int) -> list[dict]:
+    return [{"id": str(index), "memory": f"Talked about the weather on day {index}"} for index in range(count)]
+
+
+def test_relevant_old_memory_beats_recent_ones():
+    memories = make_memories(100)
+    memories[3] = {"id": "3", "memory": "Walks the dog Bello every morning"}
+
+    selected = select_memories(memories, "How is Bello doing?", max_items=5, token_budget=1000)
+
+    assert [memory["id"] for memory in selected] == ["3", "96", "97", "98", "99"]
+
+
+def test_without_a_query_the_most_recent_memories_are_selected():
+    memories = make_memories(10)
+
+    assert select_memories(memories, "", max_items=3, token_budget=1000) == memories[-3:]
+
+
+def test_token_budget_is_respected():
+    memories = make_memories(50)
+
+    selected = select_memories(memories, "", max_items=50, token_budget=40)
+
+    assert 0 < len(selected) < 50
+    assert format_memories(selected, len(memories)).endswith(
+        f"({50 - len(selected)} older or less relevant memories not shown)"
+    )
+
+
+def test_last_user_message_text_reads_text_parts():
+    messages = [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "reply"},
+        {"role": "user", "content": [{"type": "text", "text": "second"}, {"type": "image_url", "image_url": {}}]},
+    ]
+
+    assert last_user_message_text(messages) == "second"
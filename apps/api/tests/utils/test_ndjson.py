@@ -0,0 +1,26 @@
+from collections.abc import AsyncGenerator
+
+from src.utils.ndjson import iter_ndjson_lines
+
+
+async def stream(*chunks: bytes) -> AsyncGenerator[bytes, None]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_lines_are_split_across_chunks():
+    lines = [line async for line in iter_ndjson_lines(stream(b'{"a": 1}\n{"b"', b": 2}\n\n", b'{"c": 3}'), 100)]
+
+    assert lines == [(1, b'{"a": 1}'), (2, b'{"b": 2}'), (4, b'{"c": 3}')]
+
+
+async def test_oversized_lines_are_yielded_as_none():
+    lines = [line async for line in iter_ndjson_lines(stream(b"x" * 8, b"x" * 8, b'xx\n{"a": 1}\n', b"y" * 20), 10)]
+
+    assert lines == [(1, None), (2, b'{"a": 1}'), (3, None)]
+
+
+async def test_oversized_lines_within_a_single_chunk_are_yielded_as_none():
+    lines = [line async for line in iter_ndjson_lines(stream(b'{"a": 1}\n' + b"x" * 20 + b'\n\n{"b": 2}\n'), 10)]
+
+    assert lines == [(1, b'{"a": 1}'), (2, None), (4, b'{"b": 2}')]
@@ -0,0 +1,39 @@
+from src.utils.prompt_budget import PromptBudget, truncate_to_tokens
+
+
+def test_sections_over_their_cap_are_truncated_at_a_line_break():
+    budget = PromptBudget({"reminders": 10})
+    reminders = "\n".join(f"- reminder {index}" for index in range(20))
+
+    format_args = budget.sections_from({"reminders": reminders, "current_role": "Coach"})
+
+    assert format_args["reminders"] == truncate_to_tokens(reminders, 10)
+    assert format_args["reminders"].startswith("- reminder 0\n- reminder 1\n")
+    assert "[truncated" in format_args["reminders"]
+    assert format_args["current_role"] == "Coach"
+    assert budget.truncated_sections == {"reminders"}
+
+
+def test_grouped_sections_are_counted_but_not_truncated():
+    budget = PromptBudget({"questionnaire": 1})
+
+    format_args = budget.sections_from(
+        {"questionnaire_q1": "a" * 40, "questionnaire_q2": "b" * 40}, group="questionnaire"
+    )
+
+    assert format_args == {"questionnaire_q1": "a" * 40, "questionnaire_q2": "b" * 40}
+    assert budget.sections == {"questionnaire": 20}
+    assert budget.truncated_sections == set()
+
+
+def test_headers_list_tools_and_mark_truncated_sections():
+    budget = PromptBudget({"memories": 1})
+    budget.section("memories", "x" * 100)
+    budget.system_prompt("y" * 400)
+    budget.tool_schemas([{"type": "function", "function": {"name": "tool_create_bar_chart", "parameters": {}}}])
+
+    headers = budget.headers()
+
+    assert headers["X-Prompt-Budget"].startswith("total=")
+    assert headers["X-Prompt-Budget-Sections"].startswith("memories*=")
+    assert headers["X-Prompt-Budget-Tools"].startswith("tool_create_bar_chart=")
@@ -0,0 +1,21 @@
+from src.utils.prompt_template import compile_template, render_template
+
+
+def test_placeholders_are_substituted_and_missing_ones_marked():
+    template = "Hi {{name}}, it is {{current_time}}. {{name}} answered {{questionaire_age_answer}}."
+
+    assert (
+        render_template(template, {"name": "Anna", "current_time": "12:00"})
+        == "Hi Anna, it is 12:00. Anna answered [missing:questionaire_age_answer]."
+    )
+
+
+def test_values_are_not_substituted_again():
+    assert render_template("{{a}} {{b}}", {"a": "{{b}}", "b": 1}) == "{{b}} 1"
+
+
+def test_templates_are_compiled_once():
+    template = "Only {{one}} placeholder"
+
+    assert compile_template(template) is compile_template(template)
+    assert render_template("No placeholders", {"unused": "x"}) == "No placeholders"
@@ -0,0 +1,87 @@
+import pytest
+
+from src.utils.function_to_openai_tool import function_to_openai_tool
+from src.utils.tool_router import route_tools
+
+
+def tool_noop() -> None:
+    """Do nothing."""
+
+
+def tool_store_memory(memory: str) -> str:
+    """Store a memory."""
+
+    return memory
+
+
+def tool_get_steps_data(date_from: str, date_to: str) -> list:
+    """Retrieve a user's step counts."""
+
+    return []
+
+
+def tool_create_bar_chart(data: list) -> str:
+    """Create a bar chart."""
+
+    return ""
+
+
+def tool_add_reminder(date: str, message: str) -> str:
+    """Add a reminder."""
+
+    return ""
+
+
+TOOLS = [tool_noop, tool_store_memory, tool_get_steps_data, tool_create_bar_chart, tool_add_reminder]
+
+
+def names(tools: list) -> list[str]:
+    return [tool.__name__ for tool in tools]
+
+
+def test_only_the_core_and_declared_tools_are_sent():
+    routed_tools, callable_tools = route_tools(TOOLS, r"tool_get_steps_data")
+
+    assert names(routed_tools) == [
+        "tool_noop",
+        "tool_store_memory",
+        "tool_get_steps_data",
+        "tool_load_tools",
+        "tool_call_loaded_tool",
+    ]
+    assert names(callable_tools) == [*names(TOOLS), "tool_load_tools", "tool_call_loaded_tool"]
+
+
+def test_roles_without_a_regex_get_all_their_tools():
+    routed_tools, callable_tools = route_tools(TOOLS)
+
+    assert routed_tools == TOOLS
+    assert callable_tools == TOOLS
+
+
+def test_the_sent_schemas_do_not_change_between_requests():
+    first, _ = route_tools(TOOLS, r"tool_create_bar_chart")
+    second, _ = route_tools(TOOLS, r"tool_create_bar_chart")
+
+    assert [function_to_openai_tool(tool) for tool in first] == [function_to_openai_tool(tool) for tool in second]
+
+
+def test_loaded_tools_are_returned_as_schemas():
+    routed_tools, _ = route_tools(TOOLS, r"tool_create_bar_chart")
+    load_tools = next(tool for tool in routed_tools if tool.__name__ == "tool_load_tools")
+
+    result = load_tools(["tool_add_reminder", "tool_unknown"])
+
+    assert '"name": "tool_add_reminder"' in result
+    assert "Unknown tools: tool_unknown" in result
+
+
+@pytest.mark.asyncio
+async def test_loaded_tools_are_called_through_the_meta_tool():
+    routed_tools, _ = route_tools(TOOLS, r"tool_create_bar_chart")
+    call_loaded_tool = next(tool for tool in routed_tools if tool.__name__ == "tool_call_loaded_tool")
+
+    assert await call_loaded_tool("tool_get_steps_data", {"date_from": "", "date_to": ""}) == []
+
+    with pytest.raises(ValueError, match="not found"):
+        await call_loaded_tool("tool_noop", {})